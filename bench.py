@@ -0,0 +1,357 @@
+import builtins
+import dio
+import datetime
+import json
+import list_recs
+import multiprocessing
+import os
+import os.path
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import click
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+"""
+Benchmarks for the hot paths. Not tests, these take a while
+
+Run like `python bench.py roster-load` or `python bench.py suite --baseline bench_baseline.json`
+or `python bench.py startup` or `python bench.py latency`
+"""
+
+# a date that's an emailing day for the default schedule, and inside a three times period
+BENCH_DATE = datetime.date(2019, 1, 4)
+
+def make_peeps(num_peeps: int) -> Iterator[dio.Person]:
+    rng = random.Random(num_peeps)
+    for peep_idx in range(num_peeps):
+        yield dio.Person(name="peep{}".format(peep_idx),
+                         salt=str(rng.randint(int(1e30), int(9e30))))
+
+def make_dio_dir(num_peeps: int, notes_per_peep: int=0, notes_depth: int=1) -> dio.DioDir:
+    """
+    Synthetic dio dir in a tempdir.
+    Notes go in nested folders inside the peep folders, like the readme tells folks to do
+    """
+    dio_dir = dio.DioDir(tempfile.mkdtemp(prefix="dio_bench_"))
+    dio.batch_save(dio_dir, make_peeps(num_peeps))
+    if notes_per_peep:
+        for peep_dirname in dio.Person.iter_dirs(dio_dir):
+            notes_dirname = os.path.join(peep_dirname, *(["notes"] * notes_depth))
+            os.makedirs(notes_dirname, exist_ok=True)
+            for note_idx in range(notes_per_peep):
+                with open(os.path.join(notes_dirname, "note{}.txt".format(note_idx)), "w") as note_file:
+                    note_file.write("talked about the weather\n")
+    return dio_dir
+
+def time_it(fn: Callable[[], object], repeats: int=3) -> float:
+    """ best of a few, in seconds """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+class OpenCounter(object):
+    """
+    Counts files opened, through an audit hook.
+    Audit hooks can't be taken off again, so it's one per process and switched on and off
+    """
+    def __init__(self) -> None:
+        self.counting = False
+        self.count = 0
+        if hasattr(sys, "addaudithook"):
+            sys.addaudithook(self.hook)
+
+    def hook(self, event: str, args: Any) -> None:
+        if self.counting and event == "open":
+            self.count += 1
+
+    def measure(self, fn: Callable[[], object]) -> Optional[int]:
+        if not hasattr(sys, "addaudithook"):
+            return None
+        self.count = 0
+        self.counting = True
+        try:
+            fn()
+        finally:
+            self.counting = False
+        return self.count
+
+CASE_NAMES = [
+    "get_all",
+    "roster_load",
+    "get_recs",
+    "default_should_contact",
+    "roster_contacts_for",
+    "three_times_should_contact",
+    "list_all_recs",
+    "batchadd",
+]
+
+def get_cases(dio_dir: dio.DioDir) -> Dict[str, Callable[[], object]]:
+    default_sched = dio.DefaultSchedule()
+    three_times_sched = dio.ThreeTimesSchedule()
+    roster = dio.Person.get_all(dio_dir)
+    compact_roster = dio.Roster.from_people(roster)
+    def batchadd() -> None:
+        batch_dio_dir = dio.DioDir(tempfile.mkdtemp(prefix="dio_bench_batch_"))
+        try:
+            dio.batch_save(batch_dio_dir, make_peeps(len(roster)))
+        finally:
+            shutil.rmtree(batch_dio_dir.dirname)
+    return {
+        "get_all": lambda: dio.Person.get_all(dio_dir),
+        "roster_load": lambda: dio.Roster.load(dio_dir),
+        "get_recs": lambda: dio.get_recs(dio_dir, default_sched, BENCH_DATE),
+        "default_should_contact": lambda: [peep for peep in roster
+                                           if default_sched.should_contact(peep, BENCH_DATE)],
+        "roster_contacts_for": lambda: default_sched.contacts_for(compact_roster, BENCH_DATE),
+        "three_times_should_contact": lambda: [peep for peep in roster
+                                               if three_times_sched.should_contact(peep, BENCH_DATE)],
+        "list_all_recs": lambda: list_recs.list_all_recs(dio_dir, default_sched, BENCH_DATE.year),
+        "batchadd": batchadd,
+    }
+
+def run_case(dirname: str, case_name: str, repeats: int) -> Dict[str, Any]:
+    """
+    Runs in its own fresh process, so peak RSS means something
+    """
+    dio_dir = dio.DioDir(dirname)
+    case = get_cases(dio_dir)[case_name]
+    open_counter = OpenCounter()
+    # warm up the index, and the counting
+    files_opened = open_counter.measure(case)
+    wall_secs = time_it(case, repeats=repeats)
+    return {
+        "wall_secs": wall_secs,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "files_opened": files_opened,
+    }
+
+def compare_to_baseline(results: Dict[str, Dict[str, Any]],
+                        baseline: Dict[str, Dict[str, Any]],
+                        tolerance: float) -> List[str]:
+    """
+    Regressions, as messages. Wall time and RSS get some slack, file opens don't
+    """
+    res = []
+    for key, curr in sorted(results.items()):
+        if key not in baseline:
+            continue
+        prev = baseline[key]
+        for metric in ("wall_secs", "peak_rss_kb"):
+            if curr[metric] > prev[metric] * (1 + tolerance):
+                res.append("{} {}: {} -> {}".format(key, metric, prev[metric], curr[metric]))
+        if curr["files_opened"] is not None and prev["files_opened"] is not None:
+            if curr["files_opened"] > prev["files_opened"]:
+                res.append("{} files_opened: {} -> {}".format(key, prev["files_opened"], curr["files_opened"]))
+    return res
+
+STARTUP_COMMANDS = [
+    ["--help"],
+    ["add", "bench_peep"],
+    ["dryrecs"],
+]
+
+# none of these should get imported unless the command actually emails or touches cron
+STARTUP_FORBIDDEN_MODULES = [
+    "smtplib",
+    "email",
+    "crontab",
+    "http",
+    "urllib",
+    "concurrent",
+]
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """
+    `python -X importtime` output -> top level module name -> cumulative microseconds
+    Nested imports are indented, and counted in their parent's cumulative already
+    """
+    res: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  "):
+            res.setdefault(name.strip(), 0)
+            continue
+        res[name.strip()] = res.get(name.strip(), 0) + int(cumulative)
+    return res
+
+def measure_startup(args: List[str], home_dirname: str) -> Dict[str, int]:
+    cli_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "diocli.py")
+    proc = subprocess.run([sys.executable, "-X", "importtime", cli_filename] + args,
+                          env=dict(os.environ, HOME=home_dirname),
+                          cwd=home_dirname,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE,
+                          universal_newlines=True,
+                          check=True)
+    return parse_importtime(proc.stderr)
+
+class SimulatedLatency(object):
+    """
+    Makes every stat and open under dirname sleep first, like each one's a round trip to an NFS server.
+    The sleep lets go of the GIL like waiting on the network does, so threads overlap the same way
+    """
+    def __init__(self, dirname: str, latency_secs: float) -> None:
+        self.dirname = os.path.realpath(dirname)
+        self.latency_secs = latency_secs
+
+    def wrap(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def slow_fn(path: Any, *args: Any, **kwargs: Any) -> Any:
+            if isinstance(path, str) and path.startswith(self.dirname):
+                time.sleep(self.latency_secs)
+            return fn(path, *args, **kwargs)
+        return slow_fn
+
+    def __enter__(self):
+        self.orig_stat, self.orig_open = os.stat, builtins.open
+        os.stat, builtins.open = self.wrap(os.stat), self.wrap(builtins.open)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        os.stat, builtins.open = self.orig_stat, self.orig_open
+
+@click.group()
+def bench():
+    pass
+
+@bench.command("roster-load")
+@click.option("--peeps", default=1000, help="Number of peeps in the synthetic dio dir")
+@click.option("--max-notes", default=64, help="Largest number of notes files per peep to try")
+def roster_load(peeps, max_notes):
+    """
+    Person.iter_all over a roster whose notes folders keep growing.
+    Should stay flat, iter_all never goes into the notes
+    """
+    notes_per_peep = 0
+    while notes_per_peep <= max_notes:
+        dio_dir = make_dio_dir(peeps, notes_per_peep=notes_per_peep, notes_depth=3)
+        try:
+            os.remove(dio.RosterIndex.get_filename(dio_dir))
+            cold = time_it(lambda: sum(1 for _ in dio.Person.iter_all(dio_dir)), repeats=1)
+            warm = time_it(lambda: sum(1 for _ in dio.Person.iter_all(dio_dir)))
+            click.echo("peeps: {} notes/peep: {} cold (no index): {:.4f}s warm: {:.4f}s".format(
+                peeps, notes_per_peep, cold, warm))
+        finally:
+            shutil.rmtree(dio_dir.dirname)
+        notes_per_peep = notes_per_peep * 4 if notes_per_peep else 1
+
+@bench.command()
+@click.option("--peeps", default=2000, help="Number of peeps in the synthetic dio dir")
+@click.option("--latency-ms", default=1.0, help="Made up round trip for every stat and open")
+@click.option("--workers", "workers_list", default="1,4,16,32", help="Loader thread counts to try, comma separated")
+def latency(peeps, latency_ms, workers_list):
+    """
+    Person.get_all and Roster.load on a dio dir with a made up network round trip on every file access,
+    at a few loader thread counts. Cold is without the roster index, so every peep.json gets opened too
+    """
+    dio_dir = make_dio_dir(peeps)
+    try:
+        serial: Dict[str, float] = {}
+        for workers in map(int, workers_list.split(",")):
+            curr_dio_dir = dio.DioDir(dio_dir.dirname)
+            curr_dio_dir.load_workers = workers
+            def cold() -> None:
+                os.remove(dio.RosterIndex.get_filename(curr_dio_dir))
+                with SimulatedLatency(curr_dio_dir.dirname, latency_ms / 1000):
+                    dio.Person.get_all(curr_dio_dir)
+            def warm() -> None:
+                with SimulatedLatency(curr_dio_dir.dirname, latency_ms / 1000):
+                    dio.Person.get_all(curr_dio_dir)
+            def roster_load() -> None:
+                with SimulatedLatency(curr_dio_dir.dirname, latency_ms / 1000):
+                    dio.Roster.load(curr_dio_dir)
+            dio.Roster.load(curr_dio_dir)
+            timings = {
+                "cold get_all": time_it(cold, repeats=1),
+                "warm get_all": time_it(warm, repeats=1),
+                "roster load": time_it(roster_load, repeats=1),
+            }
+            serial = serial or timings
+            click.echo("workers: {} ".format(workers) + " ".join(
+                "{}: {:.3f}s ({:.1f}x)".format(name, secs, serial[name] / secs) for name, secs in timings.items()))
+    finally:
+        shutil.rmtree(dio_dir.dirname)
+
+@bench.command()
+@click.option("--sizes", default="100,1000,10000", help="Roster sizes, comma separated. Goes up to 1000000 if you've got the disk")
+@click.option("--cases", "case_names", default=None, help="Comma separated, defaults to all of them")
+@click.option("--notes-per-peep", default=4, help="Notes files per peep in the with-notes dio dirs")
+@click.option("--repeats", default=3)
+@click.option("--output", default="bench_results.json", help="Where the results JSON goes")
+@click.option("--baseline", default=None, help="Results JSON from an earlier run to compare against")
+@click.option("--tolerance", default=0.25, help="Slack on wall time and RSS before it counts as a regression")
+def suite(sizes, case_names, notes_per_peep, repeats, output, baseline, tolerance):
+    """
+    Every hot path at every roster size, with and without notes folders.
+    Exits nonzero if anything regressed against the baseline
+    """
+    case_names = case_names.split(",") if case_names else CASE_NAMES
+    # fresh interpreter per case, otherwise peak RSS is just the biggest case so far
+    mp_context = multiprocessing.get_context("spawn")
+    results: Dict[str, Dict[str, Any]] = {}
+    for size in map(int, sizes.split(",")):
+        for curr_notes in (0, notes_per_peep):
+            dio_dir = make_dio_dir(size, notes_per_peep=curr_notes)
+            try:
+                for case_name in case_names:
+                    key = "{}/peeps={}/notes={}".format(case_name, size, curr_notes)
+                    with mp_context.Pool(1) as pool:
+                        results[key] = pool.apply(run_case, (dio_dir.dirname, case_name, repeats))
+                    click.echo("{}: {:.4f}s, {} KB peak RSS, {} files opened".format(
+                        key, results[key]["wall_secs"], results[key]["peak_rss_kb"], results[key]["files_opened"]))
+            finally:
+                shutil.rmtree(dio_dir.dirname)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    click.echo("Results written to {}".format(output))
+    if baseline is not None:
+        with open(baseline, "r") as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), tolerance)
+        for regression in regressions:
+            click.echo("REGRESSION {}".format(regression))
+        if regressions:
+            sys.exit(1)
+        click.echo("No regressions against {}".format(baseline))
+
+@bench.command()
+@click.option("--budget-ms", default=250.0, help="Most import time any one command is allowed")
+@click.option("--repeats", default=5)
+def startup(budget_ms, repeats):
+    """
+    Import time of `dio --help`, `dio add` and `dio dryrecs`, best of a few runs.
+    Exits nonzero if a command goes over budget or imports something it shouldn't
+    """
+    home_dirname = tempfile.mkdtemp(prefix="dio_bench_home_")
+    failures = []
+    try:
+        for args in STARTUP_COMMANDS:
+            best_ms = float("inf")
+            for _ in range(repeats):
+                imported = measure_startup(args, home_dirname)
+                best_ms = min(best_ms, sum(imported.values()) / 1000)
+            forbidden = [module_name for module_name in imported
+                         if module_name.split(".")[0] in STARTUP_FORBIDDEN_MODULES]
+            click.echo("dio {}: {:.1f}ms of imports, {} modules".format(" ".join(args), best_ms, len(imported)))
+            if best_ms > budget_ms:
+                failures.append("dio {} took {:.1f}ms, budget is {:.1f}ms".format(" ".join(args), best_ms, budget_ms))
+            if forbidden:
+                failures.append("dio {} imported {}".format(" ".join(args), ", ".join(sorted(forbidden))))
+    finally:
+        shutil.rmtree(home_dirname)
+    for failure in failures:
+        click.echo("OVER BUDGET {}".format(failure))
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,294 @@
+import dio
+import datetime
+import hashlib
+import json
+import os.path
+import random
+import shutil
+import sys
+import tempfile
+import time
+import click
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+"""
+Differential harness: every way dio has of working out who gets contacted when,
+checked against a reference oracle that's the original hash-based semantics written out the slow way.
+Any cache, calendar, compiled year, vectorized or on-disk shortcut has to give the same peeps
+on the same days as the oracle, bit for bit, or somebody's contact plan silently changes.
+
+Run like `python difftest.py --peeps 100000 --start-year 2019 --end-year 2030`.
+Exits nonzero on any divergence. test.py runs the same engines on hypothesis rosters
+"""
+
+# -- the reference oracle. These are the definitions, not an implementation:
+# don't speed them up, don't share code with dio, don't cache anything.
+
+# python folds whatever __hash__ returns down modulo this, Person.__hash__ returns int(salt)
+HASH_MODULUS = 2 ** 61 - 1
+
+def ref_peep_hash(salt: str) -> int:
+    return hash(int(salt))
+
+def ref_date_hash(date: datetime.date) -> int:
+    return int(hashlib.sha256(str(date).encode("utf-8")).hexdigest(), 16)
+
+def ref_days_in_year(year: int) -> List[datetime.date]:
+    res = []
+    curr_day = datetime.date(year=year, month=1, day=1)
+    while curr_day.year == year:
+        res.append(curr_day)
+        if curr_day == datetime.date.max:
+            break
+        curr_day += datetime.timedelta(days=1)
+    return res
+
+def ref_default_should_email_day(date: datetime.date) -> bool:
+    return ref_date_hash(date) % 100 <= 25
+
+# should_contact is split into the part that only depends on the day, done once per emailing day,
+# and the part that depends on the peep. Same expression, just not redone per peep
+
+def ref_default_day_context(date: datetime.date, year_emailing_days: List[datetime.date]) -> Tuple[int, int]:
+    assert date in year_emailing_days
+    midyear = datetime.date(year=date.year, month=7, day=2)
+    email_list = sorted(day for day in year_emailing_days if (day < midyear) == (date < midyear))
+    return len(email_list), email_list.index(date)
+
+def ref_default_should_contact(peep_hash: int, day_context: Tuple[int, int]) -> bool:
+    total_cardinality, curr_bucket = day_context
+    return peep_hash % total_cardinality == curr_bucket
+
+def ref_three_times_should_email_day(date: datetime.date) -> bool:
+    _, week, _ = date.isocalendar()
+    return week in set(range(1, 9)) | set(range(18, 26)) | set(range(35, 43))
+
+def ref_three_times_day_context(date: datetime.date, year_emailing_days: List[datetime.date]) -> int:
+    _, week, weekday = date.isocalendar()
+    # buckets past 55 never come up, that's how it always was
+    return weekday + week * 8
+
+def ref_three_times_should_contact(peep_hash: int, day_context: int) -> bool:
+    return peep_hash % (8 * 7) == day_context
+
+# schedule name -> (should_email_day, day_context, should_contact)
+REFERENCE_SCHEDULES: Dict[str, Tuple[Callable[..., bool], Callable[..., Any], Callable[..., bool]]] = {
+    "default": (ref_default_should_email_day, ref_default_day_context, ref_default_should_contact),
+    "threetimes": (ref_three_times_should_email_day, ref_three_times_day_context, ref_three_times_should_contact),
+}
+
+def ref_emailing_days(schedule_name: str, year: int) -> List[datetime.date]:
+    should_email_day, _, _ = REFERENCE_SCHEDULES[schedule_name]
+    return [day for day in ref_days_in_year(year) if should_email_day(day)]
+
+def ref_next_emailing_day(schedule_name: str, date: datetime.date) -> datetime.date:
+    should_email_day, _, _ = REFERENCE_SCHEDULES[schedule_name]
+    while not should_email_day(date):
+        date += datetime.timedelta(days=1)
+    return date
+
+# a day's answer: (name, salt) of everyone contacted, sorted, so engines can hand peeps back in any order
+DayAnswer = List[Tuple[str, str]]
+
+def get_answer(peeps: Optional[Sequence[Any]]) -> DayAnswer:
+    return sorted((peep.name, peep.salt) for peep in peeps or [])
+
+def ref_partition(schedule_name: str, peeps: Sequence[dio.Person], year: int) -> Dict[datetime.date, DayAnswer]:
+    _, day_context, should_contact = REFERENCE_SCHEDULES[schedule_name]
+    year_emailing_days = ref_emailing_days(schedule_name, year)
+    peep_hashes = [ref_peep_hash(peep.salt) for peep in peeps]
+    res = {}
+    for day in year_emailing_days:
+        curr_context = day_context(day, year_emailing_days)
+        res[day] = get_answer([peep for peep, peep_hash in zip(peeps, peep_hashes)
+                               if should_contact(peep_hash, curr_context)])
+    return res
+
+# -- the engines. Each takes (schedule, peeps, year, dio_dir with those peeps saved or None)
+# and hands back emailing day -> DayAnswer for the whole year
+
+def engine_should_contact(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    """ the plain per peep, per day API """
+    return {day: get_answer([peep for peep in peeps if schedule.should_contact(peep, day)])
+            for day in ref_days_in_year(year) if schedule.should_email_day(day)}
+
+def engine_compiled(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    return {day: get_answer(day_peeps) for day, day_peeps in schedule.compile(year).partition(list(peeps)).items()}
+
+def engine_contacts_for(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    """ a day at a time off a Roster, like get_recs does """
+    roster = dio.Roster.from_people(peeps)
+    return {day: get_answer(schedule.contacts_for(roster, day))
+            for day in ref_days_in_year(year) if schedule.should_email_day(day)}
+
+def engine_roster(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    return {day: get_answer(day_peeps)
+            for day, day_peeps in schedule.partition_year(dio.Roster.from_people(peeps), year).items()}
+
+def engine_vectorized(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    return {day: get_answer(day_peeps)
+            for day, day_peeps in dio.vectorized.partition_year(schedule, dio.Roster.from_people(peeps), year).items()}
+
+def engine_get_recs(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    """ off disk: roster snapshot and all, no year plan """
+    if os.path.isdir(dio.YearPlan.get_dirname(dio_dir)):
+        shutil.rmtree(dio.YearPlan.get_dirname(dio_dir))
+    return {day: get_answer(dio.get_recs(dio_dir, schedule, day))
+            for day in ref_days_in_year(year) if schedule.should_email_day(day)}
+
+def engine_year_plan(schedule: dio.ScheduleABC, peeps: Sequence[dio.Person], year: int, dio_dir: Any) -> Dict[datetime.date, DayAnswer]:
+    """ off disk, through `dio plan` """
+    dio.YearPlan.build(dio_dir, schedule, year).save(dio_dir)
+    res = {day: get_answer(dio.get_recs(dio_dir, schedule, day))
+           for day in ref_days_in_year(year) if schedule.should_email_day(day)}
+    shutil.rmtree(dio.YearPlan.get_dirname(dio_dir))
+    return res
+
+ENGINES: Dict[str, Callable[..., Dict[datetime.date, DayAnswer]]] = {
+    "should_contact": engine_should_contact,
+    "compiled": engine_compiled,
+    "contacts_for": engine_contacts_for,
+    "roster": engine_roster,
+    "vectorized": engine_vectorized,
+    "get_recs": engine_get_recs,
+    "year_plan": engine_year_plan,
+}
+# these want a dio dir with the peeps saved in it
+DISK_ENGINES = ["get_recs", "year_plan"]
+
+def get_engine_names() -> List[str]:
+    """ vectorized only if numpy's there, it's optional """
+    return [engine_name for engine_name in ENGINES
+            if engine_name != "vectorized" or dio.vectorized.np is not None]
+
+def diff_partitions(expected: Dict[datetime.date, DayAnswer], actual: Dict[datetime.date, DayAnswer]) -> List[str]:
+    """ Divergences, as messages. Empty if they're the same """
+    res = []
+    for day in sorted(set(expected) | set(actual)):
+        if day not in actual:
+            res.append("{}: emailing day missing".format(day))
+        elif day not in expected:
+            res.append("{}: not an emailing day, but has {} peeps".format(day, len(actual[day])))
+        elif expected[day] != actual[day]:
+            missing = sorted(set(expected[day]) - set(actual[day]))
+            extra = sorted(set(actual[day]) - set(expected[day]))
+            res.append("{}: missing {} extra {}".format(day, missing[:3], extra[:3]))
+    return res
+
+def diff_days(schedule_name: str, schedule: dio.ScheduleABC, year: int) -> List[str]:
+    """ should_email_day, next_emailing_day, emailing_days_between and count_emailing_days against the oracle """
+    res = []
+    expected = ref_emailing_days(schedule_name, year)
+    year_start = datetime.date(year=year, month=1, day=1)
+    if year < datetime.MAXYEAR:
+        next_year_start = datetime.date(year=year + 1, month=1, day=1)
+        if schedule.emailing_days_between(year_start, next_year_start) != expected:
+            res.append("{}: emailing_days_between differs".format(year))
+        if schedule.count_emailing_days(year_start, next_year_start) != len(expected):
+            res.append("{}: count_emailing_days differs".format(year))
+    for day in ref_days_in_year(year):
+        if schedule.should_email_day(day) != (day in expected):
+            res.append("{}: should_email_day differs".format(day))
+        if year < datetime.MAXYEAR and schedule.next_emailing_day(day) != ref_next_emailing_day(schedule_name, day):
+            res.append("{}: next_emailing_day differs".format(day))
+    return res
+
+def make_roster(num_peeps: int, seed: int=0) -> List[dio.Person]:
+    """
+    Unique names, so the disk engines keep everybody.
+    Starts with salts right around multiples of the hash modulus, where folding could go wrong
+    """
+    rng = random.Random(seed)
+    edge_salts = []
+    for multiple in (int(1e30) // HASH_MODULUS + 1, int(9e30) // HASH_MODULUS - 1):
+        for offset in (0, 1, HASH_MODULUS - 1):
+            edge_salts.append(multiple * HASH_MODULUS + offset)
+    salts = edge_salts[:num_peeps] + [rng.randint(int(1e30), int(9e30)) for _ in range(num_peeps - len(edge_salts))]
+    return [dio.Person(name="peep{}".format(peep_idx), salt=str(salt)) for peep_idx, salt in enumerate(salts)]
+
+def run(schedule_names: List[str],
+        engine_names: List[str],
+        peeps: List[dio.Person],
+        years: List[int],
+        progress: Callable[[Dict[str, Any]], None]=lambda row: None) -> List[Dict[str, Any]]:
+    """
+    One row per (schedule, year, engine), plus one per (schedule, year) for the emailing days.
+    Throughput is peeps times emailing days, per second
+    """
+    rows = []
+    dio_dir: Optional[dio.DioDir] = None
+    if set(engine_names) & set(DISK_ENGINES):
+        dio_dir = dio.DioDir(tempfile.mkdtemp(prefix="dio_difftest_"))
+        dio.batch_save(dio_dir, peeps)
+    try:
+        for schedule_name in schedule_names:
+            for year in years:
+                schedule = dio.get_schedule(schedule_name)
+                row = {"schedule": schedule_name, "year": year, "engine": "days"}
+                row["divergences"] = diff_days(schedule_name, schedule, year)
+                progress(row)
+                rows.append(row)
+                start = time.perf_counter()
+                expected = ref_partition(schedule_name, peeps, year)
+                ref_secs = time.perf_counter() - start
+                for engine_name in ["reference"] + engine_names:
+                    start = time.perf_counter()
+                    if engine_name == "reference":
+                        actual, secs = expected, ref_secs
+                    else:
+                        actual = ENGINES[engine_name](dio.get_schedule(schedule_name), peeps, year, dio_dir)
+                        secs = time.perf_counter() - start
+                    row = {
+                        "schedule": schedule_name,
+                        "year": year,
+                        "engine": engine_name,
+                        "secs": secs,
+                        "peep_days_per_sec": len(peeps) * len(expected) / secs if secs else 0.0,
+                        "divergences": diff_partitions(expected, actual),
+                    }
+                    progress(row)
+                    rows.append(row)
+    finally:
+        if dio_dir is not None:
+            shutil.rmtree(dio_dir.dirname)
+    return rows
+
+def format_row(row: Dict[str, Any], max_divergences: int=5) -> str:
+    status = "ok" if not row["divergences"] else "{} DIVERGENCES".format(len(row["divergences"]))
+    if row["engine"] == "days":
+        line = "{} {} emailing days: {}".format(row["schedule"], row["year"], status)
+    else:
+        line = "{} {} {}: {:.3f}s, {:.0f} peep-days/sec, {}".format(
+            row["schedule"], row["year"], row["engine"], row["secs"], row["peep_days_per_sec"], status)
+    return "\n".join([line] + ["    " + divergence for divergence in row["divergences"][:max_divergences]])
+
+@click.command()
+@click.option("--peeps", "num_peeps", default=10000, help="Roster size, up to 100000 or so")
+@click.option("--start-year", default=2019)
+@click.option("--end-year", default=None, type=int, help="Inclusive, defaults to the start year")
+@click.option("--schedule", "schedule_names", multiple=True, type=click.Choice(sorted(REFERENCE_SCHEDULES)),
+              help="Defaults to all of them. Balanced has no reference, it's newer than the hash semantics")
+@click.option("--engine", "engine_names", multiple=True, type=click.Choice(sorted(ENGINES)),
+              help="Defaults to all of them. get_recs and year_plan write the roster to a temp dio dir first")
+@click.option("--seed", default=0)
+@click.option("--json", "output", default=None, help="Also write every row to this JSON file")
+def difftest(num_peeps, start_year, end_year, schedule_names, engine_names, seed, output):
+    """
+    Runs a roster over the years through every engine and the reference,
+    and prints each one's throughput and anywhere it doesn't match. Exits 1 if anything doesn't
+    """
+    peeps = make_roster(num_peeps, seed=seed)
+    years = list(range(start_year, (end_year if end_year is not None else start_year) + 1))
+    rows = run(list(schedule_names) or sorted(REFERENCE_SCHEDULES),
+               list(engine_names) or get_engine_names(),
+               peeps, years, progress=lambda row: click.echo(format_row(row)))
+    if output is not None:
+        with open(output, "w") as output_file:
+            json.dump(rows, output_file, indent=2)
+    num_divergent = sum(1 for row in rows if row["divergences"])
+    click.echo("{} peeps, {} years, {} of {} runs diverged".format(len(peeps), len(years), num_divergent, len(rows)))
+    if num_divergent:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    difftest()
@@ -1,45 +1,91 @@
-from .schedule_abc import ScheduleABC
-from .default_schedule import DefaultSchedule
-from .dio_dir import DioDir
-from .person import Person
-from .settings import Settings
-from .three_times_schedule import ThreeTimesSchedule
-from .utils import *
-from typing import Optional, List, Dict
-import datetime
-import email
-import smtplib
-import functools
+import importlib
+from typing import Any, Dict, List
 
-def get_recs(dio_dir: DioDir, schedule: ScheduleABC, date_to_rec: datetime.date) -> Optional[List[Person]]:
-    if schedule.should_email_day(date_to_rec):
-        should_contact_on_day = functools.partial(
-            schedule.should_contact,
-            date=date_to_rec
-        )
-        return list(filter(should_contact_on_day, Person.get_all(dio_dir)))
-    else:
-        return None
+"""
+Everything is imported lazily, on first use of the name,
+so `dio add` doesn't pay for smtplib and friends it never touches.
+`from dio import Person` only imports dio.person (and what it needs)
+"""
 
-def recs_to_message(res: Optional[List[Person]], next_day: datetime.date) -> str:
-    if res is None:
-        return "Next emailing day is : {}".format(next_day)
-    elif res == []:
-        return "Emailing day, but no peeps today. Add more peeps."
-    else:
-        return "\n".join(
-            [peep.name for peep in res]
-        )
+_LAZY_NAMES: Dict[str, str] = {
+    "ScheduleABC": ".schedule_abc",
+    "CompiledYear": ".compiled_schedule",
+    "DefaultSchedule": ".default_schedule",
+    "ThreeTimesSchedule": ".three_times_schedule",
+    "BalancedSchedule": ".balanced_schedule",
+    "DioDir": ".dio_dir",
+    "Person": ".person",
+    "Settings": ".settings",
+    "RosterIndex": ".roster_index",
+    "migrate_layout": ".layout",
+    "Roster": ".roster",
+    "RosterSnapshot": ".roster_snapshot",
+    "PersonView": ".roster",
+    "NameIndex": ".name_index",
+    "export_roster": ".export",
+    "import_roster": ".export",
+    "BatchResult": ".batch",
+    "batch_save": ".batch",
+    "on_roster_change": ".roster_events",
+    "roster_changed": ".roster_events",
+    "SCHEDULES": ".schedules",
+    "get_schedule": ".schedules",
+    "get_schedule_name": ".schedules",
+    "YearPlan": ".year_plan",
+    "Mailer": ".mailer",
+    "deliver_all": ".mailer",
+    "make_message": ".mailer",
+    "send_message": ".mailer",
+    "get_recs": ".recs",
+    "get_next_emailing_day": ".recs",
+    "recs_to_message": ".recs",
+    "days_in_year": ".utils",
+    "get_date_hash": ".utils",
+    "before_midyear": ".utils",
+    "atomic_write_json": ".utils",
+}
 
-def send_message(contents: str, date: datetime.date, settings: Settings) -> None:
-    msg_obj: email.message.EmailMessage = email.message.EmailMessage()
-    msg_obj['From'] = settings.smtp_username
-    msg_obj['To'] = settings.smtp_dest_email
-    msg_obj['Subject'] = "Diogenes | {}".format(str(date))
-    msg_obj.set_content(contents)
-    with smtplib.SMTP(settings.smtp_url, settings.smtp_port) as server:
-        server.ehlo()
-        server.starttls()
-        server.login(settings.smtp_username, settings.smtp_password)
-        server.send_message(msg_obj)
+_SUBMODULES: List[str] = [
+    "balanced_schedule",
+    "batch",
+    "compiled_schedule",
+    "daemon",
+    "default_schedule",
+    "dio_dir",
+    "export",
+    "fanout",
+    "layout",
+    "mailer",
+    "name_index",
+    "person",
+    "profiling",
+    "recs",
+    "roster",
+    "roster_events",
+    "roster_index",
+    "roster_snapshot",
+    "schedule_abc",
+    "schedules",
+    "settings",
+    "simulate",
+    "spool",
+    "three_times_schedule",
+    "utils",
+    "vectorized",
+    "year_calendar",
+    "year_plan",
+]
 
+__all__ = sorted(_LAZY_NAMES)
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_NAMES:
+        res = getattr(importlib.import_module(_LAZY_NAMES[name], __name__), name)
+        globals()[name] = res
+        return res
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_LAZY_NAMES) | set(_SUBMODULES))
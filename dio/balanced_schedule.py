@@ -0,0 +1,102 @@
+import datetime
+from .default_schedule import DefaultSchedule, get_calendar
+from .person import Person
+from .roster import Roster
+from .year_calendar import YearCalendar
+from . import profiling
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+class BalancedSchedule(DefaultSchedule):
+    """
+    Same emailing days as the default schedule, and everyone starts out on the day the default gives them,
+    hash % days. Going down the roster in hash order, everybody takes that day if it has room,
+    otherwise the nearest day either side that does. Every day has room for n // days peeps,
+    and the first n % days days to fill that up get room for one more,
+    so days in a half year never differ by more than one peep.
+
+    Adding or deleting someone only bumps the few peeps in the chain between where they land
+    and the nearest day with room, not a peep at every slice boundary.
+    Needs the whole roster to say who goes when, so there's no should_contact
+    """
+    needs_whole_roster = True
+
+    def __init__(self):
+        pass
+
+    def should_contact(self, person: Person, date: datetime.date) -> bool:
+        raise Exception("BalancedSchedule needs the whole roster, use contacts_for")
+
+    def contact_rule(self, date: datetime.date) -> Optional[Tuple[int, int]]:
+        return None
+
+    @staticmethod
+    def get_ranked(roster: Sequence[Any]) -> List[int]:
+        """
+        Roster positions in hash order, names breaking ties. O(n log n)
+        """
+        profiling.count("people_evaluated", len(roster))
+        if isinstance(roster, Roster):
+            hashes, names = roster.hashes, roster.names
+            return sorted(range(len(roster)), key=lambda idx: (hashes[idx], names[idx]))
+        return sorted(range(len(roster)), key=lambda idx: (hash(roster[idx]), roster[idx].name))
+
+    @staticmethod
+    def get_hashes(roster: Sequence[Any]) -> Sequence[int]:
+        if isinstance(roster, Roster):
+            return roster.hashes
+        return [hash(peep) for peep in roster]
+
+    @staticmethod
+    def assign_days(hashes: Sequence[int], ranked: Sequence[int], num_days: int) -> List[int]:
+        """
+        Day index in the half for every roster position
+        """
+        base, num_extra = divmod(len(ranked), num_days)
+        loads = [0] * num_days
+        num_full = 0
+        res = [0] * len(ranked)
+        for idx in ranked:
+            cap = base + 1 if num_full < num_extra else base
+            home = hashes[idx] % num_days
+            # there's always room somewhere: what's placed so far is less than the room there was to begin with
+            for dist in range(num_days):
+                day_idx = (home + dist) % num_days
+                if loads[day_idx] < cap:
+                    break
+                day_idx = (home - dist) % num_days
+                if loads[day_idx] < cap:
+                    break
+            loads[day_idx] += 1
+            res[idx] = day_idx
+            if loads[day_idx] == base + 1:
+                num_full += 1
+        return res
+
+    def contacts_for(self, roster: Iterable[Person], date: datetime.date) -> List[Person]:
+        """ In roster order, like the other schedules """
+        calendar: YearCalendar = get_calendar(date.year)
+        assert date in calendar.emailing_days
+        if not isinstance(roster, Roster):
+            roster = list(roster)
+        days = BalancedSchedule.assign_days(
+                BalancedSchedule.get_hashes(roster), BalancedSchedule.get_ranked(roster), calendar.cardinality(date))
+        return [roster[idx] for idx, day_idx in enumerate(days) if day_idx == calendar.buckets[date]]
+
+    def partition_year(self, roster: Iterable[Person], year: int) -> Dict[datetime.date, List[Person]]:
+        """
+        One sort for the whole year: everyone lands in exactly one day of each half
+        """
+        calendar: YearCalendar = get_calendar(year)
+        if not isinstance(roster, Roster):
+            roster = list(roster)
+        hashes = BalancedSchedule.get_hashes(roster)
+        ranked = BalancedSchedule.get_ranked(roster)
+        res: Dict[datetime.date, List[Person]] = {}
+        for half in (calendar.fst_half, calendar.snd_half):
+            if not half:
+                continue
+            groups: List[List[Person]] = [[] for _ in half]
+            for idx, day_idx in enumerate(BalancedSchedule.assign_days(hashes, ranked, len(half))):
+                groups[day_idx].append(roster[idx])
+            res.update(zip(half, groups))
+        return dict(sorted(res.items()))
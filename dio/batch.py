@@ -0,0 +1,88 @@
+import concurrent.futures
+import dataclasses
+import functools
+import threading
+import time
+from .dio_dir import DioDir
+from .person import Person
+from .roster_index import RosterIndex
+from .roster_events import roster_changed
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+@dataclasses.dataclass
+class BatchResult(object):
+    rows: int = 0
+    duplicates: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def batch_save(dio_dir: DioDir,
+               peeps: Iterable[Person],
+               workers: int=8,
+               progress: Optional[Callable[[BatchResult], None]]=None,
+               progress_every: int=10000) -> BatchResult:
+    """
+    Saves a stream of peeps through a bounded thread pool.
+    Every peep.json is written atomically and the roster index is written once, at the end.
+
+    Peeps landing in the same folder are saved in stream order, so the last one wins,
+    same as calling save one after another
+    """
+    index: RosterIndex = RosterIndex.load(dio_dir)
+    # bounds memory too, the stream doesn't get read any further ahead than this
+    in_flight = threading.BoundedSemaphore(workers * 4)
+    pending_lock = threading.Lock()
+    pending: Dict[str, concurrent.futures.Future] = {}
+    errors: List[BaseException] = []
+    seen_dirnames: Set[str] = set()
+    saved: List[Person] = []
+    res = BatchResult()
+    start = time.perf_counter()
+
+    def save_one(peep: Person) -> None:
+        try:
+            peep.save(dio_dir, index)
+            saved.append(peep)
+        finally:
+            in_flight.release()
+
+    def forget(peep_dirname: str, future: concurrent.futures.Future) -> None:
+        with pending_lock:
+            if pending.get(peep_dirname) is future:
+                del pending[peep_dirname]
+            if future.exception() is not None:
+                errors.append(future.exception())
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for peep in peeps:
+                peep_dirname = peep.get_dir(dio_dir)
+                if peep_dirname in seen_dirnames:
+                    res.duplicates += 1
+                    with pending_lock:
+                        earlier = pending.get(peep_dirname)
+                    if earlier is not None:
+                        # wait out the earlier write, so the later row deterministically wins
+                        concurrent.futures.wait([earlier])
+                seen_dirnames.add(peep_dirname)
+                in_flight.acquire()
+                future = executor.submit(save_one, peep)
+                with pending_lock:
+                    pending[peep_dirname] = future
+                future.add_done_callback(functools.partial(forget, peep_dirname))
+                res.rows += 1
+                if progress is not None and res.rows % progress_every == 0:
+                    res.seconds = time.perf_counter() - start
+                    progress(res)
+    finally:
+        # whatever did get written is in the index and bumps the roster version,
+        # even if some of it blew up or the stream itself did
+        index.save()
+        roster_changed(dio_dir, saved, [])
+    res.seconds = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return res
@@ -0,0 +1,102 @@
+import bisect
+import dataclasses
+import datetime
+import types
+from .roster import Roster
+from .utils import days_in_year
+from . import profiling
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+# (modulus, residue): contact whoever has hash(peep) % modulus == residue
+ContactRule = Tuple[int, int]
+
+@dataclasses.dataclass(frozen=True)
+class CompiledYear(object):
+    """
+    One year of a schedule worked out ahead of time:
+    a bitset of the emailing days, and the contact rule for each of them if the schedule has rules.
+    Made by ScheduleABC.compile, which asks should_email_day and contact_rule once per day,
+    or only contact_rule if the schedule has its emailing days already (see ScheduleABC.get_sorted_days),
+    so nothing here calls back into the schedule unless it has no rules
+    """
+    schedule: Any
+    year: int
+    first_day: datetime.date
+    # bit i is set if first_day + i days is an emailing day
+    bits: bytes
+    sorted_days: Tuple[datetime.date, ...]
+    # None if the schedule's should_contact isn't a contact rule, then it gets asked per peep
+    rules: Optional[Mapping[datetime.date, ContactRule]]
+
+    @staticmethod
+    def build(schedule: Any, year: int, sorted_days: Optional[Sequence[datetime.date]]=None):
+        first_day = datetime.date(year=year, month=1, day=1)
+        bits = bytearray((366 + 7) // 8)
+        if sorted_days is None:
+            sorted_days = [day for day in days_in_year(year) if schedule.should_email_day(day)]
+        rules: Optional[Dict[datetime.date, ContactRule]] = {}
+        for day in sorted_days:
+            day_idx = (day - first_day).days
+            bits[day_idx >> 3] |= 1 << (day_idx & 7)
+            rule = schedule.contact_rule(day) if rules is not None else None
+            if rule is None:
+                rules = None
+            else:
+                rules[day] = rule
+        return CompiledYear(
+                schedule=schedule,
+                year=year,
+                first_day=first_day,
+                bits=bytes(bits),
+                sorted_days=tuple(sorted_days),
+                rules=types.MappingProxyType(rules) if rules is not None else None)
+
+    def is_emailing_day(self, date: datetime.date) -> bool:
+        assert date.year == self.year
+        day_idx = (date - self.first_day).days
+        return bool(self.bits[day_idx >> 3] >> (day_idx & 7) & 1)
+
+    def next_emailing_day(self, date: datetime.date) -> Optional[datetime.date]:
+        """ None if there's none left this year """
+        day_idx = bisect.bisect_left(self.sorted_days, date)
+        if day_idx < len(self.sorted_days):
+            return self.sorted_days[day_idx]
+        return None
+
+    def emailing_days_between(self, start: datetime.date, end: datetime.date) -> Tuple[datetime.date, ...]:
+        """ The ones that fall in this year, end not included """
+        return self.sorted_days[bisect.bisect_left(self.sorted_days, start):bisect.bisect_left(self.sorted_days, end)]
+
+    def contacts_for(self, roster: Iterable[Any], date: datetime.date) -> List[Any]:
+        assert self.is_emailing_day(date)
+        if self.rules is None:
+            return [person for person in profiling.counted("people_evaluated", roster)
+                    if self.schedule.should_contact(person, date)]
+        modulus, residue = self.rules[date]
+        if isinstance(roster, Roster):
+            return roster.select_residue(modulus, residue)
+        return [person for person in profiling.counted("people_evaluated", roster)
+                if hash(person) % modulus == residue]
+
+    def partition(self, roster: Iterable[Any]) -> Dict[datetime.date, List[Any]]:
+        """
+        Every emailing day of the year, mapped to who to contact that day.
+        With rules, everyone gets hashed once and bucketed once per distinct modulus
+        """
+        if self.rules is None:
+            roster = list(roster)
+            return {day: self.contacts_for(roster, day) for day in self.sorted_days}
+        moduli = sorted({modulus for modulus, _ in self.rules.values()})
+        if isinstance(roster, Roster):
+            groups_by_modulus = {modulus: roster.group_by_residue(modulus) for modulus in moduli}
+        else:
+            people = list(profiling.counted("people_evaluated", roster))
+            hashes = [hash(person) for person in people]
+            groups_by_modulus = {}
+            for modulus in moduli:
+                groups: Dict[int, List[Any]] = {}
+                for person, person_hash in zip(people, hashes):
+                    groups.setdefault(person_hash % modulus, []).append(person)
+                groups_by_modulus[modulus] = groups
+        return {day: list(groups_by_modulus[self.rules[day][0]].get(self.rules[day][1], []))
+                for day in self.sorted_days}
@@ -0,0 +1,190 @@
+import concurrent.futures
+import dataclasses
+import datetime
+import http.server
+import json
+import os
+import os.path
+import smtplib
+import threading
+import sys
+import time
+import urllib.parse
+import urllib.request
+from .recs import recs_to_message
+from .dio_dir import DioDir
+from .mailer import make_message
+from .person import Person
+from .roster import Roster
+from .schedule_abc import ScheduleABC
+from . import spool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_PORT = 8768
+
+@dataclasses.dataclass
+class Tenant(object):
+    """
+    One dio dir the daemon looks after, and what it remembers about it
+    """
+    dio_dir: DioDir
+    roster: Roster = dataclasses.field(default_factory=Roster)
+    roster_stamp: Optional[Tuple] = None
+    last_sent: Optional[datetime.date] = None
+    # a send's going in the executor, don't start another
+    sending: bool = False
+
+def get_roster_stamp(dio_dir: DioDir) -> Tuple:
+    """
+    Cheap stand-in for "did the roster change".
+    Adding or deleting a peep changes the dio dir mtime, and anything going through dio bumps the roster version.
+    Hand edits to a peep.json don't show up here, `dio add` or a restart does
+    """
+    dio_stat = os.stat(dio_dir.dirname)
+    return (dio_stat.st_mtime_ns, dio_dir.get_roster_version())
+
+class RecsDaemon(object):
+    """
+    Keeps the roster of a bunch of dio dirs in memory and emails each of them their recs
+    once a day, instead of one cron-spawned python per dio dir.
+    Also answers dryrecs over http on localhost
+    """
+    def __init__(self,
+                 dirnames: List[str],
+                 schedule: ScheduleABC,
+                 send_hour: int=15,
+                 workers: int=4,
+                 smtp_factory: Callable[..., Any]=smtplib.SMTP) -> None:
+        self.tenants: Dict[str, Tenant] = {}
+        for dirname in dirnames:
+            dio_dir = DioDir(dirname)
+            self.tenants[os.path.abspath(dio_dir.dirname)] = Tenant(dio_dir=dio_dir)
+        self.schedule = schedule
+        self.send_hour = send_hour
+        self.smtp_factory = smtp_factory
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+
+    def refresh(self, tenant: Tenant) -> None:
+        """
+        One tenant's broken dio dir only costs that tenant, it keeps the last roster that loaded
+        """
+        try:
+            roster_stamp = get_roster_stamp(tenant.dio_dir)
+            if roster_stamp != tenant.roster_stamp:
+                roster = Roster.load(tenant.dio_dir)
+                # reading the roster can bump the version, if someone edited by hand
+                with self.lock:
+                    tenant.roster = roster
+                    tenant.roster_stamp = get_roster_stamp(tenant.dio_dir)
+        except Exception as exc:
+            print("dio serve: couldn't read {}, keeping the roster from before: {}".format(
+                tenant.dio_dir.dirname, exc), file=sys.stderr)
+
+    def refresh_all(self) -> None:
+        for tenant in list(self.tenants.values()):
+            self.refresh(tenant)
+
+    def get_recs(self, tenant: Tenant, date: datetime.date) -> Optional[List[Person]]:
+        """ Same as dio.get_recs, off the in-memory roster """
+        if not self.schedule.should_email_day(date):
+            return None
+        with self.lock:
+            roster = tenant.roster
+        return [Person(name=peep.name, salt=peep.salt) for peep in self.schedule.contacts_for(roster, date)]
+
+    def get_message(self, tenant: Tenant, date: datetime.date) -> str:
+        return recs_to_message(self.get_recs(tenant, date), self.schedule.next_emailing_day(date))
+
+    def send_recs(self, tenant: Tenant, date: datetime.date) -> None:
+        """
+        Through the tenant's spool like `dio recs`, so a date never goes out twice,
+        whether it was this daemon, an earlier one or cron that sent it.
+        Only counts as sent once it's gone, otherwise the next poll tries again
+        """
+        try:
+            settings = tenant.dio_dir.get_settings()
+            if settings is None:
+                raise Exception("{} has no email settings, run `dio setupemail`".format(tenant.dio_dir.dirname))
+            spool.spool_message(tenant.dio_dir, make_message(self.get_message(tenant, date), date, settings), date)
+            # no retries in here, polling is the retry
+            res = spool.flush(tenant.dio_dir, settings, retries=0, smtp_factory=self.smtp_factory)
+            if res.error is not None:
+                raise res.error
+            if date not in res.pending:
+                tenant.last_sent = date
+        finally:
+            tenant.sending = False
+
+    def fire_due(self, now: datetime.datetime) -> List[concurrent.futures.Future]:
+        """
+        Sends recs for every tenant that hasn't had them today, once it's past the send hour.
+        Starting up late still sends today's, unless they went out already
+        """
+        today = now.date()
+        if now.hour < self.send_hour:
+            return []
+        futures = []
+        for tenant in self.tenants.values():
+            if tenant.last_sent == today or tenant.sending:
+                continue
+            if spool.is_sent(tenant.dio_dir, today):
+                tenant.last_sent = today
+                continue
+            tenant.sending = True
+            futures.append(self.executor.submit(self.send_recs, tenant, today))
+        return futures
+
+    def make_server(self, port: int=DEFAULT_PORT) -> http.server.HTTPServer:
+        daemon = self
+
+        class DryrecsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                dirname = query.get("dir", [DioDir.get_default_dirname()])[0]
+                tenant = daemon.tenants.get(os.path.abspath(dirname))
+                if url.path != "/dryrecs" or tenant is None:
+                    self.send_error(404, "Not a dio dir this daemon knows about")
+                    return
+                date = datetime.date.fromisoformat(query.get("date", [str(datetime.date.today())])[0])
+                body = json.dumps({"message": daemon.get_message(tenant, date)}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return http.server.ThreadingHTTPServer(("127.0.0.1", port), DryrecsHandler)
+
+    def serve_forever(self, port: int=DEFAULT_PORT, poll_secs: float=60.0) -> None:
+        self.refresh_all()
+        server = self.make_server(port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            while True:
+                for future in self.fire_due(datetime.datetime.now()):
+                    future.add_done_callback(log_failure)
+                time.sleep(poll_secs)
+                self.refresh_all()
+        finally:
+            server.shutdown()
+            self.executor.shutdown()
+
+def log_failure(future: concurrent.futures.Future) -> None:
+    if future.exception() is not None:
+        print("dio serve: sending recs failed: {}".format(future.exception()), file=sys.stderr)
+
+def ask_daemon(daemon_url: str, dio_dir: DioDir, date: datetime.date, timeout: float=2.0) -> Optional[str]:
+    """
+    The dryrecs message from a running `dio serve`, or None if there's nobody there
+    """
+    query = urllib.parse.urlencode({"dir": dio_dir.dirname, "date": str(date)})
+    try:
+        with urllib.request.urlopen("{}/dryrecs?{}".format(daemon_url.rstrip("/"), query), timeout=timeout) as resp:
+            return json.load(resp)["message"]
+    except OSError:
+        return None
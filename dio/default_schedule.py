@@ -1,8 +1,28 @@
+import bisect
 import datetime
-from .utils import days_in_year, get_date_hash
+import functools
+from .utils import days_in_year, get_date_hash, before_midyear
 from .person import Person
+from .roster import Roster
 from .schedule_abc import ScheduleABC
-from typing import Optional, List, Tuple, Set, Iterator
+from .year_calendar import YearCalendar
+from . import profiling
+from typing import List, Tuple, Set, FrozenSet, Dict, Iterable
+
+# a couple of years is all anybody asks for in one process (this year, next year, list_recs)
+CALENDAR_CACHE_SIZE = 8
+
+def _is_emailing_day(date: datetime.date) -> bool:
+    # use date, since otherwise the finer increments mess things up wrt stability
+    # so, 25% of days, or about 90 days/year
+    return get_date_hash(date) % 100 <= 25
+
+@functools.lru_cache(maxsize=CALENDAR_CACHE_SIZE)
+def get_calendar(year: int) -> YearCalendar:
+    """
+    Hashing the whole year is the expensive part, so it's done once per year per process
+    """
+    return YearCalendar.from_days(year, filter(_is_emailing_day, days_in_year(year)))
 
 class DefaultSchedule(ScheduleABC):
     """
@@ -13,20 +33,41 @@ class DefaultSchedule(ScheduleABC):
         pass
 
     def should_email_day(self, date: datetime.date) -> bool:
-        # use date, since otherwise the finer increments mess things up wrt stability
-        # so, 25% of days, or about 90 days/year
-        return get_date_hash(date) % 100 <= 25
+        return date in get_calendar(date.year).emailing_days
     
     def next_emailing_day(self, date: datetime.date) -> datetime.date:
-        return super().next_emailing_day(date)
+        curr_year = date.year
+        while True:
+            sorted_days = get_calendar(curr_year).sorted_days
+            day_idx = bisect.bisect_left(sorted_days, date)
+            if day_idx < len(sorted_days):
+                return sorted_days[day_idx]
+            curr_year += 1
 
-    def set_of_days_emailed(self, year:int) -> Iterator[datetime.date]:
-        return filter(self.should_email_day, days_in_year(year))
+    def emailing_days_between(self, start: datetime.date, end: datetime.date) -> List[datetime.date]:
+        res: List[datetime.date] = []
+        for curr_year in range(start.year, end.year + 1):
+            sorted_days = get_calendar(curr_year).sorted_days
+            res.extend(sorted_days[bisect.bisect_left(sorted_days, start):bisect.bisect_left(sorted_days, end)])
+        return res
+
+    def count_emailing_days(self, start: datetime.date, end: datetime.date) -> int:
+        res = 0
+        for curr_year in range(start.year, end.year + 1):
+            sorted_days = get_calendar(curr_year).sorted_days
+            res += max(0, bisect.bisect_left(sorted_days, end) - bisect.bisect_left(sorted_days, start))
+        return res
+
+    def set_of_days_emailed(self, year:int) -> FrozenSet[datetime.date]:
+        return get_calendar(year).emailing_days
+
+    def get_sorted_days(self, year: int) -> Tuple[datetime.date, ...]:
+        """ compile builds off the calendar, instead of hashing the year all over again """
+        return get_calendar(year).sorted_days
 
     @staticmethod
     def before_midyear(date: datetime.date) -> bool:
-        # midyear's day is july 2
-        return date < datetime.date(year=date.year, month=7, day=2)
+        return before_midyear(date)
 
     @staticmethod
     def split_emailed_set(set_of_days: Set[datetime.date]) -> Tuple[List[datetime.date], List[datetime.date]]:
@@ -34,12 +75,42 @@ class DefaultSchedule(ScheduleABC):
                 sorted(list(filter(lambda x: not DefaultSchedule.before_midyear(x), set_of_days))))
 
     def should_contact(self, person: Person, date: datetime.date) -> bool:
-        days_emailed: Set[datetime.date] = set(self.set_of_days_emailed(date.year))
-        fst_emailed, snd_emailed = DefaultSchedule.split_emailed_set(days_emailed)
+        calendar: YearCalendar = get_calendar(date.year)
         # assertion getting hit would not be happy
-        assert date in days_emailed
-        email_list = fst_emailed if self.before_midyear(date) else snd_emailed
-        total_cardinality = len(email_list)
-        curr_bucket = email_list.index(date)
-        return hash(person) % total_cardinality == curr_bucket
+        assert date in calendar.emailing_days
+        return hash(person) % calendar.cardinality(date) == calendar.buckets[date]
+
+    def contact_rule(self, date: datetime.date) -> Tuple[int, int]:
+        calendar: YearCalendar = get_calendar(date.year)
+        assert date in calendar.emailing_days
+        return (calendar.cardinality(date), calendar.buckets[date])
+
+    def contacts_for(self, roster: Iterable[Person], date: datetime.date) -> List[Person]:
+        calendar: YearCalendar = get_calendar(date.year)
+        assert date in calendar.emailing_days
+        total_cardinality = calendar.cardinality(date)
+        curr_bucket = calendar.buckets[date]
+        if isinstance(roster, Roster):
+            return roster.select_residue(total_cardinality, curr_bucket)
+        return [person for person in profiling.counted("people_evaluated", roster)
+                if hash(person) % total_cardinality == curr_bucket]
 
+    def partition_year(self, roster: Iterable[Person], year: int) -> Dict[datetime.date, List[Person]]:
+        """
+        One pass: everyone lands in exactly one day of each half
+        """
+        calendar: YearCalendar = get_calendar(year)
+        res: Dict[datetime.date, List[Person]] = {day: [] for day in sorted(calendar.emailing_days)}
+        if isinstance(roster, Roster):
+            for half in (calendar.fst_half, calendar.snd_half):
+                if half:
+                    groups = roster.group_by_residue(len(half))
+                    for idx, day in enumerate(half):
+                        res[day] = groups.get(idx, [])
+            return res
+        for person in profiling.counted("people_evaluated", roster):
+            person_hash = hash(person)
+            for half in (calendar.fst_half, calendar.snd_half):
+                if half:
+                    res[half[person_hash % len(half)]].append(person)
+        return res
@@ -1,8 +1,59 @@
 import os
 import getpass
+import hashlib
+import json
 import os.path
+import re
+import sys
 from .settings import Settings
-from typing import Optional
+from .utils import atomic_write_json
+from typing import Dict, Optional
+
+# every peep folder right in the dio dir
+FLAT_LAYOUT = 1
+# peeps/ab/cd/peep_name, ab and cd from a hash of the folder name
+SHARDED_LAYOUT = 2
+LAYOUTS: Dict[str, int] = {"flat": FLAT_LAYOUT, "sharded": SHARDED_LAYOUT}
+SHARDS_DIRNAME = "peeps"
+
+# filesystems where every stat and open is a round trip to somewhere else
+NETWORK_FS_TYPES = {"nfs", "nfs4", "cifs", "smbfs", "smb3", "9p", "ceph", "glusterfs", "afs", "fuse.sshfs", "fuse.rclone"}
+# peep files read at once on those. Local disks read them one after another
+NETWORK_LOAD_WORKERS = 16
+# set it to a number to say how many at once, whatever the filesystem
+LOAD_WORKERS_ENV = "DIO_LOAD_WORKERS"
+
+def get_fs_type(dirname: str, mounts_filename: str="/proc/mounts") -> Optional[str]:
+    """
+    Filesystem type of the mount dirname is on, None if there's no /proc/mounts (OSX and such)
+    """
+    try:
+        with open(mounts_filename, "r") as mounts_file:
+            mounts = [line.split()[1:3] for line in mounts_file if len(line.split()) >= 3]
+    except OSError:
+        return None
+    real_dirname = os.path.realpath(dirname)
+    res: Optional[str] = None
+    longest = -1
+    for mount_point, fs_type in mounts:
+        # spaces and such in mount points come escaped, like \040
+        mount_point = re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), mount_point)
+        is_under = real_dirname == mount_point or real_dirname.startswith(mount_point.rstrip("/") + "/")
+        if is_under and len(mount_point) > longest:
+            res, longest = fs_type, len(mount_point)
+    return res
+
+def get_env_load_workers() -> Optional[int]:
+    """ DIO_LOAD_WORKERS, None if it's not set or isn't a number """
+    env_workers = os.environ.get(LOAD_WORKERS_ENV)
+    if not env_workers:
+        return None
+    try:
+        return max(1, int(env_workers))
+    except ValueError:
+        print("{} should be a number, not {!r}, going by the filesystem instead".format(
+            LOAD_WORKERS_ENV, env_workers), file=sys.stderr)
+        return None
 
 class DioDir(object):
     """
@@ -12,11 +63,17 @@ class DioDir(object):
     """
     def __init__(self, dirname: str=None) -> None:
         if not dirname:
-            self.dirname = os.path.expanduser("~/.diogenes")
+            self.dirname = DioDir.get_default_dirname()
         else:
             self.dirname = str(dirname)
         if not os.path.exists(self.dirname):
             os.makedirs(self.dirname)
+        self.layout: Optional[int] = None
+        self.load_workers: Optional[int] = None
+
+    @staticmethod
+    def get_default_dirname() -> str:
+        return os.path.expanduser("~/.diogenes")
 
     def get_settings_filename(self) -> str:
         filename = "{}_settings.json".format(getpass.getuser())
@@ -27,14 +84,80 @@ class DioDir(object):
         If you use git to deal with this, as I do,
         you shouldn't check in settings.json, it has an app pwd
         """
-        with open(os.path.join(self.dirname, ".gitignore"), "r") as gitignore_file:
-            for line in gitignore_file:
-                # it's in the file already
-                if to_append in line:
-                    return
+        if os.path.exists(os.path.join(self.dirname, ".gitignore")):
+            with open(os.path.join(self.dirname, ".gitignore"), "r") as gitignore_file:
+                for line in gitignore_file:
+                    # it's in the file already
+                    if to_append in line:
+                        return
         with open(os.path.join(self.dirname, ".gitignore"), "a+") as gitignore_file:
             gitignore_file.write("{}\n".format(to_append))
 
+    def get_roster_version_filename(self) -> str:
+        return os.path.join(self.dirname, "roster_version.json")
+
+    def get_roster_version(self) -> int:
+        """
+        Goes up every time the roster changes. Derived files remember which version they were built from
+        """
+        try:
+            with open(self.get_roster_version_filename(), "r") as version_file:
+                return int(json.load(version_file))
+        except (OSError, ValueError):
+            return 0
+
+    def bump_roster_version(self) -> int:
+        new_version = self.get_roster_version() + 1
+        atomic_write_json(self.get_roster_version_filename(), new_version)
+        return new_version
+
+    def get_layout_filename(self) -> str:
+        return os.path.join(self.dirname, "layout.json")
+
+    def get_layout(self) -> int:
+        """
+        Flat unless `dio migrate-layout` said otherwise. Read once per DioDir
+        """
+        if self.layout is None:
+            try:
+                with open(self.get_layout_filename(), "r") as layout_file:
+                    self.layout = int(json.load(layout_file))
+            except (OSError, ValueError):
+                self.layout = FLAT_LAYOUT
+        return self.layout
+
+    def get_load_workers(self) -> int:
+        """
+        How many peep files to read at once. DIO_LOAD_WORKERS if it's set,
+        otherwise a bunch on network filesystems and 1 on local disks. Worked out once per DioDir
+        """
+        if self.load_workers is None:
+            env_workers = get_env_load_workers()
+            if env_workers is not None:
+                self.load_workers = env_workers
+            elif get_fs_type(self.dirname) in NETWORK_FS_TYPES:
+                self.load_workers = NETWORK_LOAD_WORKERS
+            else:
+                self.load_workers = 1
+        return self.load_workers
+
+    def set_layout(self, layout: int) -> None:
+        assert layout in LAYOUTS.values()
+        atomic_write_json(self.get_layout_filename(), layout)
+        self.layout = layout
+
+    def get_peep_dirname(self, key: str, layout: Optional[int]=None) -> str:
+        """
+        Where the peep folder named key goes, in this dio dir's layout or the one given
+        """
+        if layout is None:
+            layout = self.get_layout()
+        if layout == SHARDED_LAYOUT:
+            # stable between runs, unlike hash()
+            key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()
+            return os.path.join(self.dirname, SHARDS_DIRNAME, key_hash[:2], key_hash[2:4], key)
+        return self.dirname + "/" + key
+
     def get_settings(self) -> Optional[Settings]:
         settings_filename = self.get_settings_filename()
         if os.path.isfile(settings_filename):
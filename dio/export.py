@@ -0,0 +1,97 @@
+import contextlib
+import gzip
+import json
+import os
+import sys
+from .batch import BatchResult, batch_save
+from .dio_dir import DioDir
+from .person import Person
+from .roster_events import roster_changed
+from .roster_index import RosterIndex
+from typing import Callable, Iterator, IO, List, Optional, Set
+
+"""
+The roster as one JSONL file, one {"name": ..., "salt": ...} per line, gzipped if the file name ends in .gz.
+One file instead of a peep.json per peep, for backups and syncing.
+Notes don't go in it, they stay in the peep folders
+"""
+
+@contextlib.contextmanager
+def open_roster_file(filename: str, mode: str) -> Iterator[IO[str]]:
+    """ mode is "r" or "w". - is stdin or stdout """
+    if filename == "-":
+        std_file = sys.stdin if mode == "r" else sys.stdout
+        yield std_file
+    elif filename.endswith(".gz"):
+        with gzip.open(filename, mode + "t", encoding="utf-8") as gz_file:
+            yield gz_file
+    else:
+        with open(filename, mode, encoding="utf-8") as roster_file:
+            yield roster_file
+
+def export_roster(dio_dir: DioDir, out_file: IO[str]) -> int:
+    """
+    Everyone, salts and all, in folder name order. Returns how many.
+    A line goes out as each peep comes in, the roster's never all in memory
+    """
+    num_peeps = 0
+    for peep in Person.iter_all(dio_dir):
+        out_file.write(json.dumps({"name": peep.name, "salt": peep.salt}) + "\n")
+        num_peeps += 1
+    return num_peeps
+
+def iter_roster_file(in_file: IO[str]) -> Iterator[Person]:
+    for line_num, line in enumerate(in_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            json_res = json.loads(line)
+            peep = Person(name=json_res["name"], salt=str(json_res["salt"]))
+            # same check hash(peep) would do, but now, with the line number
+            int(peep.salt)
+        except (ValueError, KeyError, TypeError) as exc:
+            raise Exception("Line {} isn't a peep: {}".format(line_num, exc))
+        yield peep
+
+def import_roster(dio_dir: DioDir,
+                  in_file: IO[str],
+                  replace: bool=False,
+                  workers: int=8,
+                  progress: Optional[Callable[[BatchResult], None]]=None) -> BatchResult:
+    """
+    Upserts everyone in the file through batch_save, so the index and everything derived
+    from the roster get rebuilt once, not once a peep.
+    Only peep.json files get written, notes are left alone.
+    replace also takes out the peeps who aren't in the file, but only their peep.json:
+    the folder and notes stay, and importing them again brings them back.
+
+    A file that can seek gets read through once to check every line before anything's written,
+    so a bad line anywhere means nothing gets imported.
+    A pipe can't be read twice: a bad line there stops the import partway,
+    with the peeps before it saved and nobody taken out by replace
+    """
+    if in_file.seekable():
+        for _ in iter_roster_file(in_file):
+            pass
+        in_file.seek(0)
+    imported_keys: Set[str] = set()
+    def note_key(peeps: Iterator[Person]) -> Iterator[Person]:
+        for peep in peeps:
+            imported_keys.add(peep.get_key())
+            yield peep
+    res = batch_save(dio_dir, note_key(iter_roster_file(in_file)), workers=workers, progress=progress)
+    if replace:
+        index = RosterIndex.load(dio_dir)
+        removed: List[Person] = []
+        for peep_dirname in list(Person.iter_dirs(dio_dir)):
+            if os.path.basename(peep_dirname) in imported_keys:
+                continue
+            peep_json_filename = Person.get_filename(peep_dirname)
+            if not os.path.exists(peep_json_filename):
+                continue
+            removed.append(Person.from_file(peep_json_filename))
+            os.remove(peep_json_filename)
+            index.remove(peep_dirname)
+        index.save()
+        roster_changed(dio_dir, [], removed)
+    return res
@@ -0,0 +1,125 @@
+import concurrent.futures
+import dataclasses
+import datetime
+import glob
+import os.path
+import time
+from .dio_dir import DioDir
+from .mailer import make_message
+from .recs import get_next_emailing_day, get_recs, recs_to_message
+from .schedules import get_schedule
+from .settings import Settings
+from . import spool
+from typing import Any, Iterable, List, Optional
+
+"""
+Recs for a lot of dio dirs in one go, for one box doing recs for lots of rosters without a `dio serve`.
+Each dio dir gets worked out in a process pool, then the mail goes in each dio dir's spool,
+same as `dio recs`, for that dio dir's `dio flush` to send.
+One dio dir blowing up doesn't stop the rest
+"""
+
+@dataclasses.dataclass
+class DirResult(object):
+    dirname: str
+    message: Optional[str] = None
+    # None if it didn't get as far as the settings or there aren't any
+    settings: Optional[Settings] = None
+    num_recs: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+    # None if it wasn't spooled, False if that date's recs were spooled or sent already
+    spooled: Optional[bool] = None
+    sent: bool = False
+
+def expand_dirnames(patterns: Iterable[str]) -> List[str]:
+    """
+    Globs, and plain dio dir names. Each once, in the order given.
+    One that doesn't match any dir stays in as is, so it shows up as a failure instead of not at all
+    """
+    res: List[str] = []
+    for pattern in patterns:
+        matches = [dirname for dirname in sorted(glob.glob(os.path.expanduser(pattern))) if os.path.isdir(dirname)]
+        if not matches:
+            matches = [pattern]
+        for dirname in matches:
+            if dirname not in res:
+                res.append(dirname)
+    return res
+
+def compute_dir_recs(dirname: str, schedule_name: str, date: datetime.date) -> DirResult:
+    """ Never raises, whatever went wrong goes in the result """
+    res = DirResult(dirname=dirname)
+    if not os.path.isdir(dirname):
+        # not DioDir, that'd make it
+        res.error = "No such dio dir"
+        return res
+    start = time.perf_counter()
+    try:
+        dio_dir = DioDir(dirname)
+        schedule = get_schedule(schedule_name)
+        recs = get_recs(dio_dir, schedule, date)
+        res.num_recs = len(recs) if recs is not None else 0
+        res.message = recs_to_message(recs, get_next_emailing_day(dio_dir, schedule, date))
+        res.settings = dio_dir.get_settings()
+    except Exception as exc:
+        res.error = "{}: {}".format(type(exc).__name__, exc)
+    res.seconds = time.perf_counter() - start
+    return res
+
+def fan_out(dirnames: List[str], schedule_name: str, date: datetime.date, workers: int=4) -> List[DirResult]:
+    """ In the order given. workers=1 does it all in this process """
+    if workers <= 1:
+        return [compute_dir_recs(dirname, schedule_name, date) for dirname in dirnames]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(compute_dir_recs, dirnames,
+                                 [schedule_name] * len(dirnames), [date] * len(dirnames)))
+
+def spool_results(results: List[DirResult], date: datetime.date) -> List[DirResult]:
+    """
+    Spools every result that has a message in its own dio dir, so each dio dir only ever gets a date once.
+    Returns the ones that have a spool to flush, and puts why on the ones that don't
+    """
+    to_flush = []
+    for res in results:
+        if res.error is not None:
+            continue
+        if res.settings is None:
+            res.error = "Have to setup diogenes to get emails. Run `dio setupemail`"
+            continue
+        try:
+            res.spooled = spool.spool_message(DioDir(res.dirname), make_message(res.message, date, res.settings), date)
+        except Exception as exc:
+            res.error = "{}: {}".format(type(exc).__name__, exc)
+            continue
+        to_flush.append(res)
+    return to_flush
+
+def flush_results(results: List[DirResult], date: datetime.date, **flush_kwargs: Any) -> None:
+    """
+    `dio flush` for each of spool_results' dio dirs, one after the other, for recs --dirs --wait
+    """
+    for res in results:
+        assert res.settings is not None
+        flush_res = spool.flush(DioDir(res.dirname), res.settings, **flush_kwargs)
+        res.sent = date in flush_res.sent
+        if flush_res.error is not None:
+            res.error = "{}: {}".format(type(flush_res.error).__name__, flush_res.error)
+
+def format_summary(results: List[DirResult]) -> str:
+    lines = []
+    for res in results:
+        if res.error is not None:
+            status = "FAILED {}".format(res.error)
+        elif res.sent:
+            status = "emailed"
+        elif res.spooled:
+            status = "spooled"
+        elif res.spooled is not None:
+            status = "spooled or emailed already"
+        else:
+            status = "not emailed"
+        lines.append("{}: {} recs in {:.2f}s, {}".format(res.dirname, res.num_recs, res.seconds, status))
+    num_failed = sum(res.error is not None for res in results)
+    lines.append("{} dio dirs, {} failed".format(len(results), num_failed))
+    return "\n".join(lines)
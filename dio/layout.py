@@ -0,0 +1,64 @@
+import os
+import os.path
+from .dio_dir import DioDir, FLAT_LAYOUT, SHARDS_DIRNAME
+from .person import Person
+from .roster_index import RosterIndex
+from typing import Callable, Optional
+
+def remove_empty_shards(dio_dir: DioDir) -> None:
+    """
+    Takes away shard folders with no peeps left in them, and the peeps folder if that's empty too
+    """
+    shards_dirname = os.path.join(dio_dir.dirname, SHARDS_DIRNAME)
+    if not os.path.isdir(shards_dirname):
+        return
+    for fst_name in os.listdir(shards_dirname):
+        fst_dirname = os.path.join(shards_dirname, fst_name)
+        for snd_name in os.listdir(fst_dirname):
+            remove_if_empty(os.path.join(fst_dirname, snd_name))
+        remove_if_empty(fst_dirname)
+    remove_if_empty(shards_dirname)
+
+def remove_if_empty(dirname: str) -> None:
+    try:
+        os.rmdir(dirname)
+    except OSError:
+        # not empty
+        pass
+
+def migrate_layout(dio_dir: DioDir,
+                   layout: int,
+                   progress: Optional[Callable[[int], None]]=None,
+                   save_every: int=1000) -> int:
+    """
+    Moves every peep folder over to the layout, in place, notes and all. Returns how many moved.
+
+    The dio dir says it's in the new layout before anything moves,
+    so new saves go straight there, and anything not moved yet still gets found (see Person.find_dir).
+    Moves are renames, so a peep is always in exactly one place.
+    Interrupted, just run it again, it picks up whatever's left
+    """
+    dio_dir.set_layout(layout)
+    index = RosterIndex.load(dio_dir)
+    num_moved = 0
+    for peep_dirname in list(Person.iter_dirs(dio_dir)):
+        new_peep_dirname = dio_dir.get_peep_dirname(os.path.basename(peep_dirname), layout)
+        if os.path.abspath(peep_dirname) == os.path.abspath(new_peep_dirname):
+            continue
+        if os.path.exists(new_peep_dirname):
+            raise Exception("{} and {} are the same peep, sort that out by hand".format(
+                peep_dirname, new_peep_dirname))
+        os.makedirs(os.path.dirname(new_peep_dirname), exist_ok=True)
+        os.rename(peep_dirname, new_peep_dirname)
+        index.move(peep_dirname, new_peep_dirname)
+        num_moved += 1
+        if num_moved % save_every == 0:
+            # so a rerun doesn't have to reparse everything that moved
+            index.save()
+            if progress is not None:
+                progress(num_moved)
+    if index.dirty:
+        index.save()
+    if layout == FLAT_LAYOUT:
+        remove_empty_shards(dio_dir)
+    return num_moved
@@ -0,0 +1,138 @@
+import concurrent.futures
+import dataclasses
+import datetime
+import email.message
+import smtplib
+from .settings import Settings
+from . import profiling
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# the errors where hanging up and dialing again has a shot at working
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError)
+
+def make_message(contents: str, date: datetime.date, settings: Settings) -> email.message.EmailMessage:
+    msg_obj: email.message.EmailMessage = email.message.EmailMessage()
+    msg_obj['From'] = settings.smtp_username
+    msg_obj['To'] = settings.smtp_dest_email
+    msg_obj['Subject'] = "Diogenes | {}".format(str(date))
+    msg_obj.set_content(contents)
+    return msg_obj
+
+class Mailer(object):
+    """
+    One logged in SMTP session, kept open across messages.
+    Use it as a context manager so the session gets closed.
+
+    smtp_factory is there so tests can hand in a stand-in for smtplib.SMTP
+    """
+    def __init__(self,
+                 settings: Settings,
+                 smtp_factory: Callable[..., Any]=smtplib.SMTP,
+                 starttls: bool=True,
+                 retries: int=2) -> None:
+        self.settings = settings
+        self.smtp_factory = smtp_factory
+        self.starttls = starttls
+        self.retries = retries
+        self.server: Optional[Any] = None
+
+    def connect(self) -> None:
+        self.close()
+        server = self.smtp_factory(self.settings.smtp_url, self.settings.smtp_port)
+        server.ehlo()
+        if self.starttls:
+            server.starttls()
+        server.login(self.settings.smtp_username, self.settings.smtp_password)
+        self.server = server
+
+    def close(self) -> None:
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except RECONNECT_ERRORS:
+                # already hung up on us, nothing to close
+                pass
+            self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @profiling.timed("send_message")
+    def send(self, msg_obj: email.message.EmailMessage) -> None:
+        """
+        Connects lazily, and reconnects if the server hung up on us in the meantime.
+        Everything that emails goes through here, so the profile's send_message is all the SMTP time
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                if self.server is None:
+                    self.connect()
+                self.server.send_message(msg_obj)
+                return
+            except RECONNECT_ERRORS:
+                self.server = None
+                if attempt == self.retries:
+                    raise
+
+    def send_all(self, msg_objs: Iterable[email.message.EmailMessage]) -> int:
+        num_sent = 0
+        for msg_obj in msg_objs:
+            self.send(msg_obj)
+            num_sent += 1
+        return num_sent
+
+def get_settings_key(settings: Settings) -> Tuple:
+    """ Settings isn't hashable, it's mutable """
+    return dataclasses.astuple(settings)
+
+def deliver_all(deliveries: Iterable[Tuple[Settings, email.message.EmailMessage]],
+                max_connections: int=4,
+                smtp_factory: Callable[..., Any]=smtplib.SMTP,
+                starttls: bool=True) -> List[Optional[BaseException]]:
+    """
+    Sends everything, one session per distinct set of SMTP settings,
+    with at most max_connections sessions open at once.
+    One destination failing doesn't stop the others, and within a destination
+    the first message that won't go stops the rest of its messages.
+    Returns, for every delivery in the order given, the error that stopped it, or None if it went out
+    """
+    res: List[Optional[BaseException]] = []
+    grouped: Dict[Tuple, Tuple[Settings, List[int]]] = {}
+    msg_objs: List[email.message.EmailMessage] = []
+    for delivery_idx, (settings, msg_obj) in enumerate(deliveries):
+        grouped.setdefault(get_settings_key(settings), (settings, []))[1].append(delivery_idx)
+        msg_objs.append(msg_obj)
+        res.append(None)
+
+    def deliver_group(settings: Settings, delivery_idxs: List[int]) -> None:
+        """ Each thread only writes its own deliveries' slots in res """
+        with Mailer(settings, smtp_factory=smtp_factory, starttls=starttls) as mailer:
+            for pos, delivery_idx in enumerate(delivery_idxs):
+                try:
+                    mailer.send(msg_objs[delivery_idx])
+                except Exception as exc:
+                    for unsent_idx in delivery_idxs[pos:]:
+                        res[unsent_idx] = exc
+                    return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = [executor.submit(deliver_group, settings, delivery_idxs)
+                   for settings, delivery_idxs in grouped.values()]
+        for future in futures:
+            # the close on the way out can't lose any messages, they're all accounted for by then
+            future.exception()
+    return res
+
+def send_message(contents: str, date: datetime.date, settings: Settings, mailer: Optional[Mailer]=None) -> None:
+    """
+    Pass in a mailer to reuse its session, otherwise it's one session just for this
+    """
+    msg_obj: email.message.EmailMessage = make_message(contents, date, settings)
+    if mailer is not None:
+        mailer.send(msg_obj)
+    else:
+        with Mailer(settings) as new_mailer:
+            new_mailer.send(msg_obj)
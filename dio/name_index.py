@@ -0,0 +1,156 @@
+import bisect
+import json
+import os
+import os.path
+from .dio_dir import DioDir
+from .person import Person
+from .roster import Roster
+from .roster_events import on_roster_change
+from .utils import atomic_write_json
+from . import profiling
+from typing import Any, Dict, List, Optional
+
+NAME_INDEX_FILENAME = "name_index.json"
+NAME_INDEX_VERSION = 1
+
+class NameIndex(object):
+    """
+    Every peep name, sorted, with the peep folder name (key) it goes with.
+    Prefix search is a bisect, looking up one name is a dict lookup.
+    Remembers the roster version it's of, and rebuilds itself off the roster when that's stale
+    """
+    def __init__(self, dio_dir: DioDir, roster_version: int, names: List[str], keys: Dict[str, str]) -> None:
+        self.dio_dir = dio_dir
+        self.roster_version = roster_version
+        self.names = names
+        self.keys = keys
+        # one peep per folder, so saving a name that shares a folder replaces whoever was in it
+        self.names_by_key = {key: name for name, key in keys.items()}
+
+    @staticmethod
+    def get_filename(dio_dir: DioDir) -> str:
+        return os.path.join(dio_dir.dirname, NAME_INDEX_FILENAME)
+
+    @staticmethod
+    def build(dio_dir: DioDir):
+        roster = Roster.load(dio_dir)
+        # after the roster's been read, reading it can bump the version
+        roster_version = dio_dir.get_roster_version()
+        keys = {peep.name: peep.get_key() for peep in roster}
+        return NameIndex(dio_dir, roster_version, sorted(keys), keys)
+
+    @staticmethod
+    def load(dio_dir: DioDir) -> Optional["NameIndex"]:
+        """ None if missing or unreadable, whether or not it's current """
+        profiling.count("files_opened")
+        try:
+            with open(NameIndex.get_filename(dio_dir), "r") as index_file:
+                json_res: Dict[str, Any] = json.load(index_file)
+        except (OSError, ValueError):
+            return None
+        if json_res.get("version") != NAME_INDEX_VERSION:
+            return None
+        # saved sorted already
+        names = [name for name, _ in json_res["peeps"]]
+        return NameIndex(dio_dir, json_res["roster_version"], names, dict(json_res["peeps"]))
+
+    @staticmethod
+    def rebuild(dio_dir: DioDir):
+        index = NameIndex.build(dio_dir)
+        index.save()
+        return index
+
+    @staticmethod
+    def load_current(dio_dir: DioDir):
+        """
+        Rebuilds it if it's missing or the roster version moved on.
+        Peep folders edited by hand only show up once something reads the whole roster
+        (recs, plan, a miss in get_dir), which notices and bumps the version
+        """
+        index = NameIndex.load(dio_dir)
+        if index is None or index.roster_version != dio_dir.get_roster_version():
+            index = NameIndex.rebuild(dio_dir)
+        return index
+
+    def save(self) -> None:
+        index_filename = NameIndex.get_filename(self.dio_dir)
+        is_new = not os.path.exists(index_filename)
+        atomic_write_json(index_filename, {
+            "version": NAME_INDEX_VERSION,
+            "roster_version": self.roster_version,
+            "peeps": [[name, self.keys[name]] for name in self.names],
+        })
+        if is_new:
+            self.dio_dir.append_to_gitignore(NAME_INDEX_FILENAME)
+
+    def find(self, prefix: str) -> List[str]:
+        """ Names starting with prefix, sorted """
+        res = []
+        for name in self.names[bisect.bisect_left(self.names, prefix):]:
+            if not name.startswith(prefix):
+                break
+            res.append(name)
+        return res
+
+    def get_key(self, name: str) -> Optional[str]:
+        return self.keys.get(name)
+
+    def refresh(self) -> None:
+        """ Rebuilds it off the roster in place """
+        rebuilt = NameIndex.rebuild(self.dio_dir)
+        self.roster_version = rebuilt.roster_version
+        self.names = rebuilt.names
+        self.keys = rebuilt.keys
+        self.names_by_key = rebuilt.names_by_key
+
+    def _find_dir(self, name: str) -> Optional[str]:
+        if name not in self.keys:
+            return None
+        peep_dirname = Person(name=name).find_dir(self.dio_dir)
+        if not os.path.exists(Person.get_filename(peep_dirname)):
+            return None
+        return peep_dirname
+
+    def get_dir(self, name: str) -> Optional[str]:
+        """
+        The peep folder, whichever layout it's in. None if there's nobody by that name.
+        A miss could be somebody in the folders by hand, so it refreshes and looks again before giving up
+        """
+        peep_dirname = self._find_dir(name)
+        if peep_dirname is None:
+            self.refresh()
+            peep_dirname = self._find_dir(name)
+        return peep_dirname
+
+    def remove(self, key: str) -> None:
+        """ Whoever's in that peep folder """
+        name = self.names_by_key.pop(key, None)
+        if name is not None:
+            del self.keys[name]
+            del self.names[bisect.bisect_left(self.names, name)]
+
+    def upsert(self, name: str, key: str) -> None:
+        if self.names_by_key.get(key) != name:
+            self.remove(key)
+            bisect.insort(self.names, name)
+        self.keys[name] = key
+        self.names_by_key[key] = name
+
+@on_roster_change
+def patch_name_index(dio_dir: DioDir,
+                     upserted: List[Person],
+                     deleted: List[Person],
+                     old_version: int,
+                     new_version: int) -> None:
+    """
+    Only patched if it was current, a stale one gets rebuilt next time somebody wants it
+    """
+    index = NameIndex.load(dio_dir)
+    if index is None or index.roster_version != old_version:
+        return
+    for peep in deleted:
+        index.remove(peep.get_key())
+    for peep in upserted:
+        index.upsert(peep.name, peep.get_key())
+    index.roster_version = new_version
+    index.save()
@@ -4,8 +4,12 @@ import os
 import os.path
 import json
 import shutil
-from .dio_dir import DioDir
-from typing import Dict, List, Any
+from .dio_dir import DioDir, LAYOUTS, SHARDS_DIRNAME
+from .roster_index import RosterIndex
+from .roster_events import roster_changed
+from .utils import atomic_write_json, ordered_map
+from . import profiling
+from typing import Dict, List, Any, Optional, Set, Iterator, Tuple
 
 @dataclasses.dataclass
 class Person(object):
@@ -19,27 +23,57 @@ class Person(object):
         return int(self.salt)
 
     def to_file(self, person_filename: str) -> None:
-        with open(person_filename, "w") as person_file:
-            json.dump(dataclasses.asdict(self), person_file)
+        atomic_write_json(person_filename, dataclasses.asdict(self))
+
+    def get_key(self) -> str:
+        """
+        Name of the peep folder. Two peeps with the same key are the same peep as far as the disk is concerned
+        """
+        return "peep_{}".format(os.path.basename(self.name))
 
     def get_dir(self, dio_dir: DioDir) -> str:
-        return dio_dir.dirname +\
-                "/peep_{}".format(os.path.basename(self.name))
+        return dio_dir.get_peep_dirname(self.get_key())
 
-    def save(self, dio_dir: DioDir) -> None:
-        """ upserts """
+    def find_dir(self, dio_dir: DioDir) -> str:
+        """
+        Where the peep folder actually is. Halfway through a `dio migrate-layout`
+        it could be in the old layout still. get_dir if it's nowhere yet
+        """
         peep_dirname = self.get_dir(dio_dir)
-        if not os.path.exists(peep_dirname):
-            os.makedirs(peep_dirname)
+        if os.path.exists(peep_dirname):
+            return peep_dirname
+        for layout in LAYOUTS.values():
+            other_dirname = dio_dir.get_peep_dirname(self.get_key(), layout)
+            if os.path.exists(other_dirname):
+                return other_dirname
+        return peep_dirname
+
+    def save(self, dio_dir: DioDir, index: Optional[RosterIndex]=None) -> None:
+        """
+        upserts
+        Pass in an index when saving a lot of peeps,
+        then you save the index and call roster_changed once yourself
+        """
+        peep_dirname = self.find_dir(dio_dir)
+        os.makedirs(peep_dirname, exist_ok=True)
         peep_json_filename = Person.get_filename(peep_dirname)
         self.to_file(peep_json_filename)
+        curr_index = index if index is not None else RosterIndex.load(dio_dir)
+        curr_index.record(peep_dirname, self.name, self.salt, os.stat(peep_json_filename))
+        if index is None:
+            curr_index.save()
+            roster_changed(dio_dir, [self], [])
 
     def delete(self, dio_dir: DioDir) -> None:
-        peep_dirname = self.get_dir(dio_dir)
+        peep_dirname = self.find_dir(dio_dir)
         if not os.path.exists(peep_dirname):
             raise Exception("Peep directory does not exist to delete")
         else:
             shutil.rmtree(peep_dirname)
+            index = RosterIndex.load(dio_dir)
+            index.remove(peep_dirname)
+            index.save()
+            roster_changed(dio_dir, [], [self])
 
     @staticmethod
     def get_filename(dirname: str) -> str:
@@ -47,6 +81,7 @@ class Person(object):
 
     @staticmethod
     def from_file(person_filename: str):
+        profiling.count("files_opened")
         with open(person_filename, "r") as person_file:
             json_res: Dict[str, Any] = json.load(person_file)
             return Person(**json_res)
@@ -57,11 +92,79 @@ class Person(object):
         return Person.from_file(person_filepath)
 
     @staticmethod
-    def get_all(dio_dir: DioDir):
-        res = []
-        for dirpath, _, filenames in os.walk(dio_dir.dirname):
-            if "peep_" in dirpath and "peep.json" in filenames:
-                res.append(Person.from_dir(dirpath))
-        return res
+    def scan_peep_dirs(dirname: str) -> List[Tuple[str, str]]:
+        """ (folder name, path) of the peep folders right inside dirname """
+        with os.scandir(dirname) as entries:
+            return [(entry.name, entry.path) for entry in entries
+                    if entry.name.startswith("peep_") and entry.is_dir()]
 
+    @staticmethod
+    def iter_dirs(dio_dir: DioDir) -> Iterator[str]:
+        """
+        Peep folders only ever live at the top of the dio dir or two shard folders down,
+        so never go looking inside them (that's where the notes are).
+        Looks in both layouts, whichever the dio dir is in, since a migrate-layout can get interrupted.
+        Sorted by folder name, so the roster is in the same order whatever the layout
+        """
+        peep_dirs = Person.scan_peep_dirs(dio_dir.dirname)
+        shards_dirname = os.path.join(dio_dir.dirname, SHARDS_DIRNAME)
+        if os.path.isdir(shards_dirname):
+            with os.scandir(shards_dirname) as fst_entries:
+                fst_dirnames = [entry.path for entry in fst_entries if entry.is_dir()]
+            for fst_dirname in fst_dirnames:
+                with os.scandir(fst_dirname) as snd_entries:
+                    snd_dirnames = [entry.path for entry in snd_entries if entry.is_dir()]
+                for snd_dirname in snd_dirnames:
+                    peep_dirs.extend(Person.scan_peep_dirs(snd_dirname))
+        for _, peep_dirname in sorted(peep_dirs):
+            yield peep_dirname
 
+    @staticmethod
+    def iter_all(dio_dir: DioDir) -> Iterator["Person"]:
+        """
+        Lazily yields everyone, in directory name order.
+        Stats every peep.json, but only opens the ones the roster index doesn't know about.
+        On network filesystems the stats and opens go through a thread pool (DioDir.get_load_workers),
+        the order stays the same.
+        The index gets written back once the whole roster has been gone through
+        """
+        index = RosterIndex.load(dio_dir)
+        seen_relpaths: Set[str] = set()
+        reparsed: List[Person] = []
+
+        def read_peep_dir(peep_dirname: str) -> Optional[Tuple[str, os.stat_result, Optional[Person]]]:
+            """ Only reads the index, the index gets written to back in the loop """
+            peep_json_filename = Person.get_filename(peep_dirname)
+            try:
+                peep_stat = os.stat(peep_json_filename)
+            except OSError:
+                # peep.json got deleted by hand
+                return None
+            if index.lookup(peep_dirname, peep_stat) is not None:
+                return peep_dirname, peep_stat, None
+            return peep_dirname, peep_stat, Person.from_file(peep_json_filename)
+
+        for read_res in ordered_map(read_peep_dir, Person.iter_dirs(dio_dir), dio_dir.get_load_workers()):
+            if read_res is None:
+                continue
+            peep_dirname, peep_stat, parsed_peep = read_res
+            if parsed_peep is not None:
+                peep = parsed_peep
+                index.record(peep_dirname, peep.name, peep.salt, peep_stat)
+                reparsed.append(peep)
+            else:
+                entry = index.lookup(peep_dirname, peep_stat)
+                peep = Person(name=entry["name"], salt=entry["salt"])
+            seen_relpaths.add(index.relpath(peep_dirname))
+            yield peep
+        pruned = [Person(name=entry["name"], salt=entry["salt"])
+                  for entry in index.prune(seen_relpaths)]
+        if index.dirty:
+            index.save()
+            # somebody's been editing peep folders by hand
+            roster_changed(dio_dir, reparsed, pruned)
+
+    @staticmethod
+    @profiling.timed("get_all")
+    def get_all(dio_dir: DioDir):
+        return list(Person.iter_all(dio_dir))
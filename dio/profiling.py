@@ -0,0 +1,104 @@
+import functools
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, TypeVar
+
+"""
+Named timing spans and counters, for `dio --profile`.
+Off unless something calls enable(), and when it's off nothing gets timed or counted
+"""
+
+T = TypeVar("T")
+
+enabled = False
+_spans: Dict[str, List[float]] = {}
+_counters: Dict[str, int] = {}
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+def reset() -> None:
+    _spans.clear()
+    _counters.clear()
+
+class _Span(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        span_stats = _spans.setdefault(self.name, [0, 0.0])
+        span_stats[0] += 1
+        span_stats[1] += time.perf_counter() - self.start
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str):
+    """ with profiling.span("thing"): ... """
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+def timed(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """ decorator, wraps the whole call in a span """
+    def decorator(fn: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs) -> T:
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, amount: int=1) -> None:
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def counted(name: str, items: Iterable[T]) -> Iterable[T]:
+    """
+    Counts items as they go by. Hands the iterable straight back when profiling is off
+    """
+    if not enabled:
+        return items
+    return _count_items(name, items)
+
+def _count_items(name: str, items: Iterable[T]) -> Iterator[T]:
+    for item in items:
+        _counters[name] = _counters.get(name, 0) + 1
+        yield item
+
+def get_report() -> Dict[str, Any]:
+    return {
+        "spans": {name: {"calls": int(calls), "secs": secs}
+                  for name, (calls, secs) in sorted(_spans.items())},
+        "counters": dict(sorted(_counters.items())),
+    }
+
+def format_report(fmt: str="text") -> str:
+    report = get_report()
+    if fmt == "json":
+        return json.dumps(report, indent=2)
+    lines = ["{:<24} {:>8} {:>12}".format("span", "calls", "secs")]
+    for name, span_stats in report["spans"].items():
+        lines.append("{:<24} {:>8} {:>12.6f}".format(name, span_stats["calls"], span_stats["secs"]))
+    lines.append("{:<24} {:>8}".format("counter", "count"))
+    for name, curr_count in report["counters"].items():
+        lines.append("{:<24} {:>8}".format(name, curr_count))
+    return "\n".join(lines)
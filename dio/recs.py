@@ -0,0 +1,43 @@
+import datetime
+from .compiled_schedule import CompiledYear
+from .dio_dir import DioDir
+from .person import Person
+from .roster import Roster
+from .roster_snapshot import RosterSnapshot
+from .schedule_abc import ScheduleABC
+from .year_plan import YearPlan
+from . import profiling
+from typing import Optional, List
+
+@profiling.timed("get_recs")
+def get_recs(dio_dir: DioDir, schedule: ScheduleABC, date_to_rec: datetime.date) -> Optional[List[Person]]:
+    """
+    Reads them off the year plan, if `dio plan` made one and it's current:
+    a couple of small files, without checking the peep folders (see patch_plans)
+    """
+    compiled: CompiledYear = schedule.compile(date_to_rec.year)
+    if not compiled.is_emailing_day(date_to_rec):
+        return None
+    snapshot: Optional[RosterSnapshot] = RosterSnapshot.load_current(dio_dir, verify=False)
+    if snapshot is not None and YearPlan.is_current(dio_dir, schedule, date_to_rec.year, snapshot):
+        return YearPlan.read_day(dio_dir, schedule, date_to_rec)
+    roster: Roster = Roster.load(dio_dir)
+    # not compiled.contacts_for, some schedules need the whole roster to say who.
+    # Real Persons out of the roster's views, same as the year plan hands back
+    return [Person(name=peep.name, salt=peep.salt)
+            for peep in schedule.contacts_for(roster, date_to_rec)]
+
+def get_next_emailing_day(dio_dir: DioDir, schedule: ScheduleABC, date: datetime.date) -> datetime.date:
+    """ Emailing days don't depend on who's in the roster, the schedule knows them without a plan """
+    return schedule.next_emailing_day(date)
+
+@profiling.timed("recs_to_message")
+def recs_to_message(res: Optional[List[Person]], next_day: datetime.date) -> str:
+    if res is None:
+        return "Next emailing day is : {}".format(next_day)
+    elif res == []:
+        return "Emailing day, but no peeps today. Add more peeps."
+    else:
+        return "\n".join(
+            [peep.name for peep in res]
+        )
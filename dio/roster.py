@@ -0,0 +1,140 @@
+import array
+from .dio_dir import DioDir
+from .person import Person
+from .roster_index import RosterIndex
+from . import profiling
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+class PersonView(object):
+    """
+    A peep in a Roster, made on demand. Reads like a Person and hashes like one,
+    but it's two slots, not a dataclass with a dict, and the hash is already worked out.
+    to_person() for a real Person, to save and such
+    """
+    __slots__ = ("roster", "idx")
+
+    def __init__(self, roster: "Roster", idx: int) -> None:
+        self.roster = roster
+        self.idx = idx
+
+    @property
+    def name(self) -> str:
+        return self.roster.names[self.idx]
+
+    @property
+    def salt(self) -> str:
+        return self.roster.salts[self.idx]
+
+    def __hash__(self) -> int:
+        return self.roster.hashes[self.idx]
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, (Person, PersonView)):
+            return NotImplemented
+        return (self.name, self.salt) == (other.name, other.salt)
+
+    def __repr__(self) -> str:
+        return "PersonView(name={!r}, salt={!r})".format(self.name, self.salt)
+
+    def get_key(self) -> str:
+        return Person.get_key(self)
+
+    def get_dir(self, dio_dir: DioDir) -> str:
+        return Person.get_dir(self, dio_dir)
+
+    def to_person(self) -> Person:
+        return Person(name=self.name, salt=self.salt)
+
+class Roster(object):
+    """
+    Everyone, as parallel arrays: names, salts, and hash(peep) as int64s.
+    hash(peep) gets worked out once when the peep goes in,
+    so the schedules never parse a salt again.
+    Every schedule takes one of these wherever it takes a list of peeps
+    """
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.salts: List[str] = []
+        self.hashes: array.array = array.array("q")
+        self.positions: Dict[str, int] = {}
+
+    @staticmethod
+    def from_people(people: Iterable[Any]) -> "Roster":
+        res = Roster()
+        for person in people:
+            res.append(person)
+        return res
+
+    @staticmethod
+    def from_columns(names: Iterable[str], salts: Iterable[str], hashes: Iterable[int]) -> "Roster":
+        """ Off columns somebody already worked out, hashes and all, so no salts get parsed """
+        res = Roster()
+        res.names = list(names)
+        res.salts = list(salts)
+        res.hashes = array.array("q", hashes)
+        # last one wins, same as appending them
+        res.positions = {name: idx for idx, name in enumerate(res.names)}
+        return res
+
+    @staticmethod
+    @profiling.timed("roster_load")
+    def load(dio_dir: DioDir) -> "Roster":
+        """
+        Straight off the roster snapshot if it's current, otherwise off the peep folders,
+        and then the snapshot gets written so it's there next time
+        """
+        # the snapshot is a kind of Roster, so it can't be imported up top
+        from .roster_snapshot import RosterSnapshot
+        snapshot = RosterSnapshot.load_current(dio_dir)
+        if snapshot is not None:
+            return snapshot
+        roster_version = dio_dir.get_roster_version()
+        res = Roster.from_people(Person.iter_all(dio_dir))
+        # if iter_all found changes, the snapshot's listener just wrote it
+        if dio_dir.get_roster_version() == roster_version:
+            # iter_all just brought the index up to date
+            RosterSnapshot.write(dio_dir, RosterIndex.load(dio_dir), roster_version)
+        return res
+
+    def append(self, person: Any) -> None:
+        self.positions[person.name] = len(self.names)
+        self.names.append(person.name)
+        self.salts.append(person.salt)
+        # same folding python does to what Person.__hash__ returns
+        self.hashes.append(hash(person))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, idx: int) -> PersonView:
+        if not -len(self) <= idx < len(self):
+            raise IndexError("roster index out of range")
+        return PersonView(self, idx % len(self))
+
+    def __iter__(self) -> Iterator[PersonView]:
+        for idx in range(len(self)):
+            yield PersonView(self, idx)
+
+    def __contains__(self, name: Any) -> bool:
+        return name in self.positions
+
+    def get(self, name: str) -> Optional[PersonView]:
+        """ By name, None if they're not in here """
+        idx = self.positions.get(name)
+        if idx is None:
+            return None
+        return PersonView(self, idx)
+
+    def select_residue(self, modulus: int, residue: int) -> List[PersonView]:
+        """ Everyone with hash(peep) % modulus == residue, in roster order """
+        profiling.count("people_evaluated", len(self))
+        return [PersonView(self, idx) for idx, person_hash in enumerate(self.hashes)
+                if person_hash % modulus == residue]
+
+    def group_by_residue(self, modulus: int) -> Dict[int, List[PersonView]]:
+        """ residue -> everyone with hash(peep) % modulus == residue, in roster order """
+        profiling.count("people_evaluated", len(self))
+        res: Dict[int, List[PersonView]] = {}
+        for idx, person_hash in enumerate(self.hashes):
+            res.setdefault(person_hash % modulus, []).append(PersonView(self, idx))
+        return res
@@ -0,0 +1,40 @@
+import importlib
+from .dio_dir import DioDir
+from typing import Callable, List, Any
+
+"""
+Everything derived from the roster (year plans and such) hears about roster changes here,
+instead of Person having to know about all of it
+"""
+
+# listener(dio_dir, upserted, deleted, old_roster_version, new_roster_version)
+RosterListener = Callable[[DioDir, List[Any], List[Any], int, int], None]
+
+_listeners: List[RosterListener] = []
+
+# modules whose listeners have to hear about every change, whether or not anybody imported them yet
+BUILTIN_LISTENER_MODULES: List[str] = [
+    ".year_plan",
+    ".roster_snapshot",
+    ".name_index",
+]
+
+def on_roster_change(listener: RosterListener) -> RosterListener:
+    """ decorator """
+    _listeners.append(listener)
+    return listener
+
+def roster_changed(dio_dir: DioDir, upserted: List[Any], deleted: List[Any]) -> None:
+    """
+    Bumps the roster version before telling anybody,
+    so a crash halfway through leaves derived stuff looking stale rather than current
+    """
+    if not upserted and not deleted:
+        return
+    for module_name in BUILTIN_LISTENER_MODULES:
+        # registers its listeners on first import
+        importlib.import_module(module_name, __package__)
+    old_version = dio_dir.get_roster_version()
+    new_version = dio_dir.bump_roster_version()
+    for listener in _listeners:
+        listener(dio_dir, upserted, deleted, old_version, new_version)
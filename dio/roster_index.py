@@ -0,0 +1,102 @@
+import json
+import os
+import os.path
+from .dio_dir import DioDir
+from .utils import atomic_write_json
+from . import profiling
+from typing import Dict, Any, Optional, Set, List
+
+ROSTER_INDEX_FILENAME = "roster_index.json"
+ROSTER_INDEX_VERSION = 1
+
+class RosterIndex(object):
+    """
+    Name, salt and peep.json stat for every peep, in one file in the dio dir,
+    keyed by the peep directory relative to the dio dir.
+
+    It's a cache, the peep.json files are still the truth:
+    an entry is only trusted while the mtime and size of its peep.json match,
+    so hand edits and half-finished saves just cost a reparse
+    """
+    def __init__(self, dio_dir: DioDir, entries: Dict[str, Dict[str, Any]]=None) -> None:
+        self.dio_dir = dio_dir
+        self.entries: Dict[str, Dict[str, Any]] = entries if entries is not None else {}
+        self.dirty = False
+
+    @staticmethod
+    def get_filename(dio_dir: DioDir) -> str:
+        return os.path.join(dio_dir.dirname, ROSTER_INDEX_FILENAME)
+
+    @staticmethod
+    def load(dio_dir: DioDir):
+        """
+        Missing or unreadable index is just an empty one, it rebuilds itself
+        """
+        profiling.count("files_opened")
+        try:
+            with open(RosterIndex.get_filename(dio_dir), "r") as index_file:
+                json_res: Dict[str, Any] = json.load(index_file)
+        except (OSError, ValueError):
+            return RosterIndex(dio_dir)
+        if json_res.get("version") != ROSTER_INDEX_VERSION:
+            return RosterIndex(dio_dir)
+        return RosterIndex(dio_dir, json_res["peeps"])
+
+    def save(self) -> None:
+        index_filename = RosterIndex.get_filename(self.dio_dir)
+        is_new = not os.path.exists(index_filename)
+        atomic_write_json(index_filename, {
+            "version": ROSTER_INDEX_VERSION,
+            "peeps": self.entries,
+        })
+        if is_new:
+            # machine-specific mtimes, no business being in git
+            self.dio_dir.append_to_gitignore(ROSTER_INDEX_FILENAME)
+        self.dirty = False
+
+    def relpath(self, peep_dirname: str) -> str:
+        return os.path.relpath(peep_dirname, self.dio_dir.dirname)
+
+    def lookup(self, peep_dirname: str, peep_stat: os.stat_result) -> Optional[Dict[str, Any]]:
+        """
+        Entry for the peep, if it's still fresh wrt the stat of its peep.json
+        """
+        entry = self.entries.get(self.relpath(peep_dirname))
+        if entry is None:
+            return None
+        if entry["mtime_ns"] != peep_stat.st_mtime_ns or entry["size"] != peep_stat.st_size:
+            return None
+        return entry
+
+    def record(self, peep_dirname: str, name: str, salt: str, peep_stat: os.stat_result) -> None:
+        self.entries[self.relpath(peep_dirname)] = {
+            "name": name,
+            "salt": salt,
+            "mtime_ns": peep_stat.st_mtime_ns,
+            "size": peep_stat.st_size,
+        }
+        self.dirty = True
+
+    def remove(self, peep_dirname: str) -> None:
+        if self.entries.pop(self.relpath(peep_dirname), None) is not None:
+            self.dirty = True
+
+    def move(self, old_peep_dirname: str, new_peep_dirname: str) -> None:
+        """
+        Peep folder got renamed. Renaming doesn't touch the peep.json stat, so the entry's still good
+        """
+        entry = self.entries.pop(self.relpath(old_peep_dirname), None)
+        if entry is not None:
+            self.entries[self.relpath(new_peep_dirname)] = entry
+            self.dirty = True
+
+    def prune(self, seen_relpaths: Set[str]) -> List[Dict[str, Any]]:
+        """
+        Drop entries for peeps whose folders went away behind our back.
+        Returns the dropped entries
+        """
+        res = []
+        for relpath in set(self.entries) - seen_relpaths:
+            res.append(self.entries.pop(relpath))
+            self.dirty = True
+        return res
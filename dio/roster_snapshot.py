@@ -0,0 +1,216 @@
+import array
+import hashlib
+import mmap
+import os
+import os.path
+import struct
+from .dio_dir import DioDir
+from .person import Person
+from .roster import Roster
+from .roster_events import on_roster_change
+from .roster_index import RosterIndex
+from .utils import make_temp_file, ordered_map
+from . import profiling
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+"""
+The whole roster in one fixed-width binary file, roster_snapshot.bin, for loading without any JSON:
+
+    header: magic, format version, number of peeps, roster version, checksum
+    hash column: hash(peep) as int64, one per peep
+    digest column: uint64 digest of each peep folder's name and peep.json stat
+    name offsets, salt offsets: uint64, one more than there are peeps
+    names blob, salts blob: utf-8
+
+Peeps are in folder name order, same as Person.iter_all.
+Readers mmap it and the schedules bucket straight off the hash column,
+so only the peeps that get picked ever have their names decoded.
+Rebuilt off the roster index whenever the roster changes through dio.
+The checksum is the digests added up, so it can be checked against the folders with just a stat per peep
+"""
+
+SNAPSHOT_FILENAME = "roster_snapshot.bin"
+SNAPSHOT_MAGIC = b"DIOSNAP\x00"
+SNAPSHOT_VERSION = 1
+# magic, format version, number of peeps, roster version, checksum
+HEADER = struct.Struct("<8sQQQQ")
+WORD_SIZE = 8
+
+def get_digest(peep_dirname: str, mtime_ns: int, size: int) -> int:
+    """
+    Only the folder name, not where it is, so migrate-layout doesn't change it
+    """
+    digest_input = "{}\x00{}\x00{}".format(os.path.basename(peep_dirname), mtime_ns, size).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(digest_input, digest_size=WORD_SIZE).digest(), "little")
+
+def get_checksum(digests: Iterable[int]) -> int:
+    return sum(digests) % (2 ** 64)
+
+def get_folder_checksum(dio_dir: DioDir) -> int:
+    """
+    Checksum of the peep folders as they are right now. Stats every peep.json, opens none of them.
+    As many stats at once as iter_all does opens
+    """
+    def get_dir_digest(peep_dirname: str) -> int:
+        try:
+            peep_stat = os.stat(Person.get_filename(peep_dirname))
+        except OSError:
+            # peep.json got deleted by hand, iter_all skips these too
+            return 0
+        return get_digest(peep_dirname, peep_stat.st_mtime_ns, peep_stat.st_size)
+    return get_checksum(ordered_map(get_dir_digest, Person.iter_dirs(dio_dir), dio_dir.get_load_workers()))
+
+def get_index_checksum(index: RosterIndex) -> int:
+    """
+    What get_folder_checksum comes out to if the folders are the way the roster index thinks they are
+    """
+    return get_checksum(get_digest(relpath, entry["mtime_ns"], entry["size"])
+                        for relpath, entry in index.entries.items())
+
+class BlobColumn(Sequence[str]):
+    """ Strings packed in a blob, with an offset table. Decodes on indexing """
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: Any) -> Any:
+        if isinstance(idx, slice):
+            return [self[curr_idx] for curr_idx in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        return bytes(self.blob[self.offsets[idx]:self.offsets[idx + 1]]).decode("utf-8")
+
+def pack_blob(strs: List[str]) -> Tuple[array.array, bytes]:
+    offsets = array.array("Q", [0])
+    encoded = []
+    for curr_str in strs:
+        encoded.append(curr_str.encode("utf-8"))
+        offsets.append(offsets[-1] + len(encoded[-1]))
+    return offsets, b"".join(encoded)
+
+def pad(blob: bytes) -> bytes:
+    """ so the next column starts word aligned """
+    return blob + b"\x00" * (-len(blob) % WORD_SIZE)
+
+class RosterSnapshot(Roster):
+    """
+    A Roster read straight out of the snapshot file, read only.
+    The columns are views on the mapped file, nothing gets copied or parsed up front
+    """
+    def __init__(self, buf: Any) -> None:
+        magic, format_version, num_peeps, roster_version, checksum = HEADER.unpack_from(buf, 0)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_VERSION:
+            raise ValueError("Not a roster snapshot this version of dio can read")
+        self.buf = buf
+        self.roster_version: int = roster_version
+        self.checksum: int = checksum
+        whole = memoryview(buf)
+        offset = HEADER.size
+        def take_words(num_words: int, fmt: str) -> memoryview:
+            nonlocal offset
+            res = whole[offset:offset + num_words * WORD_SIZE].cast(fmt)
+            offset += num_words * WORD_SIZE
+            return res
+        self.hashes = take_words(num_peeps, "q")
+        self.digests = take_words(num_peeps, "Q")
+        name_offsets = take_words(num_peeps + 1, "Q")
+        salt_offsets = take_words(num_peeps + 1, "Q")
+        names_blob = whole[offset:offset + name_offsets[-1]]
+        offset += name_offsets[-1] + (-name_offsets[-1] % WORD_SIZE)
+        salts_blob = whole[offset:offset + salt_offsets[-1]]
+        self.names = BlobColumn(name_offsets, names_blob)
+        self.salts = BlobColumn(salt_offsets, salts_blob)
+        self._positions: Optional[Dict[str, int]] = None
+
+    @property
+    def positions(self) -> Dict[str, int]:
+        """ Decodes every name, so only once somebody looks a peep up by name """
+        if self._positions is None:
+            self._positions = {name: idx for idx, name in enumerate(self.names)}
+        return self._positions
+
+    def append(self, person: Any) -> None:
+        raise Exception("Roster snapshots are read only, save the peep instead")
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        """
+        The mapped file doesn't pickle, so it goes as a plain Roster of the same peeps,
+        for process pools and such
+        """
+        return (Roster.from_columns, (list(self.names), list(self.salts), self.hashes.tolist()))
+
+    @staticmethod
+    def get_filename(dio_dir: DioDir) -> str:
+        return os.path.join(dio_dir.dirname, SNAPSHOT_FILENAME)
+
+    @staticmethod
+    def write(dio_dir: DioDir, index: RosterIndex, roster_version: int) -> None:
+        """
+        Off the roster index, which is up to date whenever the roster's just been changed through dio
+        """
+        sorted_entries = sorted(index.entries.items(), key=lambda item: (os.path.basename(item[0]), item[0]))
+        hashes = array.array("q", [hash(Person(name=entry["name"], salt=entry["salt"]))
+                                   for _, entry in sorted_entries])
+        digests = array.array("Q", [get_digest(relpath, entry["mtime_ns"], entry["size"])
+                                    for relpath, entry in sorted_entries])
+        name_offsets, names_blob = pack_blob([entry["name"] for _, entry in sorted_entries])
+        salt_offsets, salts_blob = pack_blob([entry["salt"] for _, entry in sorted_entries])
+        snapshot_filename = RosterSnapshot.get_filename(dio_dir)
+        is_new = not os.path.exists(snapshot_filename)
+        fd, tmp_filename = make_temp_file(dio_dir.dirname)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sorted_entries),
+                                           roster_version, get_checksum(digests)))
+                for column in (hashes, digests, name_offsets, salt_offsets):
+                    tmp_file.write(column.tobytes())
+                tmp_file.write(pad(names_blob))
+                tmp_file.write(pad(salts_blob))
+            # readers that have the old one mapped keep the old one
+            os.replace(tmp_filename, snapshot_filename)
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        if is_new:
+            dio_dir.append_to_gitignore(SNAPSHOT_FILENAME)
+
+    @staticmethod
+    def load(dio_dir: DioDir) -> Optional["RosterSnapshot"]:
+        """
+        None if there isn't one or it's unreadable
+        """
+        profiling.count("files_opened")
+        try:
+            with open(RosterSnapshot.get_filename(dio_dir), "rb") as snapshot_file:
+                try:
+                    buf: Any = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # not everything can be mapped (empty files, some filesystems), reading it is fine too
+                    buf = snapshot_file.read()
+            return RosterSnapshot(buf)
+        except (OSError, ValueError, struct.error, IndexError, TypeError):
+            return None
+
+    @staticmethod
+    @profiling.timed("snapshot_load")
+    def load_current(dio_dir: DioDir, verify: bool=True) -> Optional["RosterSnapshot"]:
+        """
+        The snapshot, if it's of the roster as it is now.
+        The roster version catches changes through dio.
+        verify also checks it against the folders, to catch hand edits, for one stat per peep
+        """
+        snapshot = RosterSnapshot.load(dio_dir)
+        if snapshot is None or snapshot.roster_version != dio_dir.get_roster_version():
+            return None
+        if verify and snapshot.checksum != get_folder_checksum(dio_dir):
+            return None
+        return snapshot
+
+@on_roster_change
+def rebuild_snapshot(dio_dir: DioDir, upserted: List[Any], deleted: List[Any], old_version: int, new_version: int) -> None:
+    with profiling.span("snapshot_rebuild"):
+        RosterSnapshot.write(dio_dir, RosterIndex.load(dio_dir), new_version)
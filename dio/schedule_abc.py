@@ -1,8 +1,17 @@
 from abc import ABC
 import datetime
+from .compiled_schedule import CompiledYear, ContactRule
 from .person import Person
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# years of compiled schedule kept around per schedule
+COMPILED_YEARS_KEPT = 8
 
 class ScheduleABC(ABC):
+    # True if who gets contacted depends on who else is in the roster,
+    # then should_contact can't answer and only contacts_for and partition_year can
+    needs_whole_roster: bool = False
+
     def __init__(self):
         pass
 
@@ -13,16 +22,71 @@ class ScheduleABC(ABC):
         """
         raise NotImplementedError()
 
+    def should_contact(self, person: Person, date: datetime.date) -> bool:
+        raise NotImplementedError()
+
+    def contact_rule(self, date: datetime.date) -> Optional[ContactRule]:
+        """
+        If should_contact on an emailing day comes down to hash(peep) % modulus == residue,
+        return (modulus, residue) and everything gets to skip calling should_contact per peep.
+        None means ask should_contact
+        """
+        return None
+
+    def get_sorted_days(self, year: int) -> Optional[Sequence[datetime.date]]:
+        """
+        The year's emailing days in order, if the schedule keeps them already.
+        None means compile asks should_email_day for every day of the year
+        """
+        return None
+
+    def compile(self, year: int) -> CompiledYear:
+        """
+        The year's emailing days as a bitset, plus the contact rules, worked out once and kept.
+        Everything below runs off this, so a new schedule only needs should_email_day
+        and should_contact (and contact_rule, if it can) to be fast
+        """
+        compiled_years: Dict[int, CompiledYear] = vars(self).setdefault("_compiled_years", {})
+        if year not in compiled_years:
+            if len(compiled_years) >= COMPILED_YEARS_KEPT:
+                # oldest one first, dicts keep insertion order
+                del compiled_years[next(iter(compiled_years))]
+            compiled_years[year] = CompiledYear.build(self, year, self.get_sorted_days(year))
+        return compiled_years[year]
+
     def next_emailing_day(self, date: datetime.date) -> datetime.date:
         """
         Will shortcircuit if we are currently doing emailing day that day
         """
-        curr_dt = date
-        while not self.should_email_day(curr_dt):
-            curr_dt += datetime.timedelta(days=1)
-        return curr_dt
+        curr_year = date.year
+        while True:
+            res = self.compile(curr_year).next_emailing_day(date)
+            if res is not None:
+                return res
+            curr_year += 1
 
-    def should_contact(self, person: Person, date: datetime.date) -> bool:
-        raise NotImplementedError()
+    def emailing_days_between(self, start: datetime.date, end: datetime.date) -> List[datetime.date]:
+        """
+        Emailing days from start up to but not including end, in order
+        """
+        res: List[datetime.date] = []
+        for curr_year in range(start.year, end.year + 1):
+            res.extend(self.compile(curr_year).emailing_days_between(start, end))
+        return res
 
+    def count_emailing_days(self, start: datetime.date, end: datetime.date) -> int:
+        """ Same range as emailing_days_between """
+        return len(self.emailing_days_between(start, end))
 
+    def contacts_for(self, roster: Iterable[Person], date: datetime.date) -> List[Person]:
+        """
+        Everyone in the roster to contact on an emailing day, in roster order
+        """
+        return self.compile(date.year).contacts_for(roster, date)
+
+    def partition_year(self, roster: Iterable[Person], year: int) -> Dict[datetime.date, List[Person]]:
+        """
+        Every emailing day of the year, mapped to who to contact that day.
+        Non-emailing days are not keys
+        """
+        return self.compile(year).partition(roster)
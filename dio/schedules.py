@@ -0,0 +1,28 @@
+from .schedule_abc import ScheduleABC
+from .default_schedule import DefaultSchedule
+from .three_times_schedule import ThreeTimesSchedule
+from .balanced_schedule import BalancedSchedule
+from typing import Dict, Optional, Type
+
+"""
+Names for the built-in schedules, for the cli and for files that need to remember a schedule
+"""
+
+SCHEDULES: Dict[str, Type[ScheduleABC]] = {
+    "default": DefaultSchedule,
+    "threetimes": ThreeTimesSchedule,
+    "balanced": BalancedSchedule,
+}
+
+def get_schedule(schedule_name: str) -> ScheduleABC:
+    if schedule_name not in SCHEDULES:
+        raise Exception("Unknown schedule {}, try one of {}".format(
+            schedule_name, ", ".join(sorted(SCHEDULES))))
+    return SCHEDULES[schedule_name]()
+
+def get_schedule_name(schedule: ScheduleABC) -> Optional[str]:
+    """ None for schedules not in here, like homemade ones """
+    for schedule_name, schedule_cls in SCHEDULES.items():
+        if type(schedule) is schedule_cls:
+            return schedule_name
+    return None
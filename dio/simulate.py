@@ -0,0 +1,136 @@
+import array
+import collections
+import concurrent.futures
+import dataclasses
+import random
+import statistics
+from .person import Person
+from .roster import Roster
+from .schedule_abc import ScheduleABC
+from typing import Dict, Iterator, List, Optional
+
+"""
+Runs schedules over whole years of a roster, to see how fair they are:
+how many peeps land on each emailing day, and how often each peep comes up.
+(schedule, year) pairs go out to a process pool, the roster goes to each worker once
+"""
+
+# set in each worker process by init_worker, so the roster is only pickled once per worker
+_worker_roster: Optional[Roster] = None
+
+@dataclasses.dataclass
+class YearResult(object):
+    schedule_name: str
+    year: int
+    # peeps contacted on each emailing day, in day order
+    day_loads: List[int]
+    # times each peep got contacted, in roster order
+    person_counts: array.array
+
+@dataclasses.dataclass
+class SimulationReport(object):
+    schedule_name: str
+    years: List[int]
+    num_peeps: int
+    emailing_days: int = 0
+    total_contacts: int = 0
+    min_per_day: int = 0
+    median_per_day: float = 0.0
+    max_per_day: int = 0
+    mean_per_day: float = 0.0
+    # peeps on a day -> how many emailing days had that many
+    day_load_histogram: Dict[int, int] = dataclasses.field(default_factory=dict)
+    # times contacted over all the years -> how many peeps
+    contact_count_histogram: Dict[int, int] = dataclasses.field(default_factory=dict)
+    # year -> peeps not contacted at all that year
+    never_contacted: Dict[int, List[str]] = dataclasses.field(default_factory=dict)
+
+def make_synthetic_roster(num_peeps: int, seed: int=0) -> Roster:
+    rng = random.Random(seed)
+    return Roster.from_people(Person(name="peep{}".format(peep_idx),
+                                     salt=str(rng.randint(int(1e30), int(9e30))))
+                              for peep_idx in range(num_peeps))
+
+def init_worker(roster: Roster) -> None:
+    global _worker_roster
+    _worker_roster = roster
+
+def simulate_year(schedule_name: str, schedule: ScheduleABC, year: int, roster: Optional[Roster]=None) -> YearResult:
+    if roster is None:
+        roster = _worker_roster
+    year_partition = schedule.partition_year(roster, year)
+    person_counts = array.array("l", bytes(array.array("l").itemsize * len(roster)))
+    day_loads = []
+    for day in sorted(year_partition):
+        day_loads.append(len(year_partition[day]))
+        for peep in year_partition[day]:
+            person_counts[peep.idx] += 1
+    return YearResult(schedule_name=schedule_name, year=year, day_loads=day_loads, person_counts=person_counts)
+
+def iter_year_results(roster: Roster,
+                      schedules: Dict[str, ScheduleABC],
+                      years: List[int],
+                      workers: int) -> Iterator[YearResult]:
+    tasks = [(schedule_name, schedule, year) for schedule_name, schedule in schedules.items() for year in years]
+    if workers <= 1:
+        for schedule_name, schedule, year in tasks:
+            yield simulate_year(schedule_name, schedule, year, roster)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=init_worker,
+                                                initargs=(roster,)) as executor:
+        futures = [executor.submit(simulate_year, schedule_name, schedule, year)
+                   for schedule_name, schedule, year in tasks]
+        for future in futures:
+            yield future.result()
+
+def simulate(roster: Roster,
+             schedules: Dict[str, ScheduleABC],
+             years: List[int],
+             workers: int=4) -> List[SimulationReport]:
+    """
+    One report per schedule, in the order given. workers=1 does it all in this process
+    """
+    reports = {schedule_name: SimulationReport(schedule_name=schedule_name, years=list(years), num_peeps=len(roster))
+               for schedule_name in schedules}
+    total_counts = {schedule_name: array.array("l", bytes(array.array("l").itemsize * len(roster)))
+                    for schedule_name in schedules}
+    all_day_loads: Dict[str, List[int]] = {schedule_name: [] for schedule_name in schedules}
+    for year_result in iter_year_results(roster, schedules, list(years), workers):
+        report = reports[year_result.schedule_name]
+        all_day_loads[year_result.schedule_name].extend(year_result.day_loads)
+        curr_total_counts = total_counts[year_result.schedule_name]
+        never_contacted = []
+        for idx, person_count in enumerate(year_result.person_counts):
+            curr_total_counts[idx] += person_count
+            if person_count == 0:
+                never_contacted.append(roster.names[idx])
+        report.never_contacted[year_result.year] = never_contacted
+    for schedule_name, report in reports.items():
+        day_loads = all_day_loads[schedule_name]
+        report.never_contacted = dict(sorted(report.never_contacted.items()))
+        report.emailing_days = len(day_loads)
+        report.total_contacts = sum(day_loads)
+        report.min_per_day = min(day_loads, default=0)
+        report.median_per_day = statistics.median(day_loads) if day_loads else 0.0
+        report.max_per_day = max(day_loads, default=0)
+        report.mean_per_day = statistics.mean(day_loads) if day_loads else 0.0
+        report.day_load_histogram = dict(sorted(collections.Counter(day_loads).items()))
+        report.contact_count_histogram = dict(sorted(collections.Counter(total_counts[schedule_name]).items()))
+    return list(reports.values())
+
+def format_report(report: SimulationReport, max_names: int=10) -> str:
+    """ The whole histograms are in the JSON, this is the short version """
+    lines = [
+        "schedule: {} years: {}-{} peeps: {}".format(report.schedule_name, min(report.years), max(report.years), report.num_peeps),
+        "emailing days: {} contacts: {}".format(report.emailing_days, report.total_contacts),
+        "peeps on a day: min {} median {} mean {:.2f} max {}".format(
+            report.min_per_day, report.median_per_day, report.mean_per_day, report.max_per_day),
+        "times contacted: " + ", ".join("{}: {} peeps".format(num_contacts, num_peeps)
+                                        for num_contacts, num_peeps in report.contact_count_histogram.items()),
+    ]
+    for year, names in report.never_contacted.items():
+        if names:
+            shown = ", ".join(names[:max_names]) + (" ..." if len(names) > max_names else "")
+            lines.append("never contacted in {}: {} peeps ({})".format(year, len(names), shown))
+    return "\n".join(lines)
@@ -0,0 +1,160 @@
+import dataclasses
+import datetime
+import email
+import email.message
+import email.policy
+import fcntl
+import os
+import os.path
+import smtplib
+import time
+from .dio_dir import DioDir
+from .mailer import Mailer
+from .settings import Settings
+from .utils import make_temp_file
+from typing import Any, Callable, List, Optional
+
+"""
+Outgoing recs wait in spool/ in the dio dir until `dio flush` sends them,
+so `dio recs` is done as soon as the message is written and a slow or broken SMTP server
+costs a retry later instead of that day's recs.
+
+    spool/<date>.eml    waiting to go out
+    spool/sent/<date>   went out, so that date doesn't get spooled or sent again
+
+A crash between sending and writing the sent marker sends it twice next flush, never zero times
+"""
+
+SPOOL_DIRNAME = "spool"
+SENT_DIRNAME = "sent"
+LOCK_FILENAME = ".flush_lock"
+# sent markers older than this get cleaned up on flush
+SENT_MARKERS_KEPT_DAYS = 40
+
+@dataclasses.dataclass
+class FlushResult(object):
+    sent: List[datetime.date] = dataclasses.field(default_factory=list)
+    # still spooled, the next flush tries them again
+    pending: List[datetime.date] = dataclasses.field(default_factory=list)
+    error: Optional[BaseException] = None
+
+def get_spool_dirname(dio_dir: DioDir) -> str:
+    return os.path.join(dio_dir.dirname, SPOOL_DIRNAME)
+
+def get_message_filename(dio_dir: DioDir, date: datetime.date) -> str:
+    return os.path.join(get_spool_dirname(dio_dir), "{}.eml".format(date.isoformat()))
+
+def get_sent_filename(dio_dir: DioDir, date: datetime.date) -> str:
+    return os.path.join(get_spool_dirname(dio_dir), SENT_DIRNAME, date.isoformat())
+
+def is_sent(dio_dir: DioDir, date: datetime.date) -> bool:
+    return os.path.exists(get_sent_filename(dio_dir, date))
+
+def get_pending(dio_dir: DioDir) -> List[datetime.date]:
+    """ Spooled and not sent yet, oldest first """
+    spool_dirname = get_spool_dirname(dio_dir)
+    if not os.path.isdir(spool_dirname):
+        return []
+    return sorted(datetime.date.fromisoformat(filename[:-len(".eml")])
+                  for filename in os.listdir(spool_dirname) if filename.endswith(".eml"))
+
+def spool_message(dio_dir: DioDir, msg_obj: email.message.EmailMessage, date: datetime.date) -> bool:
+    """
+    False if that date's recs are spooled or sent already, then nothing gets written
+    """
+    message_filename = get_message_filename(dio_dir, date)
+    if os.path.exists(message_filename) or is_sent(dio_dir, date):
+        return False
+    spool_dirname = get_spool_dirname(dio_dir)
+    is_new = not os.path.isdir(spool_dirname)
+    os.makedirs(os.path.join(spool_dirname, SENT_DIRNAME), exist_ok=True)
+    if is_new:
+        dio_dir.append_to_gitignore(SPOOL_DIRNAME + "/")
+    fd, tmp_filename = make_temp_file(spool_dirname)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(msg_obj.as_bytes())
+        # flush only ever sees whole messages
+        os.replace(tmp_filename, message_filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return True
+
+def read_message(message_filename: str) -> email.message.EmailMessage:
+    with open(message_filename, "rb") as message_file:
+        return email.message_from_binary_file(message_file, policy=email.policy.default)
+
+def mark_sent(dio_dir: DioDir, date: datetime.date) -> None:
+    with open(get_sent_filename(dio_dir, date), "w") as sent_file:
+        sent_file.write("{}\n".format(datetime.datetime.now().isoformat()))
+    os.remove(get_message_filename(dio_dir, date))
+
+def prune_sent_markers(dio_dir: DioDir, today: datetime.date) -> None:
+    sent_dirname = os.path.join(get_spool_dirname(dio_dir), SENT_DIRNAME)
+    if not os.path.isdir(sent_dirname):
+        return
+    for filename in os.listdir(sent_dirname):
+        try:
+            sent_date = datetime.date.fromisoformat(filename)
+        except ValueError:
+            continue
+        if (today - sent_date).days > SENT_MARKERS_KEPT_DAYS:
+            os.remove(os.path.join(sent_dirname, filename))
+
+def flush(dio_dir: DioDir,
+          settings: Settings,
+          retries: int=3,
+          backoff_secs: float=30.0,
+          sleep: Callable[[float], None]=time.sleep,
+          **mailer_kwargs: Any) -> FlushResult:
+    """
+    Sends everything spooled, oldest first, over one SMTP session.
+    A message that won't go gets retried with exponential backoff,
+    and if it still won't, it and everything after it stay spooled for next time.
+    If another flush is going already, leaves it to that one
+    """
+    res = FlushResult()
+    if not os.path.isdir(get_spool_dirname(dio_dir)):
+        return res
+    with open(os.path.join(get_spool_dirname(dio_dir), LOCK_FILENAME), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            res.pending = get_pending(dio_dir)
+            return res
+        # the lock goes when the file closes
+        return flush_locked(dio_dir, settings, res, retries, backoff_secs, sleep, **mailer_kwargs)
+
+def flush_locked(dio_dir: DioDir,
+                 settings: Settings,
+                 res: FlushResult,
+                 retries: int,
+                 backoff_secs: float,
+                 sleep: Callable[[float], None],
+                 **mailer_kwargs: Any) -> FlushResult:
+    pending = get_pending(dio_dir)
+    with Mailer(settings, **mailer_kwargs) as mailer:
+        for date_idx, date in enumerate(pending):
+            if is_sent(dio_dir, date):
+                # sent by a flush that died before it cleaned up
+                os.remove(get_message_filename(dio_dir, date))
+                continue
+            msg_obj = read_message(get_message_filename(dio_dir, date))
+            for attempt in range(retries + 1):
+                try:
+                    mailer.send(msg_obj)
+                    break
+                except (smtplib.SMTPException, OSError) as exc:
+                    # start the next try with a fresh session
+                    mailer.close()
+                    if attempt == retries:
+                        res.error = exc
+                        res.pending = pending[date_idx:]
+                        return res
+                    sleep(backoff_secs * 2 ** attempt)
+            mark_sent(dio_dir, date)
+            res.sent.append(date)
+    prune_sent_markers(dio_dir, datetime.datetime.now().date())
+    return res
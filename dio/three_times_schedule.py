@@ -1,6 +1,15 @@
 import datetime
 from .schedule_abc import ScheduleABC
 from .person import Person
+from .roster import Roster
+from .utils import days_in_year, iso_week_start
+from . import profiling
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# first and last ISO week of each period, inclusive
+EMAILING_PERIODS: Tuple[Tuple[int, int], ...] = ((1, 8), (18, 25), (35, 42))
+EMAILING_WEEKS = frozenset(week for first_week, last_week in EMAILING_PERIODS
+                           for week in range(first_week, last_week + 1))
 
 
 class ThreeTimesSchedule(ScheduleABC):
@@ -11,23 +20,74 @@ class ThreeTimesSchedule(ScheduleABC):
         pass
 
     def should_email_day(self, date: datetime.date) -> bool:
-        dt = datetime.datetime.combine(date, datetime.datetime.min.time())
-        _, weeknumber, weekday = dt.isocalendar()
-        emailing_weeks = set(range(1, 9)) |\
-                set(range(18,26)) |\
-                set(range(35,43))
-        if weeknumber in emailing_weeks:
-            return True
-        return False
-    
+        _, weeknumber, weekday = date.isocalendar()
+        return weeknumber in EMAILING_WEEKS
+
+    @staticmethod
+    def iter_periods(start: datetime.date, end: datetime.date) -> Iterator[Tuple[datetime.date, datetime.date]]:
+        """
+        Emailing periods as (first day, day after the last day), clipped to start and end.
+        Periods that miss the range entirely get skipped
+        """
+        for iso_year in range(start.isocalendar()[0], end.isocalendar()[0] + 1):
+            for first_week, last_week in EMAILING_PERIODS:
+                period_start = max(start, iso_week_start(iso_year, first_week))
+                period_end = min(end, iso_week_start(iso_year, last_week + 1))
+                if period_start < period_end:
+                    yield period_start, period_end
+
     def next_emailing_day(self, date: datetime.date) -> datetime.date:
-        return super().next_emailing_day(date)
+        iso_year = date.isocalendar()[0]
+        # the next period is never more than a year out
+        for period_start, _ in ThreeTimesSchedule.iter_periods(date, iso_week_start(iso_year + 1, 9)):
+            return period_start
+        raise Exception("no emailing day after {}".format(date))
 
-    def should_contact(self, person: Person, date: datetime.date) -> bool:
+    def emailing_days_between(self, start: datetime.date, end: datetime.date) -> List[datetime.date]:
+        return [period_start + datetime.timedelta(days=day_idx)
+                for period_start, period_end in ThreeTimesSchedule.iter_periods(start, end)
+                for day_idx in range((period_end - period_start).days)]
+
+    def count_emailing_days(self, start: datetime.date, end: datetime.date) -> int:
+        return sum((period_end - period_start).days
+                   for period_start, period_end in ThreeTimesSchedule.iter_periods(start, end))
+
+    @staticmethod
+    def get_bucket(date: datetime.date) -> int:
         dt = datetime.datetime.combine(date, datetime.datetime.min.time())
         _, weeknumber, weekday = dt.isocalendar()
-        curr_emailing_week = weeknumber % 8
-        curr_bucket = weekday + (weeknumber * 8)
+        return weekday + (weeknumber * 8)
+
+    def should_contact(self, person: Person, date: datetime.date) -> bool:
+        curr_bucket = ThreeTimesSchedule.get_bucket(date)
         total_days_per_period = 8 * 7
         return (hash(person) % total_days_per_period) == curr_bucket
 
+    def contact_rule(self, date: datetime.date) -> Tuple[int, int]:
+        return (8 * 7, ThreeTimesSchedule.get_bucket(date))
+
+    def contacts_for(self, roster: Iterable[Person], date: datetime.date) -> List[Person]:
+        curr_bucket = ThreeTimesSchedule.get_bucket(date)
+        total_days_per_period = 8 * 7
+        if isinstance(roster, Roster):
+            return roster.select_residue(total_days_per_period, curr_bucket)
+        return [person for person in profiling.counted("people_evaluated", roster)
+                if hash(person) % total_days_per_period == curr_bucket]
+
+    def partition_year(self, roster: Iterable[Person], year: int) -> Dict[datetime.date, List[Person]]:
+        total_days_per_period = 8 * 7
+        res: Dict[datetime.date, List[Person]] = {}
+        days_by_bucket: Dict[int, List[datetime.date]] = {}
+        for day in filter(self.should_email_day, days_in_year(year)):
+            res[day] = []
+            days_by_bucket.setdefault(ThreeTimesSchedule.get_bucket(day), []).append(day)
+        if isinstance(roster, Roster):
+            groups = roster.group_by_residue(total_days_per_period)
+            for bucket, days in days_by_bucket.items():
+                for day in days:
+                    res[day] = list(groups.get(bucket, []))
+            return res
+        for person in profiling.counted("people_evaluated", roster):
+            for day in days_by_bucket.get(hash(person) % total_days_per_period, []):
+                res[day].append(person)
+        return res
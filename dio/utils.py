@@ -1,11 +1,21 @@
+import collections
 import datetime
 import hashlib
-from typing import Iterator
+import json
+import os
+import os.path
+import tempfile
+from . import profiling
+from typing import Any, Callable, Iterable, Iterator, Tuple, TypeVar
+
+T = TypeVar("T")
+U = TypeVar("U")
 
 def days_in_year(year: int) -> Iterator[datetime.date]:
     first_day_of_year = datetime.datetime(year=year, month=1, day=1).date()
-    first_day_next_year = datetime.datetime(year=year+1, month=1, day=1).date()
-    num_days_in_year = (first_day_next_year - first_day_of_year).days
+    # not jan 1 of next year, that blows up for datetime.MAXYEAR
+    last_day_of_year = datetime.datetime(year=year, month=12, day=31).date()
+    num_days_in_year = (last_day_of_year - first_day_of_year).days + 1
     for curr_day in range(num_days_in_year):
         yield first_day_of_year + datetime.timedelta(days=curr_day)
 
@@ -13,4 +23,72 @@ def get_date_hash(date: datetime.date) -> int:
     """
     normal python hash function not stable between instances of python
     """
+    profiling.count("date_hashes")
     return int(hashlib.sha256(str(date).encode("utf-8")).hexdigest(), 16)
+
+def iso_week_start(iso_year: int, week: int) -> datetime.date:
+    """
+    Monday of that ISO week. Week numbers past the end of the year just keep counting
+    """
+    jan_4 = datetime.date(year=iso_year, month=1, day=4)
+    # jan 4 is always in week 1
+    return jan_4 + datetime.timedelta(days=7 * (week - 1) - (jan_4.isoweekday() - 1))
+
+def before_midyear(date: datetime.date) -> bool:
+    # midyear's day is july 2
+    return date < datetime.date(year=date.year, month=7, day=2)
+
+def get_umask() -> int:
+    # there's no reading it without setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# read once, up front: setting it back and forth later races any thread making files
+UMASK = get_umask()
+
+def make_temp_file(dirname: str) -> Tuple[int, str]:
+    """
+    mkstemp, but with the mode a plain open would've given it instead of 0600,
+    since it's about to be renamed over a file that got a plain open's mode
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix=".tmp_")
+    os.fchmod(fd, 0o666 & ~UMASK)
+    return fd, tmp_filename
+
+def atomic_write_json(filename: str, obj: Any) -> None:
+    """
+    Write to a temp file next to the target and rename over it,
+    so a crash never leaves a half-written file behind
+    """
+    dirname = os.path.dirname(filename) or "."
+    fd, tmp_filename = make_temp_file(dirname)
+    try:
+        with os.fdopen(fd, "w") as tmp_file:
+            # not json.dump, that streams it through the pure python encoder
+            tmp_file.write(json.dumps(obj))
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+def ordered_map(fn: Callable[[T], U], items: Iterable[T], workers: int=1) -> Iterator[U]:
+    """
+    Lazy map that runs fn on a thread pool when workers > 1, for when fn is mostly waiting on I/O.
+    Results come out in the same order as items,
+    and only a few per worker run ahead, so it doesn't read a whole huge roster into memory
+    """
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+    # only the ones that go concurrent pay for importing it
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight: collections.deque = collections.deque()
+        for item in items:
+            in_flight.append(executor.submit(fn, item))
+            if len(in_flight) >= workers * 4:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -0,0 +1,67 @@
+import datetime
+from .person import Person
+from .roster import Roster
+from .schedule_abc import ScheduleABC
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+Array-backed evaluation of the built-in schedules over a whole roster at once.
+Optional, needs numpy (`pip install diogenes8[vectorized]`)
+
+Any schedule with a contact_rule boils down to, for each emailing day, "contact if hash(peep) % modulus == residue".
+hash(peep) is what they use, not the salt itself: python folds the 31-digit salt
+that Person.__hash__ returns down modulo 2**61 - 1, so it always fits in an int64
+"""
+
+def get_hashes(roster: Sequence[Person]):
+    if np is None:
+        raise Exception("Vectorized schedules need numpy. Run `pip install numpy`")
+    if isinstance(roster, Roster):
+        # already int64s, just a memcpy. copied so the roster can still grow afterwards
+        return np.frombuffer(roster.hashes, dtype=np.int64).copy()
+    return np.fromiter((hash(person) for person in roster), dtype=np.int64, count=len(roster))
+
+def get_day_rules(schedule: ScheduleABC, year: int) -> List[Tuple[datetime.date, int, int]]:
+    """
+    (emailing day, modulus, residue) for every emailing day of the year, off the compiled schedule
+    """
+    compiled = schedule.compile(year)
+    if compiled.rules is None:
+        raise Exception("No vectorized version of {}, it has no contact_rule".format(type(schedule).__name__))
+    return [(day, modulus, residue) for day, (modulus, residue) in compiled.rules.items()]
+
+def contact_matrix(schedule: ScheduleABC, roster: Sequence[Person], year: int):
+    """
+    Emailing days, and a (days x peeps) boolean array of who gets contacted when.
+    All days in one go, so mind the memory on big rosters
+    """
+    hashes = get_hashes(roster)
+    day_rules = get_day_rules(schedule, year)
+    days = [day for day, _, _ in day_rules]
+    moduli = np.array([modulus for _, modulus, _ in day_rules], dtype=np.int64)
+    residues = np.array([residue for _, _, residue in day_rules], dtype=np.int64)
+    return days, (hashes[np.newaxis, :] % moduli[:, np.newaxis]) == residues[:, np.newaxis]
+
+def partition_year(schedule: ScheduleABC, roster: Sequence[Person], year: int) -> Dict[datetime.date, List[Person]]:
+    """
+    Same answer as schedule.partition_year, roster order within each day and all.
+    One vectorized mod and one stable sort per distinct modulus
+    """
+    if not isinstance(roster, Roster):
+        roster = list(roster)
+    hashes = get_hashes(roster)
+    day_rules = get_day_rules(schedule, year)
+    res: Dict[datetime.date, List[Person]] = {day: [] for day, _, _ in sorted(day_rules)}
+    for modulus in sorted({modulus for _, modulus, _ in day_rules}):
+        remainders = hashes % modulus
+        order: List[int] = np.argsort(remainders, kind="stable").tolist()
+        bounds: List[int] = np.concatenate(([0], np.cumsum(np.bincount(remainders, minlength=modulus)))).tolist()
+        for day, day_modulus, residue in day_rules:
+            if day_modulus == modulus and residue < modulus:
+                res[day] = [roster[idx] for idx in order[bounds[residue]:bounds[residue + 1]]]
+    return res
@@ -0,0 +1,40 @@
+import dataclasses
+import datetime
+import types
+from .utils import before_midyear
+from typing import Iterable, Mapping, FrozenSet, Tuple
+
+@dataclasses.dataclass(frozen=True)
+class YearCalendar(object):
+    """
+    Everything about one year of emailing days that doesn't depend on the person.
+    Build it once per year and keep it around, it's immutable
+    """
+    year: int
+    emailing_days: FrozenSet[datetime.date]
+    fst_half: Tuple[datetime.date, ...]
+    snd_half: Tuple[datetime.date, ...]
+    # the whole year in order, for bisecting
+    sorted_days: Tuple[datetime.date, ...]
+    buckets: Mapping[datetime.date, int]
+
+    @staticmethod
+    def from_days(year: int, days: Iterable[datetime.date]):
+        emailing_days = frozenset(days)
+        fst_half = tuple(sorted(day for day in emailing_days if before_midyear(day)))
+        snd_half = tuple(sorted(day for day in emailing_days if not before_midyear(day)))
+        buckets = {day: idx for idx, day in enumerate(fst_half)}
+        buckets.update({day: idx for idx, day in enumerate(snd_half)})
+        return YearCalendar(
+                year=year,
+                emailing_days=emailing_days,
+                fst_half=fst_half,
+                snd_half=snd_half,
+                sorted_days=fst_half + snd_half,
+                buckets=types.MappingProxyType(buckets))
+
+    def half_of(self, date: datetime.date) -> Tuple[datetime.date, ...]:
+        return self.fst_half if before_midyear(date) else self.snd_half
+
+    def cardinality(self, date: datetime.date) -> int:
+        return len(self.half_of(date))
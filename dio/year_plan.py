@@ -0,0 +1,286 @@
+import bisect
+import dataclasses
+import datetime
+import json
+import os
+import os.path
+import shutil
+from .dio_dir import DioDir
+from .person import Person
+from .roster import Roster
+from .roster_events import on_roster_change
+from .roster_index import RosterIndex
+from .roster_snapshot import RosterSnapshot, get_folder_checksum, get_index_checksum
+from .schedule_abc import ScheduleABC
+from .schedules import get_schedule, get_schedule_name
+from .utils import atomic_write_json
+from . import profiling
+from typing import Dict, List, Any, Optional, Set
+
+"""
+A plan is a folder in plans/, one per schedule and year:
+
+    plans/<schedule>_<year>/plan.json       schedule, year, roster version and snapshot checksum it's good for
+    plans/<schedule>_<year>/peeps.json      key -> [name, salt], only patching reads it
+    plans/<schedule>_<year>/<date>.json     [name, salt] of who to contact that emailing day
+
+so recs for a day open two small files, whatever size the roster is
+"""
+
+PLANS_DIRNAME = "plans"
+META_FILENAME = "plan.json"
+PEEPS_FILENAME = "peeps.json"
+
+@dataclasses.dataclass
+class YearPlan(object):
+    """
+    A whole year of recs for one schedule, written down so recs don't have to be worked out.
+    Dates are iso strings, peeps are referred to by key (see Person.get_key)
+
+    Only good for the roster version and roster snapshot it was made from.
+    Looking it up doesn't go near the peep folders, so hand edits only make it stale
+    once the next change through dio notices them, see patch_plans.
+    Roster changes patch it in place
+    """
+    schedule_name: str
+    year: int
+    roster_version: int
+    # RosterSnapshot.checksum of the roster it's for, None never matches
+    checksum: Optional[int]
+    # key -> [name, salt]
+    peeps: Dict[str, List[str]]
+    # emailing day -> keys of who to contact, sorted like Person.iter_all sorts.
+    # Loaded off disk only as patching needs them if plan_dirname is set
+    days: Dict[str, List[str]]
+    plan_dirname: Optional[str] = dataclasses.field(default=None, compare=False, repr=False)
+    dirty_days: Set[str] = dataclasses.field(default_factory=set, compare=False, repr=False)
+
+    @staticmethod
+    def get_dirname(dio_dir: DioDir) -> str:
+        return os.path.join(dio_dir.dirname, PLANS_DIRNAME)
+
+    @staticmethod
+    def get_plan_dirname(dio_dir: DioDir, schedule_name: str, year: int) -> str:
+        return os.path.join(YearPlan.get_dirname(dio_dir), "{}_{}".format(schedule_name, year))
+
+    @staticmethod
+    def get_day_filename(plan_dirname: str, day: str) -> str:
+        return os.path.join(plan_dirname, "{}.json".format(day))
+
+    @staticmethod
+    def build(dio_dir: DioDir, schedule: ScheduleABC, year: int):
+        schedule_name = get_schedule_name(schedule)
+        if schedule_name is None:
+            raise Exception("Can only plan the built-in schedules")
+        # writes the snapshot if it wasn't current, the plan's only good as long as it stays that way
+        roster = [Person(name=peep.name, salt=peep.salt) for peep in Roster.load(dio_dir)]
+        snapshot = RosterSnapshot.load(dio_dir)
+        year_partition = schedule.partition_year(roster, year)
+        return YearPlan(
+                schedule_name=schedule_name,
+                year=year,
+                roster_version=snapshot.roster_version if snapshot is not None else dio_dir.get_roster_version(),
+                checksum=snapshot.checksum if snapshot is not None else None,
+                peeps={peep.get_key(): [peep.name, peep.salt] for peep in roster},
+                days={str(day): [peep.get_key() for peep in peeps]
+                      for day, peeps in year_partition.items()})
+
+    def save(self, dio_dir: DioDir) -> None:
+        plans_dirname = YearPlan.get_dirname(dio_dir)
+        if not os.path.exists(plans_dirname):
+            os.makedirs(plans_dirname)
+            dio_dir.append_to_gitignore(PLANS_DIRNAME + "/")
+        self.plan_dirname = YearPlan.get_plan_dirname(dio_dir, self.schedule_name, self.year)
+        os.makedirs(self.plan_dirname, exist_ok=True)
+        self.dirty_days = set(self.days)
+        self.write_changes()
+
+    def write_changes(self) -> None:
+        """
+        The days that changed, then the peeps, then plan.json last:
+        until plan.json has the new roster version, readers take the plan for stale
+        """
+        assert self.plan_dirname is not None
+        for day in sorted(self.dirty_days):
+            atomic_write_json(YearPlan.get_day_filename(self.plan_dirname, day),
+                              [self.peeps[key] for key in self.days[day]])
+        self.dirty_days = set()
+        atomic_write_json(os.path.join(self.plan_dirname, PEEPS_FILENAME), self.peeps)
+        atomic_write_json(os.path.join(self.plan_dirname, META_FILENAME), {
+            "schedule_name": self.schedule_name,
+            "year": self.year,
+            "roster_version": self.roster_version,
+            "checksum": self.checksum,
+        })
+
+    @staticmethod
+    def load_meta(plan_dirname: str) -> Optional[Dict[str, Any]]:
+        """ None if there's no plan there or it's unreadable """
+        profiling.count("files_opened")
+        try:
+            with open(os.path.join(plan_dirname, META_FILENAME), "r") as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def read_day_file(day_filename: str) -> List[List[str]]:
+        profiling.count("files_opened")
+        with open(day_filename, "r") as day_file:
+            return json.load(day_file)
+
+    @staticmethod
+    def load(plan_dirname: str, all_days: bool=True):
+        """
+        all_days=False leaves days to get read as patching gets to them
+        """
+        meta = YearPlan.load_meta(plan_dirname)
+        if meta is None:
+            return None
+        profiling.count("files_opened")
+        with open(os.path.join(plan_dirname, PEEPS_FILENAME), "r") as peeps_file:
+            peeps: Dict[str, List[str]] = json.load(peeps_file)
+        plan = YearPlan(peeps=peeps, days={}, plan_dirname=plan_dirname, **meta)
+        if all_days:
+            for filename in sorted(os.listdir(plan_dirname)):
+                if filename not in (META_FILENAME, PEEPS_FILENAME) and filename.endswith(".json"):
+                    plan.get_day_keys(filename[:-len(".json")])
+        return plan
+
+    @staticmethod
+    def is_current(dio_dir: DioDir, schedule: ScheduleABC, year: int, snapshot: RosterSnapshot) -> bool:
+        """
+        Off plan.json alone, against RosterSnapshot.load_current's snapshot,
+        which has the roster version right and was checked against the folders if it was asked to
+        """
+        schedule_name = get_schedule_name(schedule)
+        if schedule_name is None:
+            return False
+        meta = YearPlan.load_meta(YearPlan.get_plan_dirname(dio_dir, schedule_name, year))
+        return (meta is not None
+                and meta["roster_version"] == snapshot.roster_version
+                and meta["checksum"] == snapshot.checksum)
+
+    @staticmethod
+    def read_day(dio_dir: DioDir, schedule: ScheduleABC, date: datetime.date) -> Optional[List[Person]]:
+        """
+        Same as dio.get_recs, off just that day's file. Only once is_current said so
+        """
+        schedule_name = get_schedule_name(schedule)
+        assert schedule_name is not None
+        day_filename = YearPlan.get_day_filename(
+                YearPlan.get_plan_dirname(dio_dir, schedule_name, date.year), str(date))
+        try:
+            return [Person(*peep) for peep in YearPlan.read_day_file(day_filename)]
+        except FileNotFoundError:
+            # not an emailing day
+            return None
+
+    @staticmethod
+    def load_current(dio_dir: DioDir, schedule: ScheduleABC, year: int, verify: bool=False):
+        """
+        The whole plan for this schedule and year, if there is one and it's not stale.
+        None otherwise.
+        The roster version catches changes through dio.
+        verify also checks the roster snapshot against the folders, to catch hand edits, for one stat per peep
+        """
+        schedule_name = get_schedule_name(schedule)
+        if schedule_name is None:
+            return None
+        snapshot = RosterSnapshot.load_current(dio_dir, verify=verify)
+        if snapshot is None or not YearPlan.is_current(dio_dir, schedule, year, snapshot):
+            return None
+        return YearPlan.load(YearPlan.get_plan_dirname(dio_dir, schedule_name, year))
+
+    def get_recs(self, date: datetime.date) -> Optional[List[Person]]:
+        """ Same as dio.get_recs """
+        if str(date) not in self.days:
+            return None
+        return [Person(*self.peeps[key]) for key in self.days[str(date)]]
+
+    def get_day_keys(self, day: str) -> List[str]:
+        if day not in self.days:
+            assert self.plan_dirname is not None
+            self.days[day] = [Person(*peep).get_key()
+                              for peep in YearPlan.read_day_file(YearPlan.get_day_filename(self.plan_dirname, day))]
+        return self.days[day]
+
+    def get_peep_days(self, schedule: ScheduleABC, peep: Person) -> List[str]:
+        return [str(day) for day, peeps in schedule.partition_year([peep], self.year).items() if peeps]
+
+    def remove_peep(self, schedule: ScheduleABC, key: str) -> None:
+        if key in self.peeps:
+            old_peep = Person(*self.peeps.pop(key))
+            for day in self.get_peep_days(schedule, old_peep):
+                self.get_day_keys(day).remove(key)
+                self.dirty_days.add(day)
+
+    def patch(self, upserted: List[Person], deleted: List[Person]) -> None:
+        """
+        Only touches the days the changed peeps are on, nobody else moves,
+        and only those days get read and written.
+        For schedules that need the whole roster, everyone gets redone off the peeps in the plan
+        and every day gets written
+        """
+        schedule = get_schedule(self.schedule_name)
+        if schedule.needs_whole_roster:
+            for peep in deleted:
+                self.peeps.pop(peep.get_key(), None)
+            for peep in upserted:
+                self.peeps[peep.get_key()] = [peep.name, peep.salt]
+            roster = [Person(*self.peeps[key]) for key in sorted(self.peeps)]
+            self.days = {str(day): sorted(peep.get_key() for peep in peeps)
+                         for day, peeps in schedule.partition_year(roster, self.year).items()}
+            self.dirty_days = set(self.days)
+            return
+        for peep in deleted:
+            self.remove_peep(schedule, peep.get_key())
+        for peep in upserted:
+            key = peep.get_key()
+            self.remove_peep(schedule, key)
+            self.peeps[key] = [peep.name, peep.salt]
+            for day in self.get_peep_days(schedule, peep):
+                bisect.insort(self.get_day_keys(day), key)
+                self.dirty_days.add(day)
+
+@on_roster_change
+def patch_plans(dio_dir: DioDir,
+                upserted: List[Person],
+                deleted: List[Person],
+                old_version: int,
+                new_version: int) -> None:
+    """
+    Plans that were current get patched up to the new roster version.
+    Plans that were already stale get thrown out, `dio plan` makes them again.
+
+    The snapshot's listener went first (this module imports it), so the checksum's the new snapshot's.
+    That's off the roster index, so it gets checked against the folders here, once a change:
+    if somebody'd been at them by hand, the patch would be off whatever the index missed,
+    so all the plans get thrown out instead
+    """
+    plans_dirname = YearPlan.get_dirname(dio_dir)
+    if not os.path.isdir(plans_dirname):
+        return
+    snapshot = RosterSnapshot.load(dio_dir)
+    if snapshot is not None and snapshot.roster_version == new_version:
+        checksum = snapshot.checksum
+    else:
+        checksum = get_index_checksum(RosterIndex.load(dio_dir))
+    hand_edited = checksum != get_folder_checksum(dio_dir)
+    for plan_dirname in sorted(os.listdir(plans_dirname)):
+        plan_dirname = os.path.join(plans_dirname, plan_dirname)
+        if not os.path.isdir(plan_dirname):
+            # one big file, from before plans got split up by day
+            os.remove(plan_dirname)
+            continue
+        if hand_edited:
+            shutil.rmtree(plan_dirname)
+            continue
+        plan = YearPlan.load(plan_dirname, all_days=False)
+        if plan is None or plan.roster_version != old_version:
+            shutil.rmtree(plan_dirname)
+            continue
+        plan.patch(upserted, deleted)
+        plan.roster_version = new_version
+        plan.checksum = checksum
+        plan.write_changes()
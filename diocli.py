@@ -1,21 +1,37 @@
 #!/usr/bin/env python3.7
 from __future__ import annotations
-import functools
-import csv
-import random
-import sys
-import email
-import smtplib
-import argparse
 import datetime
-import crontab
+import os
 import click
-from dio import *
-from typing import Optional, Any, Dict, List
+from typing import Optional, Any, List
+
+"""
+Each command imports what it uses inside the command,
+so `dio add` and `dio --help` don't pay for smtplib, crontab and the rest
+"""
+
+# same as sorted(dio.SCHEDULES), spelled out so --help doesn't import every schedule
+SCHEDULE_NAMES = ["balanced", "default", "threetimes"]
 
 @click.group()
-def cli():
-    pass
+@click.option("--profile", "profile_format", type=click.Choice(["text", "json"]), default=None,
+              help="Print where the time went, once the command is done")
+@click.option("--cprofile", "cprofile_filename", default=None,
+              help="Also dump cProfile stats to this file")
+@click.pass_context
+def cli(ctx, profile_format, cprofile_filename):
+    if profile_format is not None:
+        from dio import profiling
+        profiling.enable()
+        ctx.call_on_close(lambda: click.echo(profiling.format_report(profile_format), err=True))
+    if cprofile_filename is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        def dump_cprofile() -> None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_filename)
+        ctx.call_on_close(dump_cprofile)
 
 @cli.command()
 @click.argument("name", required=True)
@@ -25,6 +41,7 @@ def add(name):
     
     Given one name twice, current behavior is replacing the salt corresponding to the name
     """
+    from dio import DioDir, Person
     dio_dir: DioDir = DioDir()
     new_peep: Person = Person(name=name)
     new_peep.save(dio_dir)
@@ -32,58 +49,309 @@ def add(name):
 
 @cli.command()
 @click.argument("batch_file_name", required=True)
-def batchadd(batch_file_name):
+@click.option("--workers", default=8, help="Number of peeps written at once")
+def batchadd(batch_file_name, workers):
     """
     Adds a batch of peeps to diogenes.
 
-    Takes a csv with one field only, field name is `name`
+    Takes a csv with one field only, field name is `name`.
+    If a name shows up more than once, the last row wins
     """
+    import csv
+    import random
+    from dio import BatchResult, DioDir, Person, batch_save
     click.echo("Processing batch file...")
     dio_dir: DioDir = DioDir()
+    def report_progress(res: BatchResult) -> None:
+        click.echo("{} peeps, {:.0f} peeps/sec".format(res.rows, res.rows_per_sec))
     with open(batch_file_name, "r") as batch_file:
         reader = csv.DictReader(batch_file, fieldnames=["name"])
-        for row in reader:
-            # if you don't do this they all have the same salt
-            new_rand: str = str(random.randint(int(1e30), int(9e30)))
-            new_peep: Person = Person(name=row["name"], salt=new_rand)
-            new_peep.save(dio_dir)
-    click.echo("Finished processing batch file...")
+        # if you don't do this they all have the same salt
+        new_peeps = (Person(name=row["name"], salt=str(random.randint(int(1e30), int(9e30))))
+                     for row in reader)
+        res: BatchResult = batch_save(dio_dir, new_peeps, workers=workers, progress=report_progress)
+    click.echo("Finished processing batch file: {} peeps ({} duplicates) in {:.2f}s, {:.0f} peeps/sec".format(
+        res.rows, res.duplicates, res.seconds, res.rows_per_sec))
+
+@cli.command()
+@click.argument("name", required=True)
+def delete(name):
+    """
+    Deletes a person from diogenes, notes folder and all
+    """
+    from dio import DioDir, Person
+    dio_dir: DioDir = DioDir()
+    Person(name=name).delete(dio_dir)
+    click.echo("Person with name {} deleted".format(name))
+
+@cli.command("export")
+@click.argument("filename", default="-")
+def export_cmd(filename):
+    """
+    Writes the whole roster, salts included, to FILENAME as JSONL, one peep a line.
+    Gzipped if it ends in .gz, stdout if it's - or not given. Notes aren't in it
+    """
+    from dio import DioDir, export_roster
+    from dio.export import open_roster_file
+    with open_roster_file(filename, "w") as out_file:
+        num_peeps: int = export_roster(DioDir(), out_file)
+    click.echo("Exported {} peeps".format(num_peeps), err=True)
+
+@cli.command("import")
+@click.argument("filename", required=True)
+@click.option("--replace", is_flag=True,
+              help="Also take out peeps that aren't in the file. Their notes folders stay")
+@click.option("--workers", default=8, help="Number of peeps written at once")
+def import_cmd(filename, replace, workers):
+    """
+    Adds everyone in a `dio export` file (.gz too, - for stdin), salts and all.
+    Peeps already here get their salt from the file, their notes are left alone
+    """
+    from dio import BatchResult, DioDir, import_roster
+    from dio.export import open_roster_file
+    def report_progress(res: BatchResult) -> None:
+        click.echo("{} peeps, {:.0f} peeps/sec".format(res.rows, res.rows_per_sec))
+    with open_roster_file(filename, "r") as in_file:
+        res: BatchResult = import_roster(DioDir(), in_file, replace=replace, workers=workers, progress=report_progress)
+    click.echo("Imported {} peeps ({} duplicates) in {:.2f}s".format(res.rows, res.duplicates, res.seconds))
+
+@cli.command()
+@click.argument("prefix", default="")
+def find(prefix):
+    """
+    Lists the peeps whose names start with PREFIX, case sensitive. No prefix lists everybody
+    """
+    from dio import DioDir, NameIndex
+    index: NameIndex = NameIndex.load_current(DioDir())
+    for name in index.find(prefix):
+        click.echo(name)
+
+@cli.command()
+@click.argument("name", required=True)
+def show(name):
+    """
+    Shows one peep: their notes folder and the next day the default schedule recommends them
+    """
+    from dio import DefaultSchedule, DioDir, NameIndex, Person
+    dio_dir: DioDir = DioDir()
+    index: NameIndex = NameIndex.load_current(dio_dir)
+    peep_dirname: Optional[str] = index.get_dir(name)
+    if peep_dirname is None:
+        near_names: List[str] = index.find(name[:1])
+        raise click.ClickException("No peep named {}{}".format(
+            name, ". Did you mean: " + ", ".join(near_names[:10]) if near_names else ""))
+    peep: Person = Person.from_dir(peep_dirname)
+    click.echo("name: {}".format(peep.name))
+    click.echo("folder: {}".format(peep_dirname))
+    today: datetime.date = datetime.datetime.now().date()
+    sched: DefaultSchedule = DefaultSchedule()
+    next_rec: Optional[datetime.date] = None
+    for year in (today.year, today.year + 1):
+        next_rec = min((day for day, peeps in sched.partition_year([peep], year).items() if peeps and day >= today),
+                       default=None)
+        if next_rec is not None:
+            break
+    click.echo("next recommended: {}".format(next_rec if next_rec is not None else "not in the next two years"))
+
+@cli.command("migrate-layout")
+@click.option("--layout", "layout_name", default="sharded", type=click.Choice(["flat", "sharded"]))
+def migrate_layout(layout_name):
+    """
+    Moves the peep folders into peeps/ab/cd/peep_<name> shard folders, or back out again.
+    Worth it past a hundred thousand peeps or so.
+    Safe to interrupt, run it again to finish up
+    """
+    from dio import DioDir
+    from dio.dio_dir import LAYOUTS
+    from dio.layout import migrate_layout
+    dio_dir: DioDir = DioDir()
+    def report_progress(num_moved: int) -> None:
+        click.echo("{} peeps moved".format(num_moved))
+    num_moved: int = migrate_layout(dio_dir, LAYOUTS[layout_name], progress=report_progress)
+    click.echo("Done, moved {} peeps into the {} layout".format(num_moved, layout_name))
 
 @cli.command()
-def dryrecs():
+@click.option("--year", type=int, default=None, help="Defaults to this year")
+@click.option("--schedule", "schedule_name", default="default", type=click.Choice(SCHEDULE_NAMES))
+def plan(year, schedule_name):
+    """
+    Works out the recommendations for the whole year ahead of time,
+    so recs and dryrecs just look them up.
+    Adding and deleting peeps keeps the plan up to date
+    """
+    from dio import DioDir, YearPlan, get_schedule
+    dio_dir: DioDir = DioDir()
+    if year is None:
+        year = datetime.datetime.now().year
+    year_plan: YearPlan = YearPlan.build(dio_dir, get_schedule(schedule_name), year)
+    year_plan.save(dio_dir)
+    click.echo("Planned {} emailing days for {} peeps in {}".format(
+        len(year_plan.days), len(year_plan.peeps), year))
+
+@cli.command()
+@click.option("--start-year", type=int, default=None, help="Defaults to this year")
+@click.option("--end-year", type=int, default=None, help="Inclusive, defaults to the start year")
+@click.option("--schedule", "schedule_names", multiple=True, type=click.Choice(SCHEDULE_NAMES),
+              help="Give it more than once to compare schedules side by side. Defaults to default")
+@click.option("--peeps", "num_peeps", type=int, default=None,
+              help="Simulate this many made up peeps instead of the dio dir's")
+@click.option("--workers", default=4, help="Processes to spread the years over, 1 for none")
+@click.option("--json", "as_json", is_flag=True, help="Print the reports as JSON")
+def simulate(start_year, end_year, schedule_names, num_peeps, workers, as_json):
+    """
+    Runs schedules over whole years and reports how fair they are:
+    peeps per emailing day, times each peep comes up, and who never does.
+    Doesn't email anyone
+    """
+    import dataclasses
+    import json
+    from dio import DioDir, Roster, get_schedule
+    from dio.simulate import format_report, make_synthetic_roster, simulate
+    if start_year is None:
+        start_year = datetime.datetime.now().year
+    if end_year is None:
+        end_year = start_year
+    if num_peeps is None:
+        roster: Roster = Roster.load(DioDir())
+    else:
+        roster = make_synthetic_roster(num_peeps)
+    schedules = {schedule_name: get_schedule(schedule_name) for schedule_name in (schedule_names or ["default"])}
+    reports = simulate(roster, schedules, list(range(start_year, end_year + 1)), workers=workers)
+    if as_json:
+        click.echo(json.dumps([dataclasses.asdict(report) for report in reports], indent=2, default=str))
+    else:
+        click.echo("\n\n".join(map(format_report, reports)))
+
+def recs_for_dirs(dir_patterns: List[str], workers: int, send: bool, wait: bool=False) -> None:
+    """ recs and dryrecs --dirs """
+    from dio import DioDir
+    from dio.fanout import expand_dirnames, fan_out, flush_results, format_summary, spool_results
+    today: datetime.date = datetime.datetime.now().date()
+    dirnames: List[str] = expand_dirnames(dir_patterns)
+    results = fan_out(dirnames, "default", today, workers=workers)
+    if send:
+        to_flush = spool_results(results, today)
+        if wait:
+            flush_results(to_flush, today, retries=3, backoff_secs=30.0)
+        else:
+            for res in to_flush:
+                start_background_flush(DioDir(res.dirname))
+    else:
+        for res in results:
+            if res.message is not None:
+                click.echo("{}:\n{}\n".format(res.dirname, res.message))
+    click.echo(format_summary(results))
+    if not dirnames or any(res.error is not None for res in results):
+        raise SystemExit(1)
+
+@cli.command()
+@click.option("--daemon", "daemon_url", default=None, envvar="DIO_DAEMON",
+              help="Ask a running `dio serve` at this url first, like http://127.0.0.1:8768")
+@click.option("--dirs", "dir_patterns", multiple=True,
+              help="Dio dir or glob of them, give it more than once. Does every one instead of ~/.diogenes")
+@click.option("--workers", default=4, help="Processes to spread the --dirs over, 1 for none")
+def dryrecs(daemon_url, dir_patterns, workers):
     """
     Gives you the recommendations for today without emailing them
     """
+    if dir_patterns:
+        recs_for_dirs(list(dir_patterns), workers, send=False)
+        return
+    from dio import DefaultSchedule, DioDir, Person, ScheduleABC, get_next_emailing_day, get_recs, recs_to_message
     click.echo("Recommendations, not emailed: ")
     dio_dir: DioDir = DioDir()
     sched: ScheduleABC = DefaultSchedule()
     today: datetime.date = datetime.datetime.now().date()
+    if daemon_url is not None:
+        from dio.daemon import ask_daemon
+        daemon_message: Optional[str] = ask_daemon(daemon_url, dio_dir, today)
+        if daemon_message is not None:
+            click.echo(daemon_message)
+            return
     res: Optional[List[Person]] = get_recs(dio_dir, sched, today)
-    next_day: datetime.date = sched.next_emailing_day(today)
+    next_day: datetime.date = get_next_emailing_day(dio_dir, sched, today)
     click.echo(recs_to_message(res, next_day))
 
 @cli.command()
-def recs():
+@click.option("--dirs", "dir_patterns", multiple=True,
+              help="Dio dir or glob of them, give it more than once. Emails every one's recs, "
+                   "one SMTP session per distinct email setup")
+@click.option("--workers", default=4, help="Processes to spread the --dirs over, 1 for none")
+@click.option("--wait", is_flag=True, help="Send it before returning, instead of leaving it to a background `dio flush`")
+def recs(dir_patterns, workers, wait):
     """
-    Emails the destination email the recommendations for today
+    Emails the destination email the recommendations for today.
+
+    The email goes in the spool in the dio dir, and a `dio flush` in the background sends it,
+    so a slow SMTP server doesn't hold this up. Running it twice in a day doesn't email twice
     """
-    click.echo("Emailing recommendations to destination...")
+    if dir_patterns:
+        recs_for_dirs(list(dir_patterns), workers, send=True, wait=wait)
+        return
+    from dio import (DefaultSchedule, DioDir, Person, ScheduleABC, Settings,
+                     get_next_emailing_day, get_recs, make_message, recs_to_message)
+    from dio.spool import spool_message
     dio_dir: DioDir = DioDir()
+    settings: Optional[Settings] = dio_dir.get_settings()
+    assert settings is not None, "Have to setup diogenes to get emails. Run `dio setupemail`"
     sched: ScheduleABC = DefaultSchedule()
     today: datetime.date = datetime.datetime.now().date()
     res: Optional[List[Person]] = get_recs(dio_dir, sched, today)
-    next_day: datetime.date = sched.next_emailing_day(today)
+    next_day: datetime.date = get_next_emailing_day(dio_dir, sched, today)
     message: str = recs_to_message(res, next_day)
+    if spool_message(dio_dir, make_message(message, today, settings), today):
+        click.echo("Recommendations spooled")
+    else:
+        click.echo("Today's recommendations are spooled or emailed already, not doing it twice")
+    if wait:
+        flush_dio_dir(dio_dir, settings, retries=3, backoff_secs=30.0)
+    else:
+        click.echo("Emailing in the background, see {}".format(start_background_flush(dio_dir)))
+
+def start_background_flush(dio_dir: Any) -> str:
+    """ A `dio flush` of that dio dir that outlives this one. Returns where it logs to """
+    import subprocess
+    import sys
+    from dio.spool import get_spool_dirname
+    with open(os.path.join(get_spool_dirname(dio_dir), "flush.log"), "a") as log_file:
+        # its own session, so it outlives cron's
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "flush", "--dir", dio_dir.dirname],
+                         stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file,
+                         start_new_session=True)
+    return log_file.name
+
+def flush_dio_dir(dio_dir: Any, settings: Any, retries: int, backoff_secs: float) -> None:
+    """ flush and recs --wait """
+    from dio.spool import FlushResult, flush
+    res: FlushResult = flush(dio_dir, settings, retries=retries, backoff_secs=backoff_secs)
+    for date in res.sent:
+        click.echo("Recommendations for {} emailed!".format(date))
+    if res.error is not None:
+        click.echo("Couldn't email {}, still spooled: {}".format(", ".join(map(str, res.pending)), res.error), err=True)
+        raise SystemExit(1)
+    if res.pending:
+        click.echo("Another flush is sending {} already".format(", ".join(map(str, res.pending))))
+
+@cli.command()
+@click.option("--retries", default=3, help="Tries per email past the first, before leaving it for next time")
+@click.option("--backoff", "backoff_secs", default=30.0, help="Seconds before the first retry, doubling each retry")
+@click.option("--dir", "dirname", default=None, help="Dio dir to flush instead of ~/.diogenes")
+def flush(retries, backoff_secs, dirname):
+    """
+    Emails whatever `dio recs` spooled that hasn't gone out yet, oldest first, over one SMTP session
+    """
+    from dio import DioDir, Settings
+    dio_dir: DioDir = DioDir(dirname)
     settings: Optional[Settings] = dio_dir.get_settings()
     assert settings is not None, "Have to setup diogenes to get emails. Run `dio setupemail`"
-    send_message(message, today, settings)
-    click.echo("Recommendations emailed!")
+    flush_dio_dir(dio_dir, settings, retries, backoff_secs)
 
 @cli.command()
 def setupemail():
     """
     Sets up the email for diogenes
     """
+    from dio import DioDir
     dio_dir: DioDir = DioDir()
     dio_dir.set_settings_interactive()
     click.echo("Setup complete. To setup the diogenes cronjob, run `dio setupcron`")
@@ -92,8 +360,9 @@ def setupemail():
 def setupcron():
     """
     Sets up the cronjob for diogenes. Run `dio setupemail` before this one.
-    Sets up only up to one cronjob per user. Sets cronjob for this user.
+    Sets up only up to one recs cronjob and one flush cronjob per user. Sets cronjobs for this user.
     """
+    import crontab
     click.echo("Note that you should have run `dio setupemail` before this, or it will error out every time")
     curr_cron = crontab.CronTab(user=True)
     if len(list(curr_cron.find_comment("diogenes8"))) > 0:
@@ -101,7 +370,33 @@ def setupcron():
     else:
         job = curr_cron.new(command="dio recs", comment="diogenes8")
         job.hour.on(15)
-        curr_cron.write_to_user(user=True)
+    if len(list(curr_cron.find_comment("diogenes8-flush"))) == 0:
+        # retries whatever recs spooled and couldn't send
+        flush_job = curr_cron.new(command="dio flush", comment="diogenes8-flush")
+        flush_job.minute.on(30)
+    curr_cron.write_to_user(user=True)
+
+@cli.command()
+@click.option("--dir", "dirnames", multiple=True, help="Dio dir to look after, give it once per dio dir. Defaults to ~/.diogenes")
+@click.option("--hour", default=15, help="Hour of the day to send recs at")
+@click.option("--poll", default=60.0, help="Seconds between checking the dio dirs for changes")
+@click.option("--port", type=int, default=None, help="Localhost port that `dio dryrecs --daemon` asks. Defaults to 8768")
+@click.option("--workers", default=4, help="Number of dio dirs emailed at once")
+def serve(dirnames, hour, poll, port, workers):
+    """
+    Runs in the foreground, sending recs for many dio dirs every day.
+    Use instead of `dio setupcron` when one box does lots of dio dirs
+    """
+    from dio import DefaultSchedule, DioDir
+    from dio.daemon import DEFAULT_PORT, RecsDaemon
+    if port is None:
+        port = DEFAULT_PORT
+    daemon: RecsDaemon = RecsDaemon(list(dirnames) or [DioDir.get_default_dirname()],
+                                    DefaultSchedule(),
+                                    send_hour=hour,
+                                    workers=workers)
+    click.echo("Serving {} dio dirs, dryrecs on http://127.0.0.1:{}".format(len(daemon.tenants), port))
+    daemon.serve_forever(port=port, poll_secs=poll)
 
 if __name__ == "__main__":
     cli()
@@ -8,13 +8,22 @@ Lists what all the recommendations are going to be this year
 Rather spoils the surprise a bit, but still here for testing reasons
 """
 
-def list_all_recs(dio_dir: dio.DioDir, sched: dio.ScheduleABC, year: int) -> List[Optional[List[dio.Person]]]:
-    return list(
-            map(
-                lambda x: dio.get_recs(dio_dir, sched, x),
-                dio.days_in_year(year)
-                )
-            )
+def list_all_recs(dio_dir: dio.DioDir, sched: dio.ScheduleABC, year: int, vectorized: bool=False) -> List[Optional[List[dio.Person]]]:
+    """
+    Same as get_recs for every day of the year, but the roster is only read and bucketed once.
+    vectorized does the bucketing with numpy, for the built-in schedules
+    """
+    saved_plan = dio.YearPlan.load_current(dio_dir, sched, year)
+    if saved_plan is not None:
+        return list(map(saved_plan.get_recs, dio.days_in_year(year)))
+    roster = dio.Roster.load(dio_dir)
+    if vectorized:
+        year_plan = dio.vectorized.partition_year(sched, roster, year)
+    else:
+        year_plan = sched.partition_year(roster, year)
+    # real Persons out of the roster's views, same as the saved plan hands back
+    return [[dio.Person(name=peep.name, salt=peep.salt) for peep in year_plan[day]] if day in year_plan else None
+            for day in dio.days_in_year(year)]
 
 if __name__ == "__main__":
     dio_dir = dio.DioDir()
@@ -28,6 +28,9 @@ setup(
             "click",
             "python-crontab",
         ],
+        extras_require={
+            "vectorized": ["numpy"],
+        },
         entry_points = """
         [console_scripts]
         dio=diocli:cli
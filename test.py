@@ -2,10 +2,28 @@ import hypothesis as hp
 import hypothesis.strategies as st
 import hypothesis_fspaths as hy_fs
 import dio
+# import everything up front, modules imported for the first time under pyfakefs don't get unpatched right
+import dio.daemon
+import dio.roster_snapshot
+import dio.simulate
+import dio.layout
+import dio.name_index
+import dio.export
+import dio.fanout
+import dio.spool
+import difftest
 import datetime
+import io
+import json
 import pytest
 import pyfakefs
 import os
+import pickle
+import shutil
+import smtplib
+import subprocess
+import sys
+import threading
 
 # fs from pyfakefs
 
@@ -32,6 +50,10 @@ def dio_dir_st(draw, dirname=hy_fs.fspaths()):
 def sched_st(draw):
     return dio.DefaultSchedule()
 
+@st.composite
+def any_sched_st(draw):
+    return draw(st.sampled_from([dio.DefaultSchedule(), dio.ThreeTimesSchedule()]))
+
 @hp.given(peep=person_st())
 def test_person_init(peep):
     # assert not null
@@ -66,6 +88,260 @@ def test_get_all_idempotence(fs, peep, dio_dir):
     assert len(fst_res) > 0
     assert fst_res == snd_res
 
+@hp.given(peeps=st.lists(person_st(), max_size=10), dio_dir=dio_dir_st())
+def test_get_all_matches_roster_index(fs, peeps, dio_dir):
+    for peep in peeps:
+        peep.save(dio_dir)
+    index = dio.RosterIndex.load(dio_dir)
+    assert sorted(
+            (entry["name"], entry["salt"]) for entry in index.entries.values()
+    ) == sorted(
+            (peep.name, peep.salt) for peep in dio.Person.get_all(dio_dir))
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), new_salt=st.integers(min_value=1e30, max_value=9e30), dio_dir=dio_dir_st())
+def test_roster_snapshot_matches_folders(fs, peeps, new_salt, dio_dir):
+    for peep in peeps:
+        peep.save(dio_dir)
+    if peeps:
+        peeps[0].delete(dio_dir)
+    assert list(dio.Roster.load(dio_dir)) == dio.Person.get_all(dio_dir)
+    snapshot = dio.RosterSnapshot.load_current(dio_dir)
+    assert snapshot is not None
+    assert list(snapshot) == dio.Person.get_all(dio_dir)
+    for peep in snapshot:
+        assert snapshot.get(peep.name) is not None
+    if len(snapshot):
+        hand_edited = dio.Person(name=snapshot[0].name, salt=str(new_salt) + "0")
+        hand_edited.to_file(dio.Person.get_filename(hand_edited.get_dir(dio_dir)))
+        assert dio.RosterSnapshot.load_current(dio_dir) is None
+        assert dio.Roster.load(dio_dir).get(hand_edited.name) == hand_edited
+        assert list(dio.RosterSnapshot.load_current(dio_dir)) == dio.Person.get_all(dio_dir)
+
+def test_roster_load_writes_snapshot_once(tmp_path, monkeypatch):
+    dio_dir = dio.DioDir(str(tmp_path))
+    peeps = [dio.Person(name="peep{}".format(peep_idx)) for peep_idx in range(5)]
+    for peep in peeps:
+        peep.save(dio_dir)
+    writes = []
+    write = dio.RosterSnapshot.write
+    monkeypatch.setattr(dio.RosterSnapshot, "write", lambda *args: writes.append(args) or write(*args))
+    # a hand edit makes iter_all fire a roster change, and the listener writes the snapshot
+    hand_edited = dio.Person(name=peeps[0].name, salt=str(int(1e30)))
+    hand_edited.to_file(dio.Person.get_filename(hand_edited.get_dir(dio_dir)))
+    assert list(dio.Roster.load(dio_dir)) == dio.Person.get_all(dio_dir)
+    assert len(writes) == 1
+    # nothing changed, just the snapshot gone
+    os.remove(dio.RosterSnapshot.get_filename(dio_dir))
+    dio.Roster.load(dio_dir)
+    assert len(writes) == 2
+    assert list(dio.RosterSnapshot.load_current(dio_dir)) == dio.Person.get_all(dio_dir)
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), prefix=st.text(max_size=2), dio_dir=dio_dir_st())
+def test_name_index_matches_roster(fs, peeps, prefix, dio_dir):
+    dio.NameIndex.load_current(dio_dir)
+    for peep in peeps:
+        peep.save(dio_dir)
+    if peeps:
+        peeps[0].delete(dio_dir)
+    # kept up to date by the saves and deletes, not rebuilt
+    index = dio.NameIndex.load(dio_dir)
+    assert index.roster_version == dio_dir.get_roster_version()
+    names = sorted(peep.name for peep in dio.Person.get_all(dio_dir))
+    assert index.names == names
+    assert index.find(prefix) == [name for name in names if name.startswith(prefix)]
+    for name in names:
+        assert dio.Person.from_dir(index.get_dir(name)).name == name
+    if peeps:
+        assert index.get_dir(peeps[0].name) is None
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), other_peep=person_st(), dio_dir=dio_dir_st())
+def test_export_import_involution(fs, peeps, other_peep, dio_dir):
+    for peep in peeps:
+        peep.save(dio_dir)
+    exported = io.StringIO()
+    assert dio.export_roster(dio_dir, exported) == len(dio.Person.get_all(dio_dir))
+    roster = dio.Person.get_all(dio_dir)
+    other_peep.save(dio_dir)
+    notes_filename = os.path.join(other_peep.get_dir(dio_dir), "notes.txt")
+    with open(notes_filename, "w") as notes_file:
+        notes_file.write("hi")
+    exported.seek(0)
+    dio.import_roster(dio_dir, exported, replace=True)
+    assert dio.Person.get_all(dio_dir) == roster
+    assert list(dio.Roster.load(dio_dir)) == roster
+    # replace only takes out peep.json
+    assert os.path.exists(notes_filename)
+
+class PipeIO(io.StringIO):
+    """ like stdin from a pipe """
+    def seekable(self):
+        return False
+
+@hp.given(peeps=st.lists(person_st(), min_size=1, max_size=10), dio_dir=dio_dir_st())
+def test_import_bad_line(fs, peeps, dio_dir):
+    lines = "".join('{{"name": {}, "salt": "{}"}}\n'.format(json.dumps(peep.name), peep.salt) for peep in peeps)
+    before = dio.Person.get_all(dio_dir)
+    with pytest.raises(Exception, match="Line {} isn't a peep".format(len(peeps) + 1)):
+        dio.import_roster(dio_dir, io.StringIO(lines + "not json\n"))
+    assert dio.Person.get_all(dio_dir) == before
+    # a pipe gets everyone before the bad line, and the roster's consistent about it
+    with pytest.raises(Exception):
+        dio.import_roster(dio_dir, PipeIO(lines + "not json\n"))
+    last_by_key = {peep.get_key(): peep for peep in peeps}
+    assert all(peep in dio.Person.get_all(dio_dir) for peep in last_by_key.values())
+    assert list(dio.RosterSnapshot.load_current(dio_dir)) == dio.Person.get_all(dio_dir)
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), workers=st.integers(min_value=1, max_value=8), dio_dir=dio_dir_st())
+def test_concurrent_load_matches_serial(fs, peeps, workers, dio_dir):
+    for peep in peeps:
+        peep.save(dio_dir)
+    dio_dir.load_workers = 1
+    serial_roster = dio.Person.get_all(dio_dir)
+    serial_checksum = dio.roster_snapshot.get_folder_checksum(dio_dir)
+    if os.path.exists(dio.RosterIndex.get_filename(dio_dir)):
+        os.remove(dio.RosterIndex.get_filename(dio_dir))
+    concurrent_dio_dir = dio.DioDir(dio_dir.dirname)
+    concurrent_dio_dir.load_workers = workers
+    assert dio.Person.get_all(concurrent_dio_dir) == serial_roster
+    assert dio.roster_snapshot.get_folder_checksum(concurrent_dio_dir) == serial_checksum
+    if not os.path.exists("/proc/mounts"):
+        fs.create_file("/proc/mounts",
+                       contents="/dev/sda1 / ext4 rw 0 0\nserver:/home /mnt/dio\\040home nfs4 rw 0 0\n")
+    assert dio.dio_dir.get_fs_type("/mnt/dio home/.diogenes") == "nfs4"
+    assert dio.dio_dir.get_fs_type("/mnt/dio") == "ext4"
+
+def test_bad_load_workers_env_falls_back(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv(dio.dio_dir.LOAD_WORKERS_ENV, "lots")
+    assert dio.DioDir(str(tmp_path)).get_load_workers() == 1
+    assert dio.dio_dir.LOAD_WORKERS_ENV in capsys.readouterr().err
+    monkeypatch.setenv(dio.dio_dir.LOAD_WORKERS_ENV, "3")
+    assert dio.DioDir(str(tmp_path)).get_load_workers() == 3
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), dio_dir=dio_dir_st())
+def test_migrate_layout_keeps_roster(fs, peeps, dio_dir):
+    dio.migrate_layout(dio_dir, dio.dio_dir.FLAT_LAYOUT)
+    for peep in peeps:
+        peep.save(dio_dir)
+    flat_roster = dio.Person.get_all(dio_dir)
+    dio.migrate_layout(dio_dir, dio.dio_dir.SHARDED_LAYOUT)
+    assert dio.DioDir(dio_dir.dirname).get_layout() == dio.dio_dir.SHARDED_LAYOUT
+    assert all(os.path.isdir(peep.get_dir(dio_dir)) for peep in flat_roster)
+    assert dio.Person.get_all(dio_dir) == flat_roster
+    # halfway back, like an interrupted migrate-layout
+    dio_dir.set_layout(dio.dio_dir.FLAT_LAYOUT)
+    assert dio.Person.get_all(dio_dir) == flat_roster
+    if flat_roster:
+        flat_roster[0].save(dio_dir)
+        flat_roster[-1].delete(dio_dir)
+        flat_roster.pop()
+    assert dio.Person.get_all(dio_dir) == flat_roster
+    dio.migrate_layout(dio_dir, dio.dio_dir.FLAT_LAYOUT)
+    assert dio.Person.get_all(dio_dir) == flat_roster
+    assert not os.path.exists(os.path.join(dio_dir.dirname, dio.dio_dir.SHARDS_DIRNAME))
+
+@hp.given(peep=person_st(), new_salt=st.integers(min_value=1e30, max_value=9e30), dio_dir=dio_dir_st())
+def test_get_all_sees_hand_edits_past_roster_index(fs, peep, new_salt, dio_dir):
+    peep.save(dio_dir)
+    dio.Person.get_all(dio_dir)
+    hand_edited = dio.Person(name=peep.name, salt=str(new_salt) + "0")
+    hand_edited.to_file(dio.Person.get_filename(peep.get_dir(dio_dir)))
+    assert hand_edited in dio.Person.get_all(dio_dir)
+
+@hp.given(peep=person_st(), dio_dir=dio_dir_st())
+def test_delete_removes_from_roster_index(fs, peep, dio_dir):
+    peep.save(dio_dir)
+    peep.delete(dio_dir)
+    index = dio.RosterIndex.load(dio_dir)
+    assert index.relpath(peep.get_dir(dio_dir)) not in index.entries
+    assert peep not in dio.Person.get_all(dio_dir)
+
+@hp.given(peep=person_st(), dio_dir=dio_dir_st())
+def test_iter_all_does_not_look_inside_notes(fs, peep, dio_dir):
+    peep.save(dio_dir)
+    notes_dirname = os.path.join(peep.get_dir(dio_dir), "notes", "peep_notes")
+    os.makedirs(notes_dirname, exist_ok=True)
+    # salt that no real peep gets
+    dio.Person(name=peep.name, salt="1").to_file(dio.Person.get_filename(notes_dirname))
+    all_peeps = list(dio.Person.iter_all(dio_dir))
+    assert peep in all_peeps
+    assert all(curr_peep.salt != "1" for curr_peep in all_peeps)
+
+@hp.given(peeps=st.lists(person_st(name=st.sampled_from(["a", "b", "c"])), max_size=20), dio_dir=dio_dir_st())
+def test_batch_save_last_duplicate_wins(fs, peeps, dio_dir):
+    res = dio.batch_save(dio_dir, iter(peeps), workers=4)
+    assert res.rows == len(peeps)
+    last_by_name = {peep.name: peep for peep in peeps}
+    assert res.duplicates == len(peeps) - len(last_by_name)
+    all_peeps = dio.Person.get_all(dio_dir)
+    for peep in last_by_name.values():
+        assert peep in all_peeps
+        assert dio.Person.from_dir(peep.get_dir(dio_dir)) == peep
+
+@hp.given(peeps=st.lists(person_st(), min_size=1, max_size=10), dio_dir=dio_dir_st())
+def test_batch_save_stream_blowing_up_still_changes_roster(fs, peeps, dio_dir):
+    def bad_stream():
+        yield from peeps
+        raise ValueError("bad row")
+    old_version = dio_dir.get_roster_version()
+    with pytest.raises(ValueError):
+        dio.batch_save(dio_dir, bad_stream(), workers=4)
+    assert dio_dir.get_roster_version() > old_version
+    index = dio.RosterIndex.load(dio_dir)
+    for peep in peeps:
+        assert index.relpath(peep.get_dir(dio_dir)) in index.entries
+
+def test_atomic_writes_keep_umask_mode(tmp_path):
+    dio_dir = dio.DioDir(str(tmp_path))
+    peep = dio.Person(name="a", salt="1" * 31)
+    peep.save(dio_dir)
+    expected_mode = 0o666 & ~dio.utils.UMASK
+    for filename in [dio.Person.get_filename(peep.get_dir(dio_dir)),
+                     dio_dir.get_roster_version_filename(),
+                     dio.RosterIndex.get_filename(dio_dir)]:
+        assert os.stat(filename).st_mode & 0o777 == expected_mode
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=10),
+        new_peep=person_st(),
+        dio_dir=dio_dir_st(),
+        sched=st.one_of(any_sched_st(), st.just(dio.BalancedSchedule())),
+        year=st.integers(min_value=1900, max_value=2200))
+@hp.settings(max_examples=20)
+def test_year_plan_patches_match_rebuilding(fs, peeps, new_peep, dio_dir, sched, year):
+    for peep in peeps:
+        peep.save(dio_dir)
+    dio.YearPlan.build(dio_dir, sched, year).save(dio_dir)
+    new_peep.save(dio_dir)
+    if peeps:
+        peeps[0].delete(dio_dir)
+    patched = dio.YearPlan.load_current(dio_dir, sched, year)
+    rebuilt = dio.YearPlan.build(dio_dir, sched, year)
+    assert patched == rebuilt
+    for curr_day in list(dio.days_in_year(year))[::7]:
+        assert patched.get_recs(curr_day) == sched.partition_year(
+                dio.Person.get_all(dio_dir), year).get(curr_day)
+
+@hp.given(peep=person_st(), new_peep=person_st(), dio_dir=dio_dir_st(), sched=sched_st(), year=st.integers(min_value=1900, max_value=2200))
+@hp.settings(max_examples=20)
+def test_year_plan_goes_stale(fs, peep, new_peep, dio_dir, sched, year):
+    hp.assume(peep.get_key() != new_peep.get_key())
+    dio.YearPlan.build(dio_dir, sched, year).save(dio_dir)
+    assert dio.YearPlan.load_current(dio_dir, sched, year) is not None
+    dio_dir.bump_roster_version()
+    assert dio.YearPlan.load_current(dio_dir, sched, year) is None
+    # rm -rf on a peep folder, then a dio add on top of it
+    peep.save(dio_dir)
+    dio.YearPlan.build(dio_dir, sched, year).save(dio_dir)
+    shutil.rmtree(peep.get_dir(dio_dir))
+    # looking it up doesn't check the folders, verifying does
+    assert dio.YearPlan.load_current(dio_dir, sched, year) is not None
+    assert dio.YearPlan.load_current(dio_dir, sched, year, verify=True) is None
+    # the next change through dio notices and throws the plan out
+    new_peep.save(dio_dir)
+    assert dio.YearPlan.load_current(dio_dir, sched, year) is None
+    dio.YearPlan.build(dio_dir, sched, year).save(dio_dir)
+    assert dio.YearPlan.load_current(dio_dir, sched, year, verify=True) == dio.YearPlan.build(dio_dir, sched, year)
+
 @hp.given(sched=sched_st(), date=st.dates())
 def test_schedule_should_email_day_idempotence(sched, date):
     fst_res = sched.should_email_day(date)
@@ -125,6 +401,492 @@ def test_schedule_should_not_have_days_with_huge_boluses(fs, peeps, dio_dir, sch
     if curr_recs is not None:
         assert len(curr_recs) < 10
 
+@hp.given(peep=person_st(), date=st.dates())
+def test_calendar_should_contact_matches_rebuilding_the_year(peep, date):
+    sched = dio.DefaultSchedule()
+    hp.assume(sched.should_email_day(date))
+    days_emailed = set(filter(
+        lambda day: dio.get_date_hash(day) % 100 <= 25,
+        dio.days_in_year(date.year)))
+    fst, snd = dio.DefaultSchedule.split_emailed_set(days_emailed)
+    email_list = fst if dio.DefaultSchedule.before_midyear(date) else snd
+    expected = hash(peep) % len(email_list) == email_list.index(date)
+    assert sched.should_contact(peep, date) == expected
+
+def test_calendar_cache_is_bounded():
+    for year in range(2000, 2000 + 2 * dio.default_schedule.CALENDAR_CACHE_SIZE):
+        dio.default_schedule.get_calendar(year)
+    assert dio.default_schedule.get_calendar.cache_info().currsize <= dio.default_schedule.CALENDAR_CACHE_SIZE
+
+@hp.given(year=st.integers(min_value=1900, max_value=2200))
+def test_default_compiled_year_comes_off_the_calendar(year):
+    calendar = dio.default_schedule.get_calendar(year)
+    for sched in (dio.DefaultSchedule(), dio.BalancedSchedule()):
+        # the same days, not a second copy worked out by asking every day of the year
+        assert sched.compile(year).sorted_days is calendar.sorted_days
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=50),
+        sched=any_sched_st(),
+        date=st.dates(min_value=datetime.date(1900, 1, 1), max_value=datetime.date(2200, 1, 1)))
+def test_contacts_for_matches_should_contact(peeps, sched, date):
+    hp.assume(sched.should_email_day(date))
+    expected = [peep for peep in peeps if sched.should_contact(peep, date)]
+    assert sched.contacts_for(peeps, date) == expected
+
+@hp.given(
+        peeps=st.lists(person_st(), min_size=100, max_size=400),
+        new_peep=person_st(),
+        year=st.integers(min_value=1900, max_value=2200))
+@hp.settings(max_examples=20)
+def test_balanced_schedule_evens_out_days(peeps, new_peep, year):
+    sched = dio.BalancedSchedule()
+    year_partition = sched.partition_year(peeps, year)
+    default_partition = dio.DefaultSchedule().partition_year(peeps, year)
+    calendar = dio.default_schedule.get_calendar(year)
+    assert sorted(year_partition) == sorted(calendar.emailing_days)
+    for half in (calendar.fst_half, calendar.snd_half):
+        loads = [len(year_partition[day]) for day in half]
+        default_loads = [len(default_partition.get(day, [])) for day in half]
+        assert sum(loads) == sum(default_loads) == len(peeps)
+        # hash % days leaves days lopsided, slicing never does
+        spread = max(loads) - min(loads)
+        assert spread <= 1
+        assert spread <= max(default_loads) - min(default_loads)
+    for day in list(year_partition)[::5]:
+        assert sched.contacts_for(peeps, day) == year_partition[day]
+        assert sched.contacts_for(dio.Roster.from_people(peeps), day) == year_partition[day]
+    # one more peep bumps a chain of peeps over to days with room, instead of moving every slice boundary.
+    # No small bound holds for every roster, but it's about 4 on average and nowhere near this
+    new_partition = sched.partition_year(peeps + [new_peep], year)
+    for half in (calendar.fst_half, calendar.snd_half):
+        moved = sum(1 for day in half for peep in year_partition[day] if peep not in new_partition[day])
+        assert moved <= 32
+
+class MondaysSchedule(dio.ScheduleABC):
+    """ a custom schedule like the readme tells folks to write, no contact_rule """
+    def should_email_day(self, date):
+        return date.weekday() == 0
+
+    def should_contact(self, person, date):
+        return len(person.name) % 4 == date.day % 4
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=20),
+        sched=st.sampled_from([MondaysSchedule(), dio.DefaultSchedule(), dio.ThreeTimesSchedule()]),
+        date=st.dates(min_value=datetime.date(1900, 1, 1), max_value=datetime.date(2200, 1, 1)))
+@hp.settings(max_examples=30)
+def test_compiled_schedule_matches_predicates(peeps, sched, date):
+    compiled = sched.compile(date.year)
+    assert sched.compile(date.year) is compiled
+    assert compiled.is_emailing_day(date) == sched.should_email_day(date)
+    next_day = date
+    while not sched.should_email_day(next_day):
+        next_day += datetime.timedelta(days=1)
+    assert dio.ScheduleABC.next_emailing_day(sched, date) == next_day
+    year_partition = compiled.partition(peeps)
+    assert sorted(year_partition) == [day for day in dio.days_in_year(date.year) if sched.should_email_day(day)]
+    for day, day_peeps in year_partition.items():
+        assert day_peeps == [peep for peep in peeps if sched.should_contact(peep, day)]
+    assert year_partition == dio.ScheduleABC.partition_year(sched, dio.Roster.from_people(peeps), date.year)
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=30),
+        sched=any_sched_st(),
+        date=st.dates(min_value=datetime.date(1900, 1, 1), max_value=datetime.date(2200, 1, 1)))
+@hp.settings(max_examples=30)
+def test_roster_matches_list_of_people(peeps, sched, date):
+    roster = dio.Roster.from_people(peeps)
+    assert list(roster) == peeps
+    assert [hash(peep) for peep in roster] == [hash(peep) for peep in peeps]
+    for peep in peeps:
+        assert peep.name in roster
+        assert roster.get(peep.name).name == peep.name
+    if sched.should_email_day(date):
+        assert sched.contacts_for(roster, date) == sched.contacts_for(peeps, date)
+    assert sched.partition_year(roster, date.year) == sched.partition_year(peeps, date.year)
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=30),
+        year=st.integers(min_value=1900, max_value=2200))
+@hp.settings(max_examples=10)
+def test_simulate_counts_match_partition_year(peeps, year):
+    roster = dio.Roster.from_people(peeps)
+    schedules = {"default": dio.DefaultSchedule(), "threetimes": dio.ThreeTimesSchedule()}
+    for report in dio.simulate.simulate(roster, schedules, [year], workers=1):
+        year_partition = schedules[report.schedule_name].partition_year(peeps, year)
+        assert report.emailing_days == len(year_partition)
+        assert report.total_contacts == sum(map(len, year_partition.values()))
+        assert sum(report.contact_count_histogram.values()) == len(peeps)
+        contacted = [any(peep is day_peep for day_peeps in year_partition.values() for day_peep in day_peeps)
+                     for peep in peeps]
+        assert report.never_contacted[year] == [peep.name for peep, was_contacted in zip(peeps, contacted)
+                                                if not was_contacted]
+
+def test_roster_snapshot_pickles_as_a_plain_roster(tmp_path):
+    dio_dir = dio.DioDir(str(tmp_path))
+    dio.batch_save(dio_dir, (peep.to_person() for peep in dio.simulate.make_synthetic_roster(50)))
+    dio.Roster.load(dio_dir)
+    snapshot = dio.Roster.load(dio_dir)
+    assert isinstance(snapshot, dio.RosterSnapshot)
+    # what a spawned process pool does to it
+    unpickled = pickle.loads(pickle.dumps(snapshot))
+    assert type(unpickled) is dio.Roster
+    assert list(unpickled) == list(snapshot)
+    assert list(unpickled.hashes) == list(snapshot.hashes)
+    assert all(unpickled.get(peep.name) == peep for peep in snapshot)
+
+def test_simulate_same_answer_in_a_process_pool():
+    roster = dio.simulate.make_synthetic_roster(200)
+    schedules = {"default": dio.DefaultSchedule(), "threetimes": dio.ThreeTimesSchedule()}
+    years = [2019, 2020]
+    assert dio.simulate.simulate(roster, schedules, years, workers=2) == dio.simulate.simulate(roster, schedules, years, workers=1)
+
+@hp.given(
+        sched=any_sched_st(),
+        start=st.dates(min_value=datetime.date(1900, 1, 1), max_value=datetime.date(2200, 1, 1)),
+        num_days=st.integers(min_value=-10, max_value=800))
+def test_emailing_day_queries_match_compiled(sched, start, num_days):
+    end = start + datetime.timedelta(days=num_days)
+    assert sched.next_emailing_day(start) == dio.ScheduleABC.next_emailing_day(sched, start)
+    expected = dio.ScheduleABC.emailing_days_between(sched, start, end)
+    assert sched.emailing_days_between(start, end) == expected
+    assert sched.count_emailing_days(start, end) == len(expected)
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=20),
+        sched=any_sched_st(),
+        year=st.integers(min_value=1, max_value=datetime.MAXYEAR))
+@hp.settings(max_examples=30)
+def test_engines_match_reference(peeps, sched, year):
+    schedule_name = dio.get_schedule_name(sched)
+    assert difftest.diff_days(schedule_name, sched, year) == []
+    expected = difftest.ref_partition(schedule_name, peeps, year)
+    for engine_name in difftest.get_engine_names():
+        if engine_name not in difftest.DISK_ENGINES:
+            actual = difftest.ENGINES[engine_name](sched, peeps, year, None)
+            assert difftest.diff_partitions(expected, actual) == [], engine_name
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=10),
+        sched=any_sched_st(),
+        date=st.dates(min_value=datetime.date(1900, 1, 1), max_value=datetime.date(2200, 12, 31)),
+        dio_dir=dio_dir_st())
+@hp.settings(max_examples=20)
+def test_get_recs_matches_reference(fs, peeps, sched, date, dio_dir):
+    hp.assume(sched.should_email_day(date))
+    for peep in peeps:
+        peep.save(dio_dir)
+    schedule_name = dio.get_schedule_name(sched)
+    expected = difftest.ref_partition(schedule_name, dio.Person.get_all(dio_dir), date.year)[date]
+    assert difftest.get_answer(dio.get_recs(dio_dir, sched, date)) == expected
+    dio.YearPlan.build(dio_dir, sched, date.year).save(dio_dir)
+    assert difftest.get_answer(dio.get_recs(dio_dir, sched, date)) == expected
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), sched=any_sched_st(), date=st.dates(), dio_dir=dio_dir_st())
+@hp.settings(max_examples=20)
+def test_get_recs_same_with_or_without_year_plan(fs, peeps, sched, date, dio_dir):
+    hp.assume(sched.should_email_day(date))
+    for peep in peeps:
+        peep.save(dio_dir)
+    without_plan = dio.get_recs(dio_dir, sched, date)
+    dio.YearPlan.build(dio_dir, sched, date.year).save(dio_dir)
+    with_plan = dio.get_recs(dio_dir, sched, date)
+    assert repr(without_plan) == repr(with_plan)
+    assert all(type(peep) is dio.Person for peep in without_plan)
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), sched=any_sched_st(), date=st.dates(), dio_dir=dio_dir_st())
+@hp.settings(max_examples=20)
+def test_get_recs_with_year_plan_reads_just_the_day(fs, peeps, sched, date, dio_dir):
+    hp.assume(sched.should_email_day(date))
+    for peep in peeps:
+        peep.save(dio_dir)
+    dio.YearPlan.build(dio_dir, sched, date.year).save(dio_dir)
+    dio.profiling.reset()
+    dio.profiling.enable()
+    try:
+        dio.get_recs(dio_dir, sched, date)
+    finally:
+        dio.profiling.disable()
+    report = dio.profiling.get_report()
+    # the snapshot, plan.json and the day's file
+    assert report["counters"].get("files_opened", 0) <= 3
+    assert report["counters"].get("people_evaluated", 0) == 0
+    dio.profiling.reset()
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=20),
+        sched=any_sched_st(),
+        year=st.integers(min_value=1900, max_value=2200))
+@hp.settings(max_examples=20)
+def test_partition_year_matches_should_contact(peeps, sched, year):
+    year_plan = sched.partition_year(peeps, year)
+    for curr_day in dio.days_in_year(year):
+        if sched.should_email_day(curr_day):
+            expected = [peep for peep in peeps if sched.should_contact(peep, curr_day)]
+            assert year_plan[curr_day] == expected
+        else:
+            assert curr_day not in year_plan
+
+@hp.given(
+        peeps=st.lists(person_st(), max_size=50),
+        sched=any_sched_st(),
+        year=st.integers(min_value=1900, max_value=2200))
+@hp.settings(max_examples=30)
+def test_vectorized_partition_year_matches_scalar(peeps, sched, year):
+    pytest.importorskip("numpy")
+    assert dio.vectorized.partition_year(sched, peeps, year) == sched.partition_year(peeps, year)
+    days, matrix = dio.vectorized.contact_matrix(sched, peeps, year)
+    for day, row in zip(days, matrix):
+        assert [peep for peep, contacted in zip(peeps, row) if contacted] == [
+                peep for peep in peeps if sched.should_contact(peep, day)]
+
+class FakeSMTP(object):
+    """ stand-in for smtplib.SMTP that remembers everything, and hangs up when told to """
+    logins = []
+    sent = []
+    hang_ups = 0
+
+    def __init__(self, url, port):
+        self.url = url
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        FakeSMTP.logins.append(username)
+
+    def send_message(self, msg_obj):
+        if FakeSMTP.hang_ups > 0:
+            FakeSMTP.hang_ups -= 1
+            raise smtplib.SMTPServerDisconnected("bye")
+        FakeSMTP.sent.append((self.url, msg_obj["Subject"]))
+
+    def quit(self):
+        pass
+
+@pytest.fixture
+def fake_smtp():
+    FakeSMTP.logins, FakeSMTP.sent, FakeSMTP.hang_ups = [], [], 0
+    return FakeSMTP
+
+@hp.given(settings=settings_st(username=st.emails(), dest_email=st.emails()), dates=st.lists(st.dates(), min_size=1, max_size=5))
+def test_mailer_reuses_session_and_reconnects(fake_smtp, settings, dates):
+    fake_smtp.logins, fake_smtp.sent, fake_smtp.hang_ups = [], [], 1
+    with dio.Mailer(settings, smtp_factory=fake_smtp) as mailer:
+        mailer.send_all(dio.make_message("hi", date, settings) for date in dates)
+    assert len(fake_smtp.sent) == len(dates)
+    # the first session got hung up on once, the second one did the rest
+    assert len(fake_smtp.logins) == 2
+
+@hp.given(settings_list=st.lists(settings_st(username=st.emails(), dest_email=st.emails()), min_size=1, max_size=5), date=st.dates())
+def test_deliver_all_one_session_per_settings(fake_smtp, settings_list, date):
+    fake_smtp.logins, fake_smtp.sent, fake_smtp.hang_ups = [], [], 0
+    deliveries = [(settings, dio.make_message("hi", date, settings)) for settings in settings_list * 2]
+    res = dio.deliver_all(deliveries, max_connections=2, smtp_factory=fake_smtp)
+    assert res == [None] * len(deliveries)
+    assert len(fake_smtp.sent) == len(deliveries)
+    assert len(fake_smtp.logins) == len(set(dio.mailer.get_settings_key(settings) for settings in settings_list))
+
+@hp.given(num_sent=st.integers(min_value=0, max_value=4), date=st.dates())
+def test_deliver_all_failures_are_per_message(fake_smtp, num_sent, date):
+    settings = dio.Settings(smtp_username="a@b.c", smtp_password="", smtp_dest_email="a@b.c", smtp_url="x", smtp_port=0)
+    fake_smtp.logins, fake_smtp.sent, fake_smtp.hang_ups = [], [], 0
+    class FailingSMTP(fake_smtp):
+        def send_message(self, msg_obj):
+            if len(fake_smtp.sent) == num_sent:
+                raise smtplib.SMTPDataError(554, "nope")
+            super().send_message(msg_obj)
+    deliveries = [(settings, dio.make_message("hi", date, settings)) for _ in range(num_sent + 2)]
+    res = dio.deliver_all(deliveries, smtp_factory=FailingSMTP)
+    # the ones that went out say so, only the rest get tried again
+    assert res[:num_sent] == [None] * num_sent
+    assert all(isinstance(err, smtplib.SMTPDataError) for err in res[num_sent:])
+    assert len(fake_smtp.sent) == num_sent
+
+@hp.given(peeps=st.lists(person_st(), max_size=10), dio_dir=dio_dir_st(), sched=any_sched_st(), date=st.dates())
+def test_profiling_counts_people_evaluated(fs, peeps, dio_dir, sched, date):
+    hp.assume(sched.should_email_day(date))
+    for peep in peeps:
+        peep.save(dio_dir)
+    dio.profiling.reset()
+    dio.profiling.enable()
+    try:
+        dio.get_recs(dio_dir, sched, date)
+    finally:
+        dio.profiling.disable()
+    report = dio.profiling.get_report()
+    assert report["spans"]["get_recs"]["calls"] == 1
+    assert report["counters"].get("people_evaluated", 0) == len(dio.Person.get_all(dio_dir))
+    dio.profiling.reset()
+
+def test_profiling_off_costs_nothing():
+    roster = [dio.Person(name="a")]
+    assert dio.profiling.counted("people_evaluated", roster) is roster
+    dio.profiling.count("files_opened")
+    with dio.profiling.span("nothing"):
+        pass
+    assert dio.profiling.get_report() == {"spans": {}, "counters": {}}
+
+def test_daemon_sends_once_a_day_and_answers_dryrecs(tmp_path, fake_smtp):
+    dirnames = [str(tmp_path / "fst"), str(tmp_path / "snd")]
+    daemon = dio.daemon.RecsDaemon(dirnames, dio.DefaultSchedule(), smtp_factory=fake_smtp)
+    date = datetime.date(2019, 1, 4)
+    for dirname in dirnames:
+        dio_dir = dio.DioDir(dirname)
+        dio_dir.set_settings(dio.Settings("me@example.com", "pwd", "me@example.com"))
+        for peep_idx in range(20):
+            dio.Person(name="peep{}".format(peep_idx), salt=str(int(1e30) + peep_idx)).save(dio_dir)
+    daemon.refresh_all()
+    for tenant in daemon.tenants.values():
+        assert daemon.get_recs(tenant, date) == dio.get_recs(tenant.dio_dir, dio.DefaultSchedule(), date)
+    assert daemon.fire_due(datetime.datetime(2019, 1, 4, 9)) == []
+    for future in daemon.fire_due(datetime.datetime(2019, 1, 4, 15)):
+        future.result()
+    assert daemon.fire_due(datetime.datetime(2019, 1, 4, 16)) == []
+    assert len(fake_smtp.sent) == 2
+    server = daemon.make_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        daemon_url = "http://127.0.0.1:{}".format(server.server_address[1])
+        message = dio.daemon.ask_daemon(daemon_url, dio.DioDir(dirnames[0]), date)
+        assert message == daemon.get_message(daemon.tenants[dirnames[0]], date)
+        assert dio.daemon.ask_daemon(daemon_url, dio.DioDir(str(tmp_path / "nope")), date) is None
+    finally:
+        server.shutdown()
+
+def test_daemon_survives_bad_tenants_and_retries_sends(tmp_path, fake_smtp, capsys):
+    dirnames = [str(tmp_path / "fst"), str(tmp_path / "snd")]
+    # sent markers get pruned against the real today
+    date = datetime.date.today()
+
+    def at_hour(days, hour):
+        return datetime.datetime.combine(date + datetime.timedelta(days=days), datetime.time(hour))
+
+    for dirname in dirnames:
+        dio_dir = dio.DioDir(dirname)
+        dio_dir.set_settings(dio.Settings("me@example.com", "pwd", "me@example.com"))
+        for peep_idx in range(20):
+            dio.Person(name="peep{}".format(peep_idx), salt=str(int(1e30) + peep_idx)).save(dio_dir)
+    daemon = dio.daemon.RecsDaemon(dirnames, dio.DefaultSchedule(), smtp_factory=fake_smtp)
+    daemon.refresh_all()
+    bad_tenant = daemon.tenants[dirnames[0]]
+    good_recs = daemon.get_recs(bad_tenant, date)
+    # a mangled peep.json, then the whole dio dir gone
+    peep_dirname = dio.Person(name="peep0", salt=str(int(1e30))).get_dir(bad_tenant.dio_dir)
+    with open(dio.Person.get_filename(peep_dirname), "w") as peep_file:
+        peep_file.write("{not json")
+    dio.DioDir(dirnames[0]).bump_roster_version()
+    daemon.refresh_all()
+    shutil.rmtree(dirnames[0])
+    daemon.refresh_all()
+    assert daemon.get_recs(bad_tenant, date) == good_recs
+    assert "couldn't read {}".format(dirnames[0]) in capsys.readouterr().err
+    # the server's down, so nothing counts as sent and the next poll tries again
+    good_tenant = daemon.tenants[dirnames[1]]
+    fake_smtp.hang_ups = 100
+    futures = daemon.fire_due(at_hour(0, 15))
+    assert len(futures) == 2
+    assert all(future.exception() is not None for future in futures)
+    assert good_tenant.last_sent is None
+    fake_smtp.hang_ups = 0
+    for future in daemon.fire_due(at_hour(0, 16)):
+        future.exception()
+    assert good_tenant.last_sent == date
+    assert len(fake_smtp.sent) == 1
+    # restarting late sends today's only if they didn't go out
+    restarted = dio.daemon.RecsDaemon(dirnames[1:], dio.DefaultSchedule(), smtp_factory=fake_smtp)
+    restarted.refresh_all()
+    assert restarted.fire_due(at_hour(0, 17)) == []
+    for future in restarted.fire_due(at_hour(1, 17)):
+        future.result()
+    assert len(fake_smtp.sent) == 2
+
+def test_fan_out_matches_get_recs_and_survives_a_bad_dir(tmp_path, fake_smtp):
+    # sent markers get pruned against the real today
+    date = datetime.date.today()
+    for dirname, username in [("fst", "a@example.com"), ("snd", "a@example.com"), ("thd", "b@example.com")]:
+        dio_dir = dio.DioDir(str(tmp_path / dirname))
+        dio_dir.set_settings(dio.Settings(username, "pwd", username))
+        for peep_idx in range(20):
+            dio.Person(name="peep{}".format(peep_idx), salt=str(int(1e30) + peep_idx)).save(dio_dir)
+    with open(dio.DioDir(str(tmp_path / "thd")).get_settings_filename(), "w") as settings_file:
+        settings_file.write("not json")
+    dirnames = dio.fanout.expand_dirnames([str(tmp_path / "*"), str(tmp_path / "typo")])
+    assert [os.path.basename(dirname) for dirname in dirnames] == ["fst", "snd", "thd", "typo"]
+    results = dio.fanout.fan_out(dirnames, "default", date, workers=2)
+    assert results[2].error is not None
+    assert results[3].error == "No such dio dir"
+    assert not os.path.exists(str(tmp_path / "typo"))
+    for res in results[:2]:
+        dio_dir = dio.DioDir(res.dirname)
+        expected = dio.get_recs(dio_dir, dio.DefaultSchedule(), date)
+        assert res.message == dio.recs_to_message(expected, dio.get_next_emailing_day(dio_dir, dio.DefaultSchedule(), date))
+    to_flush = dio.fanout.spool_results(results, date)
+    assert [res.spooled for res in results] == [True, True, None, None]
+    assert fake_smtp.sent == []
+    dio.profiling.reset()
+    dio.profiling.enable()
+    try:
+        dio.fanout.flush_results(to_flush, date, smtp_factory=fake_smtp)
+    finally:
+        dio.profiling.disable()
+    assert dio.profiling.get_report()["spans"]["send_message"]["calls"] == 2
+    dio.profiling.reset()
+    assert [res.sent for res in results] == [True, True, False, False]
+    # each dio dir's spool remembers, so doing it again doesn't email anybody twice
+    again = dio.fanout.fan_out(dirnames[:2], "default", date, workers=1)
+    dio.fanout.flush_results(dio.fanout.spool_results(again, date), date, smtp_factory=fake_smtp)
+    assert [(res.spooled, res.sent) for res in again] == [(False, False), (False, False)]
+    assert len(fake_smtp.sent) == 2
+    assert "spooled or emailed already" in dio.fanout.format_summary(again)
+
+def test_spool_sends_each_date_once(tmp_path, fake_smtp):
+    dio_dir = dio.DioDir(str(tmp_path))
+    settings = dio.Settings("me@example.com", "pwd", "me@example.com")
+    # recent, old sent markers get cleaned up
+    today = datetime.datetime.now().date()
+    dates = [today, today - datetime.timedelta(days=1)]
+    for date in dates:
+        assert dio.spool.spool_message(dio_dir, dio.make_message("hi", date, settings), date)
+        assert not dio.spool.spool_message(dio_dir, dio.make_message("hi again", date, settings), date)
+    # hangs up more than the mailer and flush retry put together
+    fake_smtp.hang_ups = 100
+    sleeps = []
+    res = dio.spool.flush(dio_dir, settings, retries=2, backoff_secs=1.0, sleep=sleeps.append, smtp_factory=fake_smtp)
+    assert res.sent == [] and res.pending == sorted(dates) and res.error is not None
+    assert sleeps == [1.0, 2.0]
+    fake_smtp.hang_ups = 0
+    res = dio.spool.flush(dio_dir, settings, smtp_factory=fake_smtp)
+    assert res.sent == sorted(dates) and res.pending == [] and res.error is None
+    assert [subject for _, subject in fake_smtp.sent] == ["Diogenes | {}".format(date) for date in sorted(dates)]
+    assert not dio.spool.spool_message(dio_dir, dio.make_message("hi", dates[0], settings), dates[0])
+    assert dio.spool.flush(dio_dir, settings, smtp_factory=fake_smtp).sent == []
+    assert len(fake_smtp.sent) == len(dates)
+
+def test_cli_add_skips_email_and_cron_imports(tmp_path):
+    check_imports = ("import runpy, sys; sys.argv = ['dio', 'add', 'bob']\n"
+                     "try: runpy.run_path('diocli.py', run_name='__main__')\n"
+                     "except SystemExit: pass\n"
+                     "print(' '.join(sorted(sys.modules)))")
+    proc = subprocess.run([sys.executable, "-c", check_imports],
+                          env=dict(os.environ, HOME=str(tmp_path)),
+                          cwd=os.path.dirname(os.path.abspath(__file__)),
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True,
+                          check=True)
+    imported = set(proc.stdout.splitlines()[-1].split())
+    assert "dio.person" in imported
+    assert not imported & {"smtplib", "crontab", "email.message", "http.server", "dio.mailer", "dio.daemon"}
+    assert os.path.isdir(str(tmp_path / ".diogenes" / "peep_bob"))
+
+def test_cli_schedule_names_match_schedules():
+    import diocli
+    assert diocli.SCHEDULE_NAMES == sorted(dio.SCHEDULES)
+
 @hp.given(peep=person_st(), dio_dir=dio_dir_st())
 def test_add_person_idempotence(fs, peep, dio_dir):
     peep.save(dio_dir)